@@ -0,0 +1,228 @@
+"""
+LLM latency benchmark for the real call paths.
+
+Drives direction_assistant.call_llm, my_plans.generate_plan_with_ai and
+my_submissions.call_language_model against the local mock server (or any
+OpenAI-compatible --base-url) and reports time to first token, tokens/s,
+end-to-end latency and the time spent rendering between chunks:
+
+    python -m benchmarks.llm_latency --iterations 20 --concurrency 4 --tokens 800
+    python -m benchmarks.llm_latency --json baseline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_dashscope import MockConfig, start_server
+
+TOPIC = "肝炎的预防"
+
+
+@dataclass
+class Record:
+    start: float = 0.0
+    first: float = None
+    last: float = None
+    end: float = None
+    chunks: int = 0
+    render: float = 0.0  # 调用方在两个分块之间占用的时间（累积字符串、刷新页面）
+    usage: dict = None
+    error: str = None
+
+
+@dataclass
+class PathReport:
+    path: str
+    runs: int
+    errors: int
+    ttft_p50: float = None
+    ttft_p95: float = None
+    e2e_p50: float = None
+    e2e_p95: float = None
+    tokens_per_s_p50: float = None
+    render_overhead_p50: float = None
+    render_overhead_p95: float = None
+    error_samples: list = field(default_factory=list)
+
+
+_current = threading.local()
+
+
+class TimedStream:
+    """
+    Wraps a ChatStream and records chunk timings into the current thread's Record.
+    """
+
+    def __init__(self, stream, record):
+        self.stream = stream
+        self.record = record
+
+    @property
+    def usage(self):
+        return self.stream.usage
+
+    def __iter__(self):
+        record = self.record
+        for chunk in self.stream:
+            now = time.perf_counter()
+            if record.first is None:
+                record.first = now
+            record.chunks += 1
+            yield chunk
+            record.render += time.perf_counter() - now
+        record.last = time.perf_counter()
+        record.usage = self.stream.usage
+
+
+def _instrument(module):
+    original = module.stream_chat
+
+    def timed_stream_chat(*args, **kwargs):
+        return TimedStream(original(*args, **kwargs), _current.record)
+
+    module.stream_chat = timed_stream_chat
+
+
+def _prepare_environment(base_url):
+    os.environ["DASHSCOPE_BASE_URL"] = base_url
+    os.environ.setdefault("DASHSCOPE_API_KEY", "mock-key")
+    if not os.getenv("DATABASE_URL"):
+        # 使用临时 SQLite 库承载响应缓存等表，避免触碰生产数据库
+        path = os.path.join(tempfile.mkdtemp(prefix="llm-bench-"), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+
+
+def _load_paths():
+    from models.database import engine
+    from models.project_models import Base
+    from modules import direction_assistant, my_plans, my_submissions
+    from utils.stream_renderer import render_stream
+    if engine.dialect.name == "sqlite":
+        Base.metadata.create_all(bind=engine)
+    for module in (direction_assistant, my_plans, my_submissions):
+        _instrument(module)
+
+    system = [{"role": "system", "content": "你是医学研究领域的专家，特别擅长护理方面的科研选题。"}]
+    return {
+        "direction_assistant.call_llm":
+            lambda i: direction_assistant.call_llm(f"{TOPIC} #{i}", system),
+        "my_plans.generate_plan_with_ai":
+            lambda i: render_stream(my_plans.generate_plan_with_ai(f"{TOPIC}的社区护理干预研究 #{i}")),
+        "my_submissions.call_language_model":
+            lambda i: render_stream(my_submissions.call_language_model(f"请分析以下参考文稿的写作风格：#{i}")),
+    }
+
+
+def _run_once(fn, i):
+    record = Record(start=time.perf_counter())
+    _current.record = record
+    try:
+        fn(i)
+    except Exception as e:
+        record.error = f"{type(e).__name__}: {e}"
+    record.end = time.perf_counter()
+    return record
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(path, records):
+    ok = [r for r in records if r.error is None and r.first is not None]
+    ttft = [r.first - r.start for r in ok]
+    e2e = [r.end - r.start for r in ok]
+    render = [r.render + (r.end - r.last) for r in ok if r.last is not None]
+    rates = []
+    for r in ok:
+        tokens = (r.usage or {}).get("completion_tokens") or r.chunks
+        if r.last and r.last > r.first:
+            rates.append(tokens / (r.last - r.first))
+    return PathReport(
+        path=path,
+        runs=len(records),
+        errors=len(records) - len(ok),
+        ttft_p50=_percentile(ttft, 50),
+        ttft_p95=_percentile(ttft, 95),
+        e2e_p50=_percentile(e2e, 50),
+        e2e_p95=_percentile(e2e, 95),
+        tokens_per_s_p50=statistics.median(rates) if rates else None,
+        render_overhead_p50=_percentile(render, 50),
+        render_overhead_p95=_percentile(render, 95),
+        error_samples=sorted({r.error for r in records if r.error})[:3],
+    )
+
+
+def run_benchmark(paths, iterations, concurrency, warmup=1):
+    reports = []
+    for name, fn in paths.items():
+        # 预热：建立连接池、加载模块，不计入结果
+        for i in range(warmup):
+            _run_once(fn, -1 - i)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            records = list(pool.map(lambda i: _run_once(fn, i), range(iterations)))
+        reports.append(summarize(name, records))
+    return reports
+
+
+def _fmt(value, scale=1000.0, unit="ms"):
+    return "-" if value is None else f"{value * scale:.1f}{unit}"
+
+
+def print_reports(reports):
+    header = f"{'path':<38}{'runs':>6}{'err':>5}{'ttft p50':>11}{'ttft p95':>11}{'e2e p50':>11}{'e2e p95':>11}{'tok/s':>9}{'render p50':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(f"{r.path:<38}{r.runs:>6}{r.errors:>5}{_fmt(r.ttft_p50):>11}{_fmt(r.ttft_p95):>11}"
+              f"{_fmt(r.e2e_p50):>11}{_fmt(r.e2e_p95):>11}{_fmt(r.tokens_per_s_p50, 1, ''):>9}"
+              f"{_fmt(r.render_overhead_p50):>12}")
+        for sample in r.error_samples:
+            print(f"    error: {sample}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM 调用路径延迟基准测试")
+    parser.add_argument("--base-url", help="已有的 OpenAI 兼容服务地址；不指定时在进程内启动模拟服务")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--paths", nargs="*", help="只运行指定的调用路径")
+    parser.add_argument("--tokens", type=int, default=MockConfig.tokens)
+    parser.add_argument("--ttft", type=float, default=MockConfig.ttft)
+    parser.add_argument("--rate", type=float, default=MockConfig.rate)
+    parser.add_argument("--fail-rate", type=float, default=MockConfig.fail_rate)
+    parser.add_argument("--json", help="将结果写入 JSON 文件，便于与基线对比")
+    args = parser.parse_args()
+
+    base_url = args.base_url
+    if not base_url:
+        config = MockConfig(tokens=args.tokens, ttft=args.ttft, rate=args.rate, fail_rate=args.fail_rate)
+        _, base_url = start_server(config)
+    _prepare_environment(base_url)
+
+    paths = _load_paths()
+    if args.paths:
+        paths = {name: fn for name, fn in paths.items() if name in args.paths}
+    reports = run_benchmark(paths, args.iterations, args.concurrency, args.warmup)
+    print_reports(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "reports": [asdict(r) for r in reports]}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+A local stand-in for the DashScope OpenAI-compatible endpoint.
+
+Serves POST .../chat/completions with deterministic tokens, streamed at a
+configurable rate, and can inject failures so the gateway's retry path can be
+exercised. Point the app at it with DASHSCOPE_BASE_URL:
+
+    python -m benchmarks.mock_dashscope --port 8900 --tokens 400 --rate 50
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8900/v1 streamlit run main.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 模拟输出使用的中英文词表
+VOCABULARY = [
+    "护理", "干预", "患者", "随机", "对照", "研究", "结局", "指标", "队列", "评估",
+    "nursing", "intervention", "outcome", "cohort", "trial", "PICOS", "，", "。", "\n",
+]
+
+
+@dataclass
+class MockConfig:
+    tokens: int = 200  # 每次回答的 token 数
+    ttft: float = 0.3  # 首个 token 前的等待秒数
+    rate: float = 50.0  # 每秒输出的 token 数，0 表示不限速
+    fail_rate: float = 0.0  # 以该概率直接返回 fail_status
+    fail_status: int = 429
+    drop_rate: float = 0.0  # 以该概率在流的中途断开连接
+    seed: int = 0
+
+
+def generate_tokens(messages, count, seed=0):
+    """
+    Return ``count`` deterministic tokens for a list of messages.
+    """
+    digest = hashlib.sha256(json.dumps([messages, seed], ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    rng = random.Random(digest.hexdigest())
+    return [rng.choice(VOCABULARY) for _ in range(count)]
+
+
+def _chunk(model, content=None, usage=None):
+    choices = [] if content is None else [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+    body = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": model, "choices": choices}
+    if usage is not None:
+        body["usage"] = usage
+    return body
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+    lock = threading.Lock()
+    requests_served = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_event(self, data):
+        payload = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.config
+        with MockHandler.lock:
+            MockHandler.requests_served += 1
+        rng = random.Random()
+
+        if rng.random() < config.fail_rate:
+            self._send_json(config.fail_status, {"error": {"message": "mock failure", "code": config.fail_status}})
+            return
+
+        model = request.get("model", "qwen-plus")
+        messages = request.get("messages", [])
+        count = min(config.tokens, request.get("max_tokens") or config.tokens)
+        tokens = generate_tokens(messages, count, config.seed)
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            tokens = [json.dumps({"synonyms": tokens[:3], "P": tokens[:1], "I": tokens[1:2], "C": tokens[2:3],
+                                  "O": tokens[3:4], "S": tokens[4:5]}, ensure_ascii=False)]
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+
+        time.sleep(config.ttft)
+        if not request.get("stream"):
+            if config.rate:
+                time.sleep(len(tokens) / config.rate)
+            self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        drop_at = rng.randrange(1, len(tokens)) if len(tokens) > 1 and rng.random() < config.drop_rate else None
+        interval = 1.0 / config.rate if config.rate else 0
+        try:
+            for i, token in enumerate(tokens):
+                if i == drop_at:
+                    self.close_connection = True
+                    return
+                self._write_event(json.dumps(_chunk(model, token), ensure_ascii=False))
+                if interval:
+                    time.sleep(interval)
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._write_event(json.dumps(_chunk(model, usage=usage)))
+            self._write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """
+    Start the mock server on a daemon thread.
+
+    :param config: A MockConfig, defaults to MockConfig().
+    :param port: The port to listen on, 0 picks a free one.
+    :return: (server, base_url) to pass as DASHSCOPE_BASE_URL.
+    """
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-dashscope", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DashScope 兼容的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--tokens", type=int, default=MockConfig.tokens)
+    parser.add_argument("--ttft", type=float, default=MockConfig.ttft)
+    parser.add_argument("--rate", type=float, default=MockConfig.rate)
+    parser.add_argument("--fail-rate", type=float, default=MockConfig.fail_rate)
+    parser.add_argument("--fail-status", type=int, default=MockConfig.fail_status)
+    parser.add_argument("--drop-rate", type=float, default=MockConfig.drop_rate)
+    parser.add_argument("--seed", type=int, default=MockConfig.seed)
+    args = parser.parse_args()
+    config = MockConfig(args.tokens, args.ttft, args.rate, args.fail_rate, args.fail_status, args.drop_rate, args.seed)
+    server, base_url = start_server(config, args.host, args.port)
+    print(f"模拟服务已启动: DASHSCOPE_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
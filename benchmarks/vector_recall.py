@@ -0,0 +1,187 @@
+"""
+Recall / memory / throughput benchmark for the vector store encodings.
+
+Compares the float16 segment scan, int8 scalar quantization and product
+quantization (with and without full-precision re-scoring from the float16
+segments) against exact float32 search, and hnswlib when it is installed:
+
+    python -m benchmarks.vector_recall --rows 100000 --queries 200 --k 10
+    python -m benchmarks.vector_recall --store data/rag --json recall.json
+
+Synthetic vectors are drawn from a mixture of Gaussians and L2-normalised,
+which is closer to sentence embeddings than uniform noise; ``--store``
+benchmarks the vectors of an existing RAG index instead.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.quantization import QuantizedIndex
+from utils.segment_store import SegmentStore
+
+
+@dataclass
+class MethodReport:
+    method: str
+    recall: float
+    bytes_per_vector: float
+    compression: float  # 相对 float32 的压缩倍数
+    qps: float
+    build_s: float
+
+
+def synthetic_vectors(rows, dim, clusters=64, rank=48, seed=0):
+    # 句向量集中在低维子空间中：簇中心 + 低秩主题方向 + 少量各向同性噪声
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((rank, dim)).astype(np.float32)
+    centers = rng.standard_normal((clusters, rank)).astype(np.float32)
+    latent = centers[rng.integers(0, clusters, rows)] + 0.7 * rng.standard_normal((rows, rank)).astype(np.float32)
+    vectors = latent @ basis + 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def store_vectors(directory):
+    store = SegmentStore(directory)
+    labels = np.flatnonzero(store.alive)
+    return store.vectors(labels)
+
+
+def make_queries(vectors, count, seed=1):
+    # 在库内向量上加噪声作为查询，模拟相近但不相同的提问
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), count, replace=False)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def exact_top_k(matrix, queries, k):
+    return [np.argsort(-(matrix @ query))[:k] for query in queries]
+
+
+def recall_at_k(found, truth, k):
+    return float(np.mean([len(set(f[:k].tolist()) & set(t[:k].tolist())) / k for f, t in zip(found, truth)]))
+
+
+def _timed(search, queries):
+    start = time.perf_counter()
+    found = [search(query) for query in queries]
+    return found, len(queries) / (time.perf_counter() - start)
+
+
+def run_benchmark(vectors, queries, k, rescore_factor=4, pq_subspaces=None):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1]
+    full_bytes = dim * 4
+    reports = []
+
+    truth, qps = _timed(lambda query: np.argsort(-(vectors @ query))[:k], queries)
+    reports.append(MethodReport("exact float32", 1.0, full_bytes, 1.0, qps, 0.0))
+
+    # 与线上相同，float16 向量写入分段存储并通过内存映射扫描
+    directory = tempfile.mkdtemp(prefix="vector-recall-")
+    store = halves = None
+    try:
+        start = time.perf_counter()
+        store = SegmentStore(directory)
+        for block in range(0, len(vectors), 65536):
+            ids = [str(i) for i in range(block, min(block + 65536, len(vectors)))]
+            store.append(ids, vectors[block:block + len(ids)], [{} for _ in ids])
+        build = time.perf_counter() - start
+        found, qps = _timed(lambda query: store.search(query, k)[0], queries)
+        reports.append(MethodReport("float16 segment scan", recall_at_k(found, truth, k), dim * 2, 2.0, qps, build))
+        halves = store.vectors  # 重新打分时按 label 读取的全精度向量
+        reports.extend(_quantized_reports(vectors, queries, truth, k, halves, rescore_factor, pq_subspaces))
+    finally:
+        # 先释放对内存映射分段的引用再删除目录
+        store = halves = None
+        shutil.rmtree(directory, ignore_errors=True)
+
+    try:
+        import hnswlib
+    except ImportError:
+        hnswlib = None
+    if hnswlib is not None:
+        from modules.rag_system import RAG_HNSW_M, HnswlibIndex
+
+        start = time.perf_counter()
+        index = HnswlibIndex(dim, capacity=len(vectors))
+        index.add(np.arange(len(vectors)), vectors)
+        build = time.perf_counter() - start
+        found, qps = _timed(lambda query: index.search(query, k)[0], queries)
+        # hnswlib 在内存中保存 float32 原向量，外加第 0 层每个节点 2M 个 4 字节的邻居 id
+        size = full_bytes + 2 * RAG_HNSW_M * 4
+        reports.append(MethodReport("hnswlib", recall_at_k(found, truth, k), size, full_bytes / size, qps, build))
+    return reports
+
+
+def _quantized_reports(vectors, queries, truth, k, full_vectors, rescore_factor, pq_subspaces):
+    dim = vectors.shape[1]
+    full_bytes = dim * 4
+    reports = []
+    configs = [("int8", None)] + [("pq", m) for m in (pq_subspaces or [dim // 4, dim // 8])]
+    for kind, m in configs:
+        start = time.perf_counter()
+        index = QuantizedIndex(dim, kind, **({"m": m} if m else {}))
+        for block in range(0, len(vectors), 65536):
+            labels = np.arange(block, min(block + 65536, len(vectors)))
+            index.add(labels, vectors[labels])
+        build = time.perf_counter() - start
+        name = f"{kind}" if kind == "int8" else f"pq m={index.quantizer.m}"
+        size = index.bytes_per_vector()
+
+        found, qps = _timed(lambda query: index.search(query, k)[0], queries)
+        reports.append(MethodReport(f"{name} ADC", recall_at_k(found, truth, k), size, full_bytes / size, qps, build))
+
+        def rescored(query):
+            labels = index.search(query, k * rescore_factor)[0]
+            scores = full_vectors(labels) @ query
+            return labels[np.argsort(-scores)[:k]]
+
+        found, qps = _timed(rescored, queries)
+        reports.append(MethodReport(f"{name} + rescore x{rescore_factor}", recall_at_k(found, truth, k), size,
+                                    full_bytes / size, qps, build))
+    return reports
+
+
+def print_reports(reports, k):
+    header = f"{'method':<28}{f'recall@{k}':>10}{'bytes/vec':>11}{'vs f32':>8}{'QPS':>10}{'build s':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(f"{r.method:<28}{r.recall:>10.3f}{r.bytes_per_vector:>11.0f}{r.compression:>7.1f}x"
+              f"{r.qps:>10.1f}{r.build_s:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量量化召回率与吞吐基准测试")
+    parser.add_argument("--rows", type=int, default=100000, help="合成向量数")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--store", help="使用已有 RAG 索引目录中的向量代替合成数据")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--pq-m", type=int, nargs="*", help="PQ 子空间数，默认 dim/4 与 dim/8")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    vectors = store_vectors(args.store) if args.store else synthetic_vectors(args.rows, args.dim)
+    queries = make_queries(vectors, min(args.queries, len(vectors)))
+    reports = run_benchmark(vectors, queries, args.k, args.rescore_factor, args.pq_m)
+    print(f"{len(vectors)} 个 {vectors.shape[1]} 维向量，{len(queries)} 个查询")
+    print_reports(reports, args.k)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "reports": [asdict(r) for r in reports]}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
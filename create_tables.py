@@ -24,7 +24,17 @@ def create_tables():
         pm.Writing,          # 添加 Writing 表
         pm.Manuscript,       # 新增 Manuscript 表
         pm.ReferencePaper,   # 新增 ReferencePaper 表
-        pm.ReviewerComment   # 新增 ReviewerComment 表
+        pm.ReviewerComment,  # 新增 ReviewerComment 表
+        pm.LLMResponseCache,     # 新增 LLMResponseCache 表
+        pm.TopicThread,          # 新增 TopicThread 表（须先于引用它的对话消息与摘要表创建）
+        pm.ConversationMessage,  # 新增 ConversationMessage 表
+        pm.ConversationSummary,  # 新增 ConversationSummary 表
+        pm.Article,              # 新增 Article 表
+        pm.PubMedQueryCache,     # 新增 PubMedQueryCache 表
+        pm.EmbeddingCacheEntry,  # 新增 EmbeddingCacheEntry 表
+        pm.IngestionDeadLetter,  # 新增 IngestionDeadLetter 表
+        pm.IndexWatermark,       # 新增 IndexWatermark 表
+        pm.IndexTombstone        # 新增 IndexTombstone 表
     ]
     
     for table in tables_to_create:
@@ -38,4 +48,7 @@ def create_tables():
             logging.info(f"数据表 {table.__tablename__} 已存在，跳过创建。")
 
 if __name__ == '__main__':
-    create_tables()
\ No newline at end of file
+    create_tables()
+    # 对已有的表补齐索引等结构变更，见 models/migrations.py
+    from models.migrations import run_migrations
+    run_migrations()
\ No newline at end of file
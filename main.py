@@ -1,81 +1,67 @@
 import streamlit as st
-import psycopg2
 from dotenv import load_dotenv
-import os
 import bcrypt
 import importlib
 import json
 from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from models.database import SessionLocal
+from models.project_models import User, TopicThread
 
 # 加载环境变量
 load_dotenv()
 
-# 从环境变量获取数据库连接 URL
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-# 数据库连接函数
-def get_db_connection():
-    try:
-        return psycopg2.connect(DATABASE_URL)
-    except psycopg2.Error as e:
-        st.error(f"数据库连接失败: {e}")
-        return None
-
 # 注册函数
 def register(username, password):
     if not username or not password:
         st.error("用户名和密码不能为空")
         return
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-            existing_user = cursor.fetchone()
-            if existing_user:
-                st.error("该用户名已被注册，请选择其他用户名。")
-            else:
-                hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-                cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed))
-                connection.commit()
-                st.success("注册成功，请登录。")
-                st.session_state['rerun_flag'] = True
-        except psycopg2.Error as e:
-            st.error(f"注册失败: {e}")
-        finally:
-            connection.close()
+    session = SessionLocal()
+    try:
+        existing_user = session.query(User.id).filter(User.username == username).first()
+        if existing_user:
+            st.error("该用户名已被注册，请选择其他用户名。")
+        else:
+            hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            session.add(User(username=username, password=hashed))
+            session.commit()
+            st.success("注册成功，请登录。")
+            st.session_state['rerun_flag'] = True
+    except SQLAlchemyError as e:
+        session.rollback()
+        st.error(f"注册失败: {e}")
+    finally:
+        session.close()
 
 # 登录函数
 def login(username, password):
     if not username or not password:
         st.error("用户名和密码不能为空")
         return False
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT password FROM users WHERE username = %s", (username,))
-            result = cursor.fetchone()
-            if result:
-                hashed_password = bytes(result[0])
-                if bcrypt.checkpw(password.encode('utf-8'), hashed_password):
-                    st.session_state['authentication_status'] = True
-                    st.session_state['user'] = username
-                    st.query_params.update(authentication_status='True', user=username)
-                    st.session_state['rerun_flag'] = True
-                    return True
-                else:
-                    st.session_state['authentication_status'] = False
-                    return False
+    session = SessionLocal()
+    try:
+        result = session.query(User.password).filter(User.username == username).first()
+        if result:
+            hashed_password = bytes(result[0])
+            if bcrypt.checkpw(password.encode('utf-8'), hashed_password):
+                st.session_state['authentication_status'] = True
+                st.session_state['user'] = username
+                st.query_params.update(authentication_status='True', user=username)
+                st.session_state['rerun_flag'] = True
+                return True
             else:
                 st.session_state['authentication_status'] = False
                 return False
-        except psycopg2.Error as e:
-            st.error(f"登录失败: {e}")
-            st.session_state['authentication_status'] = None
+        else:
+            st.session_state['authentication_status'] = False
             return False
-        finally:
-            connection.close()
+    except SQLAlchemyError as e:
+        st.error(f"登录失败: {e}")
+        st.session_state['authentication_status'] = None
+        return False
+    finally:
+        session.close()
 
 # 登出函数
 def logout():
@@ -83,6 +69,8 @@ def logout():
         del st.session_state['authentication_status']
     if 'user' in st.session_state:
         del st.session_state['user']
+    st.session_state.pop('verified_user', None)
+    st.session_state.pop('history_cursors', None)
     st.query_params.clear()
     st.success("已成功登出。")
     st.session_state['rerun_flag'] = True
@@ -93,28 +81,27 @@ if 'authentication_status' not in st.session_state:
 if 'rerun_flag' not in st.session_state:
     st.session_state['rerun_flag'] = False
 
-# 从 URL 参数恢复会话状态
+# 从 URL 参数恢复会话状态（每个浏览器会话只校验一次，之后的重跑直接使用已恢复的状态）
 query_params = st.query_params
 if 'authentication_status' in query_params and 'user' in query_params:
     auth_status = query_params['authentication_status'] == 'True'
     user = query_params['user']
-    # 验证用户是否存在于数据库中
-    connection = get_db_connection()
-    if connection:
+    if st.session_state.get('verified_user') != (user, auth_status):
+        # 验证用户是否存在于数据库中
+        session = SessionLocal()
         try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM users WHERE username = %s", (user,))
-            existing_user = cursor.fetchone()
+            existing_user = session.query(User.id).filter(User.username == user).first()
             if existing_user:
                 st.session_state['authentication_status'] = auth_status
                 st.session_state['user'] = user
+                st.session_state['verified_user'] = (user, auth_status)
             else:
                 st.session_state['authentication_status'] = False
-        except psycopg2.Error as e:
+        except SQLAlchemyError as e:
             st.error(f"验证用户失败: {e}")
             st.session_state['authentication_status'] = False
         finally:
-            connection.close()
+            session.close()
 
 # 检查是否需要重新运行
 if st.session_state['rerun_flag']:
@@ -178,56 +165,55 @@ if st.session_state.get('authentication_status'):
     # 显示历史记录（固定在 Logout 按钮下方）
     st.sidebar.markdown("---")  # 分隔线
     with st.sidebar.expander("历史记录", expanded=False):  # 默认折叠
-        connection = get_db_connection()
-        if connection:
-            try:
-                cursor = connection.cursor()
-                
-                # 查询总记录数
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT content)
-                    FROM nursing_topics
-                """)
-                total_records = cursor.fetchone()[0]
-                
-                # 分页参数
-                records_per_page = 5  # 每页显示的记录数
-                page_number = st.number_input("页码", min_value=1, max_value=(total_records // records_per_page) + 1, value=1, key="history_page_number")
-                offset = (page_number - 1) * records_per_page
-                
-                # 查询分页数据（去重并排序）
-                cursor.execute("""
-                    SELECT content, topic_type, MAX(created_at) AS latest_created_at
-                    FROM nursing_topics
-                    GROUP BY content, topic_type
-                    ORDER BY latest_created_at DESC
-                    LIMIT %s OFFSET %s
-                """, (records_per_page, offset))
-                results = cursor.fetchall()
-                
-                # 渲染分页数据
-                for row in results:
-                    content, topic_type, _ = row
-                    
-                    # 提取“输入了选题:”后面的内容
-                    if "输入了选题:" in content:
-                        topic_content = content.split("输入了选题:")[1].strip()
-                    else:
-                        topic_content = content
+        records_per_page = 5  # 每页显示的记录数
+        # 键集分页：栈中保存每一页起点之前的最后一条 (last_activity, id)，第一页为 None
+        cursors = st.session_state.setdefault('history_cursors', [None])
+        session = SessionLocal()
+        try:
+            query = (
+                session.query(TopicThread.id, TopicThread.content, TopicThread.topic_type, TopicThread.title,
+                              TopicThread.last_activity)
+                .join(User, User.id == TopicThread.user_id)
+                .filter(User.username == st.session_state['user'])
+            )
+            if cursors[-1] is not None:
+                query = query.filter(tuple_(TopicThread.last_activity, TopicThread.id) < tuple_(*cursors[-1]))
+            # 多取一条用于判断是否还有下一页
+            results = (
+                query.order_by(TopicThread.last_activity.desc(), TopicThread.id.desc())
+                .limit(records_per_page + 1)
+                .all()
+            )
+            has_next = len(results) > records_per_page
+            results = results[:records_per_page]
+            
+            # 渲染分页数据
+            for thread_id, content, topic_type, title, _ in results:
+                # 为每个线程添加按钮
+                if st.button(f"加载: {title}", key=f"load_thread_{thread_id}"):
+                    # 更新会话状态
+                    st.session_state['selected_topic_type'] = topic_type  # 锁定 topic_type
+                    st.session_state['selected_content'] = content  # 锁定 content
                     
-                    # 为每个 content 添加按钮
-                    if st.button(f"加载: {topic_content}", key=f"load_{content}"):
-                        # 更新会话状态
-                        st.session_state['selected_topic_type'] = topic_type  # 锁定 topic_type
-                        st.session_state['selected_content'] = content  # 锁定 content
-                        
-                        # 强制刷新界面
-                        st.rerun()
+                    # 强制刷新界面
+                    st.rerun()
+            if not results:
+                st.caption("暂无历史记录")
+            
+            col_prev, col_next = st.columns(2)
+            with col_prev:
+                if len(cursors) > 1 and st.button("上一页", key="history_prev_page"):
+                    cursors.pop()
+                    st.rerun()
+            with col_next:
+                if has_next and st.button("下一页", key="history_next_page"):
+                    cursors.append((results[-1].last_activity, results[-1].id))
+                    st.rerun()
         
-            except psycopg2.Error as e:
-                st.error(f"加载历史记录失败: {e}")
-            finally:
-                connection.close()
+        except SQLAlchemyError as e:
+            st.error(f"加载历史记录失败: {e}")
+        finally:
+            session.close()
 
     # 如果选中了某个 content，则加载其所有记录
     if 'selected_content' in st.session_state:
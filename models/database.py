@@ -1,8 +1,12 @@
 # models/database.py
+import functools
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from dotenv import load_dotenv
 
 # 加载 .env 环境变量
@@ -12,11 +16,94 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise Exception("DATABASE_URL 环境变量未设置！")
 
-# 创建 SQLAlchemy 引擎
-engine = create_engine(DATABASE_URL)
+# 连接池配置（环境变量）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # 常驻连接数
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # 高峰时可额外创建的连接数
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # 连接池耗尽时等待的秒数
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 连接最长复用秒数，避免被服务端或防火墙断开
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # 单条 SQL 的超时，0 表示不限制
+
+def _engine_options(url):
+    """
+    Return create_engine keyword arguments for the database behind ``url``.
+
+    Postgres gets a bounded QueuePool with pre-ping and a server-side
+    statement_timeout; SQLite (used for local runs) keeps SQLAlchemy's defaults.
+    """
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,  # 取出连接前探活，自动替换已断开的连接
+    }
+    if DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+# 创建 SQLAlchemy 引擎：每个进程一个，所有模块共用其连接池
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 
 # 创建 SessionLocal 类
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 当前工作单元的标识；Streamlit 每次重跑在独立线程中执行，新线程的上下文中没有工作单元
+_current_unit = ContextVar("current_unit", default=None)
+
+def _unit_key():
+    unit = _current_unit.get()
+    if unit is None:
+        raise RuntimeError("数据库会话只能在 session_scope() 或 @unit_of_work 内使用")
+    return unit
+
+# 按工作单元划分的会话代理：在同一工作单元内的任何地方使用，都指向同一个会话
+ScopedSession = scoped_session(SessionLocal, scopefunc=_unit_key)
+
+@contextmanager
+def session_scope():
+    """
+    Run a block as one unit of work on its own session.
+
+    The session is committed when the block finishes, rolled back if it
+    raises, and always closed, so its connection goes back to the pool.
+    Streamlit's st.rerun() and st.stop() end the script by raising
+    exceptions that are not Exceptions; those count as finishing normally.
+    Nested scopes join the outer one.
+
+    :return: The session; ScopedSession refers to the same session inside the block.
+    """
+    if _current_unit.get() is not None:
+        yield ScopedSession()
+        return
+    token = _current_unit.set(object())
+    try:
+        session = ScopedSession()
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+        except BaseException:
+            session.commit()
+            raise
+        else:
+            session.commit()
+        finally:
+            ScopedSession.remove()
+    finally:
+        _current_unit.reset(token)
+
+def unit_of_work(fn):
+    """
+    Decorate a page's main() so each Streamlit rerun gets its own session_scope().
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with session_scope():
+            return fn(*args, **kwargs)
+    return wrapper
+
 # 声明基础类，用于模型继承
 Base = declarative_base()
@@ -0,0 +1,282 @@
+# models/migrations.py
+import argparse
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select, text
+
+import models.project_models as pm
+from models.database import engine
+from utils.context_manager import count_tokens
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_ID = 724301  # Postgres advisory lock 编号，防止多个进程同时执行迁移
+
+# 已注册的迁移：(版本号, 名称, 升级函数)；已发布的迁移不要修改，改动表结构时追加新版本
+MIGRATIONS = []
+
+def migration(version, name):
+    """
+    Register ``fn(connection)`` as schema migration ``version``.
+    """
+    def register(fn):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise ValueError(f"迁移版本 {version} 重复")
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+def _create_indexes(conn, names):
+    indexes = {index.name: index for table in pm.Base.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        indexes[name].create(bind=conn, checkfirst=True)
+        logger.info(f"索引已就绪：{name}")
+
+@migration(1, "baseline")
+def _baseline(conn):
+    # 创建模型中尚不存在的表（与 create_tables.py 相同），已有的表保持不变
+    pm.Base.metadata.create_all(bind=conn, checkfirst=True)
+
+@migration(2, "hot_path_indexes")
+def _hot_path_indexes(conn):
+    # 建唯一索引前检查重复文件，重复记录须人工合并（清洗报告通过 file_id 引用它们）
+    duplicates = conn.execute(
+        select(pm.DataFile.project_id, pm.DataFile.file_name, func.count())
+        .group_by(pm.DataFile.project_id, pm.DataFile.file_name)
+        .having(func.count() > 1)
+    ).all()
+    if duplicates:
+        listed = ", ".join(f"(project_id={p}, file_name={f!r}, {n} 条)" for p, f, n in duplicates[:10])
+        raise RuntimeError(f"data_files 中存在重复的 (project_id, file_name)，请先合并后再迁移：{listed}")
+    _create_indexes(conn, [
+        "ix_nursing_topics_user_id_created_at",
+        "ix_nursing_topics_content",
+        "ix_my_goals_user_id_created_at",
+        "ix_projects_user_id_created_at",
+        "uq_data_files_project_id_file_name",
+        "ix_cleaning_reports_file_id",
+        "ix_reviewer_comments_manuscript_id_created_at",
+    ])
+
+@migration(3, "topic_threads")
+def _topic_threads(conn):
+    # 由已有记录汇总线程；之后由 NursingTopic 的 after_insert 监听器在插入时维护
+    table = pm.TopicThread.__table__
+    table.create(bind=conn, checkfirst=True)
+    conn.execute(table.delete())
+    topic = pm.NursingTopic
+    rows = conn.execution_options(stream_results=True).execute(
+        select(topic.user_id, topic.content, topic.topic_type, func.max(topic.created_at), func.count())
+        .where(topic.user_id.isnot(None))
+        .group_by(topic.user_id, topic.content, topic.topic_type)
+    )
+    threads = {}
+    for user_id, content, topic_type, last_activity, count in rows:
+        last_activity = last_activity or datetime.min
+        key = (user_id, pm.thread_key(content))
+        thread = threads.get(key)
+        if thread is None:
+            threads[key] = thread = {"user_id": user_id, "thread_key": key[1], "content": content,
+                                     "title": pm.thread_title(content), "message_count": 0,
+                                     "last_activity": datetime.min}
+        thread["message_count"] += count
+        if last_activity >= thread["last_activity"]:
+            thread["topic_type"], thread["last_activity"] = topic_type, last_activity
+    values = list(threads.values())
+    for start in range(0, len(values), 1000):
+        conn.execute(table.insert(), values[start:start + 1000])
+    logger.info(f"已汇总 {len(values)} 个对话线程")
+
+@migration(4, "conversation_messages")
+def _conversation_messages(conn):
+    # 将每条记录的 JSON 对话拆成消息，按线程内提问的先后编号；之后只追加新消息
+    table = pm.ConversationMessage.__table__
+    table.create(bind=conn, checkfirst=True)
+    conn.execute(table.delete())
+    threads = {(user_id, key): thread_id for user_id, key, thread_id in conn.execute(
+        select(pm.TopicThread.user_id, pm.TopicThread.thread_key, pm.TopicThread.id))}
+    topic = pm.NursingTopic
+    rows = conn.execution_options(stream_results=True).execute(
+        select(topic.id, topic.user_id, topic.content, topic.conversation_history, topic.created_at)
+        .where(topic.user_id.isnot(None))
+        .order_by(topic.created_at, topic.id)
+    )
+    last_seq, batch, skipped = {}, [], 0
+    for topic_id, user_id, content, history, created_at in rows:
+        thread_id = threads.get((user_id, pm.thread_key(content)))
+        try:
+            messages = json.loads(history) if history and history.strip() else []
+        except ValueError:
+            messages = None
+        if thread_id is None or not isinstance(messages, list):
+            skipped += 1
+            continue
+        for message in messages:
+            body = (message.get("content") or "") if isinstance(message, dict) else ""
+            if not body:
+                continue  # 与 build_context 一致，跳过空的占位回答
+            last_seq[thread_id] = seq = last_seq.get(thread_id, 0) + 1
+            batch.append({"thread_id": thread_id, "seq": seq, "role": message.get("role") or "user",
+                          "content": body, "token_count": count_tokens(body), "nursing_topic_id": topic_id,
+                          "metadata": None, "created_at": created_at})
+        if len(batch) >= 1000:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+    logger.info(f"已拆分 {sum(last_seq.values())} 条消息，跳过 {skipped} 条无法解析或无线程的记录")
+
+@migration(5, "thread_summaries")
+def _thread_summaries(conn):
+    # 摘要原先只按 content 区分，不同用户的同名选题会共用一份；按线程重建表，
+    # 旧摘要无法分到各用户，直接丢弃，下次提问时重新生成
+    table = pm.ConversationSummary.__table__
+    table.drop(bind=conn, checkfirst=True)
+    table.create(bind=conn)
+
+def _add_column(conn, column):
+    # 已有表补列；新建的库由 baseline 按模型建表时已包含该列
+    if column.name in {c["name"] for c in inspect(conn).get_columns(column.table.name)}:
+        return False
+    conn.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"))
+    return True
+
+@migration(6, "my_goals_updated_at")
+def _my_goals_updated_at(conn):
+    # 方案在 my_goals 中原地修改，created_at 水位看不到这些修改；改用 updated_at 作为水位列
+    table = pm.MyGoals.__table__
+    if _add_column(conn, table.c.updated_at):
+        conn.execute(table.update().values(updated_at=table.c.created_at))
+    _create_indexes(conn, ["ix_my_goals_updated_at"])
+    # 此前原地修改过的目标无从得知，清除水位，让增量索引重新读取全部目标
+    conn.execute(pm.IndexWatermark.__table__.delete().where(pm.IndexWatermark.source == "my_goals"))
+
+@migration(7, "summary_seq")
+def _summary_seq(conn):
+    # 摘要进度改为记录线程内最后并入的消息 seq；旧的消息条数在两个页面中含义不一致，
+    # 无法换算，重建表后下次提问时重新生成摘要
+    table = pm.ConversationSummary.__table__
+    table.drop(bind=conn, checkfirst=True)
+    table.create(bind=conn)
+
+def _lock(conn):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+def applied_versions(conn):
+    pm.SchemaMigration.__table__.create(bind=conn, checkfirst=True)
+    return set(conn.execute(select(pm.SchemaMigration.version)).scalars())
+
+def pending_migrations(bind=engine):
+    """
+    :return: The registered (version, name) pairs not yet applied, oldest first.
+    """
+    with bind.connect() as conn:
+        applied = applied_versions(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+def run_migrations(target=None, bind=engine):
+    """
+    Apply pending migrations in version order, up to and including ``target``.
+
+    Each migration runs in its own transaction together with its
+    schema_migrations row, so a failed one leaves nothing half-applied on
+    Postgres (DDL is transactional there) and is retried on the next run.
+    A Postgres advisory lock serialises concurrent runners.
+
+    :return: The versions applied by this call.
+    """
+    done = []
+    for version, name, upgrade in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with bind.begin() as conn:
+            _lock(conn)
+            if version in applied_versions(conn):
+                continue
+            logger.info(f"执行迁移 {version:04d}_{name}")
+            upgrade(conn)
+            conn.execute(pm.SchemaMigration.__table__.insert().values(version=version, name=name))
+        done.append(version)
+    return done
+
+def _sample(conn, column, default):
+    value = conn.execute(select(column).where(column.isnot(None)).limit(1)).scalar()
+    return default if value is None else value
+
+def hot_queries(conn):
+    """
+    The per-request queries the pages run, with parameters sampled from the data.
+
+    :return: A dict of name -> SELECT statement.
+    """
+    user_id = _sample(conn, pm.NursingTopic.user_id, 1)
+    project_id = _sample(conn, pm.DataFile.project_id, 1)
+    file_name = _sample(conn, pm.DataFile.file_name, "")
+    thread = pm.TopicThread
+    return {
+        "history_sidebar": select(thread).where(thread.user_id == user_id)
+        .order_by(thread.last_activity.desc(), thread.id.desc()).limit(6),
+        "last_messages": select(pm.ConversationMessage).where(pm.ConversationMessage.thread_id == 1)
+        .order_by(pm.ConversationMessage.seq.desc()).limit(200),
+        "topic_messages": select(pm.ConversationMessage).where(pm.ConversationMessage.nursing_topic_id == 1)
+        .order_by(pm.ConversationMessage.thread_id, pm.ConversationMessage.seq),
+        "topics_by_user": select(pm.NursingTopic).where(pm.NursingTopic.user_id == user_id)
+        .order_by(pm.NursingTopic.created_at.desc()),
+        "goals_by_user": select(pm.MyGoals).where(pm.MyGoals.user_id == user_id)
+        .order_by(pm.MyGoals.created_at.desc()),
+        "projects_by_user": select(pm.Project).where(pm.Project.user_id == user_id)
+        .order_by(pm.Project.created_at.desc()),
+        "data_file_by_name": select(pm.DataFile).where(pm.DataFile.project_id == project_id,
+                                                       pm.DataFile.file_name == file_name),
+        "data_files_by_project": select(pm.DataFile).where(pm.DataFile.project_id == project_id),
+        "report_by_file": select(pm.CleaningReport).where(pm.CleaningReport.file_id == 1),
+        "reviews_by_manuscript": select(pm.ReviewerComment).where(pm.ReviewerComment.manuscript_id == 1)
+        .order_by(pm.ReviewerComment.created_at.desc()),
+    }
+
+def explain_hot_queries(analyze=False, bind=engine):
+    """
+    Return the query plan of each hot query.
+
+    :param analyze: On Postgres, run EXPLAIN (ANALYZE, BUFFERS), which executes the SELECTs.
+    :return: A dict of name -> plan text.
+    """
+    plans = {}
+    with bind.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        prefix = ("EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN ") if postgres else "EXPLAIN QUERY PLAN "
+        for name, statement in hot_queries(conn).items():
+            sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+            rows = conn.exec_driver_sql(prefix + sql).all()
+            # Postgres 每行一列计划文本；SQLite 的最后一列为计划说明
+            plans[name] = "\n".join(str(row[-1]) for row in rows)
+    return plans
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="数据库结构迁移")
+    parser.add_argument("--target", type=int, help="只迁移到指定版本")
+    parser.add_argument("--status", action="store_true", help="只列出待执行的迁移")
+    parser.add_argument("--explain", action="store_true", help="输出热点查询的执行计划")
+    parser.add_argument("--analyze", action="store_true", help="与 --explain 同用，实际执行查询并统计耗时（仅 Postgres）")
+    args = parser.parse_args()
+
+    if args.status:
+        pending = pending_migrations()
+        for version, name in pending:
+            print(f"待执行：{version:04d}_{name}")
+        if not pending:
+            print("数据库结构已是最新版本")
+    elif not args.explain:
+        applied = run_migrations(args.target)
+        logger.info(f"已执行 {len(applied)} 个迁移：{applied}" if applied else "没有待执行的迁移")
+    if args.explain:
+        for name, plan in explain_hot_queries(args.analyze).items():
+            print(f"== {name}\n{plan}\n")
+
+if __name__ == "__main__":
+    main()
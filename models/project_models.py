@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, TIMESTAMP,LargeBinary
-from sqlalchemy.sql import text
+import hashlib
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, TIMESTAMP,LargeBinary, UniqueConstraint, Index, JSON, event
+from sqlalchemy.sql import func, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -25,12 +27,17 @@ class NursingTopic(Base):
     topic_type = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     sub_content = Column(Text, nullable=False)
-    conversation_history = Column(Text, default="")  # 使用 TEXT 类型，默认值为空字符串
+    conversation_history = Column(Text, default="")  # 旧版 JSON 对话记录，仅供迁移读取；新消息写入 conversation_messages
     user_id = Column(Integer, ForeignKey('users.id'))
     created_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
     
     user = relationship("User", back_populates="nursing_topics")
 
+    __table_args__ = (
+        Index('ix_nursing_topics_user_id_created_at', user_id, created_at.desc()),  # 按用户列出选题
+        Index('ix_nursing_topics_content', content, postgresql_using='hash'),  # 按 content 加载对话；哈希索引不受 B 树行长限制
+    )
+
 class MyGoals(Base):
     __tablename__ = 'my_goals'
     
@@ -43,9 +50,15 @@ class MyGoals(Base):
     my_writings = Column(Text, nullable=True)
     my_manuscripts = Column(Text, nullable=True)
     created_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+    updated_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'), onupdate=text('CURRENT_TIMESTAMP'))  # 方案等字段原地修改时更新，供增量索引使用
     
     user = relationship("User", back_populates="my_goals")
 
+    __table_args__ = (
+        Index('ix_my_goals_user_id_created_at', user_id, created_at.desc()),
+        Index('ix_my_goals_updated_at', updated_at, id),  # 增量索引按 (updated_at, id) 顺序读取
+    )
+
 class Project(Base):
     __tablename__ = 'projects'
     
@@ -57,6 +70,8 @@ class Project(Base):
     user = relationship("User", back_populates="projects")
     data_files = relationship("DataFile", back_populates="project")  # 新增关联
 
+    __table_args__ = (Index('ix_projects_user_id_created_at', user_id, created_at.desc()),)
+
 class DataFile(Base):
     __tablename__ = 'data_files'
     
@@ -69,6 +84,9 @@ class DataFile(Base):
     project = relationship("Project", back_populates="data_files")
     cleaning_reports = relationship("CleaningReport", back_populates="data_file")  # 新增关联
 
+    # 唯一索引同时服务按 project_id 列出文件的查询；SQLite 不支持对已有表添加约束，故用唯一索引而非 UniqueConstraint
+    __table_args__ = (Index('uq_data_files_project_id_file_name', project_id, file_name, unique=True),)
+
 class CleaningReport(Base):
     __tablename__ = 'cleaning_reports'
     
@@ -79,6 +97,8 @@ class CleaningReport(Base):
     
     data_file = relationship("DataFile", back_populates="cleaning_reports")
 
+    __table_args__ = (Index('ix_cleaning_reports_file_id', file_id),)
+
 class Writing(Base):
     __tablename__ = 'writings'
     
@@ -126,4 +146,183 @@ class ReviewerComment(Base):
     revised_content = Column(Text, nullable=True)  # 修改后的文稿内容
     created_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
 
-    manuscript = relationship("Manuscript", back_populates="reviews")
\ No newline at end of file
+    manuscript = relationship("Manuscript", back_populates="reviews")
+
+    __table_args__ = (Index('ix_reviewer_comments_manuscript_id_created_at', manuscript_id, created_at.desc()),)
+
+class LLMResponseCache(Base):
+    __tablename__ = 'llm_response_cache'
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, nullable=False, index=True)  # (model, messages, 参数) 的 SHA-256
+    context_key = Column(String(64), nullable=False, index=True)  # 除最后一条用户消息外的上下文哈希，用于近似匹配
+    model = Column(String, nullable=False)
+    prompt = Column(Text, nullable=False)  # 最后一条用户消息
+    response = Column(Text, nullable=False)  # 缓存的完整回答
+    embedding = Column(LargeBinary, nullable=True)  # prompt 的向量（float32），启用近似匹配时写入
+    hit_count = Column(Integer, default=0)
+    created_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+    last_hit_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+
+class ConversationSummary(Base):
+    __tablename__ = 'conversation_summaries'
+
+    id = Column(Integer, primary_key=True, index=True)
+    thread_id = Column(Integer, ForeignKey('topic_threads.id', ondelete='CASCADE'), unique=True, nullable=False, index=True)  # 所属的对话线程（按用户区分）
+    summary = Column(Text, nullable=False, default="")  # 较早轮次的滚动摘要
+    summarized_seq = Column(Integer, nullable=False, default=0)  # 已并入摘要的最后一条消息的 seq
+    updated_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'), onupdate=text('CURRENT_TIMESTAMP'))
+
+class Article(Base):
+    __tablename__ = 'articles'
+
+    id = Column(Integer, primary_key=True, index=True)
+    pmid = Column(String(16), unique=True, nullable=False, index=True)  # PubMed ID
+    title = Column(Text, nullable=False)
+    authors = Column(Text, nullable=False, default="[]")  # 作者列表（JSON）
+    journal = Column(String, nullable=True)
+    year = Column(String(16), nullable=True)
+    abstract = Column(Text, nullable=True)
+    mesh_terms = Column(Text, nullable=False, default="[]")  # MeSH 主题词列表（JSON）
+    fetched_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+
+class PubMedQueryCache(Base):
+    __tablename__ = 'pubmed_query_cache'
+
+    id = Column(Integer, primary_key=True, index=True)
+    query_hash = Column(String(64), unique=True, nullable=False, index=True)  # 规范化检索式的 SHA-256
+    query = Column(Text, nullable=False)
+    total_count = Column(Integer, nullable=False, default=0)  # PubMed 命中总数
+    pmids = Column(Text, nullable=False, default="")  # 按相关性排序的 PMID，逗号分隔
+    fetched_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = 'embedding_cache'
+    __table_args__ = (UniqueConstraint('model', 'text_hash', name='uq_embedding_cache_model_text_hash'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    model = Column(String, nullable=False)  # 向量模型名称
+    text_hash = Column(String(64), nullable=False)  # 规范化文本的 SHA-256
+    dim = Column(Integer, nullable=False)
+    vector = Column(LargeBinary, nullable=False)  # 归一化后的 float16 向量
+    created_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+
+class IngestionDeadLetter(Base):
+    __tablename__ = 'ingestion_dead_letters'
+
+    id = Column(Integer, primary_key=True, index=True)
+    doc_id = Column(String, unique=True, nullable=False, index=True)  # 文档 id，如 conversation:12
+    error = Column(Text, nullable=False)  # 最后一次失败的错误信息
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+    updated_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'), onupdate=text('CURRENT_TIMESTAMP'))
+
+class IndexWatermark(Base):
+    __tablename__ = 'index_watermarks'
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, unique=True, nullable=False, index=True)  # 文档类型，如 manuscript；墓碑为 tombstones
+    watermark = Column(TIMESTAMP, nullable=True)  # 已索引记录的最大时间戳
+    last_id = Column(Integer, nullable=False, default=0)  # 该时间戳下已索引的最大主键（墓碑为已处理的最大墓碑 id）
+    updated_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'), onupdate=text('CURRENT_TIMESTAMP'))
+
+class IndexTombstone(Base):
+    __tablename__ = 'index_tombstones'
+
+    id = Column(Integer, primary_key=True, index=True)
+    doc_id = Column(String, nullable=False)  # 被删除记录对应的文档 id，如 manuscript:3
+    deleted_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+
+class TopicThread(Base):
+    __tablename__ = 'topic_threads'
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    thread_key = Column(String(64), nullable=False)  # content 的 SHA-256，同一用户同一 content 的记录为一个线程
+    topic_type = Column(String, nullable=False)
+    content = Column(Text, nullable=False)  # 线程的 content，历史记录加载时按它查询
+    title = Column(Text, nullable=False)  # 侧边栏显示的标题
+    last_activity = Column(TIMESTAMP, nullable=False, default=text('CURRENT_TIMESTAMP'))
+    message_count = Column(Integer, nullable=False, default=0)  # 线程中的提问条数（每条 NursingTopic 记录一问一答）
+
+    __table_args__ = (
+        UniqueConstraint(user_id, thread_key, name='uq_topic_threads_user_id_thread_key'),
+        Index('ix_topic_threads_user_id_last_activity', user_id, last_activity.desc(), id.desc()),  # 侧边栏按 (last_activity, id) 倒序做键集分页
+    )
+
+class ConversationMessage(Base):
+    __tablename__ = 'conversation_messages'
+    # 唯一约束同时服务按线程读取一段消息（WHERE thread_id = ? ORDER BY seq）
+    __table_args__ = (UniqueConstraint('thread_id', 'seq', name='uq_conversation_messages_thread_id_seq'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    thread_id = Column(Integer, ForeignKey('topic_threads.id'), nullable=False)
+    seq = Column(Integer, nullable=False)  # 线程内从 1 开始递增的顺序号，只追加不改写
+    role = Column(String(16), nullable=False)  # user / assistant
+    content = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False, default=0)  # utils.context_manager.count_tokens 的估算值
+    nursing_topic_id = Column(Integer, ForeignKey('nursing_topics.id', ondelete='CASCADE'), nullable=True, index=True)  # 所属的提问记录
+    meta = Column('metadata', JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=True)  # 如引用文献的 PMID
+    created_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True)  # 迁移版本号，见 models/migrations.py
+    name = Column(String, nullable=False)
+    applied_at = Column(TIMESTAMP, default=text('CURRENT_TIMESTAMP'))
+
+# 删除以下业务记录时写入墓碑，供增量索引任务删除其向量：模型 -> ((文档 id 前缀, 主键属性), ...)
+TOMBSTONE_SOURCES = {
+    NursingTopic: (("nursing_topic", "id"), ("conversation", "id")),
+    MyGoals: (("my_goals", "id"),),
+    Writing: (("writing", "id"),),
+    Manuscript: (("manuscript", "id"),),
+    Article: (("article", "pmid"),),
+}
+
+def _record_tombstones(mapper, connection, target):
+    # 与删除在同一事务中写入，回滚时墓碑一并撤销
+    rows = [{"doc_id": f"{prefix}:{getattr(target, key)}"} for prefix, key in TOMBSTONE_SOURCES[type(target)]]
+    connection.execute(IndexTombstone.__table__.insert(), rows)
+
+for _model in TOMBSTONE_SOURCES:
+    event.listen(_model, "after_delete", _record_tombstones)
+
+def thread_key(content):
+    """
+    Return the key of the NursingTopic thread with this content.
+
+    Together with the user id it identifies the thread's TopicThread row.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def thread_title(content):
+    # 去掉“输入了选题:”之前的上下文，只保留用户输入的部分
+    return content.split("输入了选题:", 1)[1].strip() if "输入了选题:" in content else content
+
+_UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def _touch_topic_thread(mapper, connection, target):
+    # 与新记录在同一事务中更新线程摘要；并发插入同一线程时由唯一约束上的 upsert 合并
+    if target.user_id is None:
+        return
+    table = TopicThread.__table__
+    values = {
+        "user_id": target.user_id,
+        "thread_key": thread_key(target.content),
+        "topic_type": target.topic_type,
+        "content": target.content,
+        "title": thread_title(target.content),
+        "last_activity": func.current_timestamp(),
+        "message_count": 1,
+    }
+    statement = _UPSERTS[connection.dialect.name](table).values(**values)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.thread_key],
+        set_={"topic_type": statement.excluded.topic_type,
+              "last_activity": statement.excluded.last_activity,
+              "message_count": table.c.message_count + 1},
+    ))
+
+event.listen(NursingTopic, "after_insert", _touch_topic_thread)
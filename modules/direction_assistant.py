@@ -1,40 +1,25 @@
 import streamlit as st
-import os
-import json
-from sqlalchemy.orm import sessionmaker, joinedload
-from models.database import engine, Base
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, NursingTopic
-from openai import OpenAI
+from utils.llm_gateway import stream_chat
+from utils.stream_renderer import render_stream
+from utils.context_manager import CONTEXT_TOKEN_BUDGET, build_context, count_message_tokens
+from utils.grounding import GROUNDING_TOKEN_BUDGET, evidence_message, warm_up
+from utils.conversation_store import append_messages, find_thread
+from utils.vector_storage import save_to_vector_db
 
 # 调用大模型
-def call_llm(user_input, messages):
-    client = OpenAI(
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-    )
+def call_llm(user_input, messages, use_cache=False):
     new_messages = messages + [{"role": "user", "content": user_input}]
-    completion = client.chat.completions.create(
-        model="qwen-plus",
-        messages=new_messages,
-        stream=True,
-        stream_options={"include_usage": True}
-    )
-    result = ""
-    placeholder = st.empty()
-    for chunk in completion:
-        try:
-            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
-                result += chunk.choices[0].delta.content
-                placeholder.write(result)
-        except IndexError as e:
-            st.error(f"发生索引错误: {e}")
+    result, _ = render_stream(stream_chat(new_messages, cache=use_cache, user=st.session_state.get('user')))
     return result
 
 # 主函数
+@unit_of_work
 def main():
     st.title("护理科研选题方向助手")
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    warm_up()  # 后台预热检索索引与向量模型
+    session = ScopedSession()  # 本次重跑的数据库会话，由 @unit_of_work 提交并关闭
     try:
         # 初始化会话状态
         if 'conversation_history' not in st.session_state:
@@ -94,14 +79,17 @@ def main():
                 topic_type=selected_topic_type,
                 content=content,
                 sub_content=content,
-                user=user,
-                conversation_history=json.dumps([
-                    {"role": "user", "content": content},
-                    {"role": "assistant", "content": ""}
-                ], ensure_ascii=False)
+                user=user
             )
             try:
                 session.add(new_nursing_topic)
+                session.flush()  # 插入时由监听器建立或更新线程
+                # 先记下提问，回答生成后再追加，不改写已有消息
+                thread = find_thread(session, user.id, content) if user else None
+                asked_seq = None  # 本次提问在线程中的 seq，构建上下文时排除在外
+                if thread:
+                    asked_seq = append_messages(session, thread.id, [{"role": "user", "content": content}],
+                                                nursing_topic_id=new_nursing_topic.id)[0].seq
                 session.commit()
                 st.success("选题信息已成功保存到数据库。")
             except Exception as e:
@@ -113,23 +101,35 @@ def main():
             # 构建用户输入
             user_input = content
             if st.session_state.last_question != user_input:
-                answer = call_llm(user_input, [{"role": "system", "content": "你是医学研究领域的专家，特别擅长护理方面的科研选题。你的任务指令是：首先将用户自然语言中的选题需求提取出核心内容，然后通过公开数据库获取与用户需求相关的最新研究方案文献，从获取的文献中提取关键信息，并按照 PICOS 模型进行总结：P，Population 参与者， 可以是患者或者人群 研究对象 ; I，Intervention干预措施，可以是治疗、护理或其他干预; C ，Comparator 对照，可以是标准治疗或安慰剂等对比条件；O，Outcome 结局指标，可以是研究目标或评估结果；S，Study design 研究设计，可以是RCT、队列研究、病例对照等。最后，输出排列组合建议：根据 PICOS 的不同组合，生成多个具有可操作性和创新性的选题建议，帮助用户选择研究方向。"}] + st.session_state.conversation_history)
+                system_prompt = "你是医学研究领域的专家，特别擅长护理方面的科研选题。你的任务指令是：首先将用户自然语言中的选题需求提取出核心内容，然后从系统提供的检索文献中提取关键信息（按编号引用，如 [1]；未提供文献或文献不足时，基于专业知识作答并说明未引用文献，不要编造文献），并按照 PICOS 模型进行总结：P，Population 参与者， 可以是患者或者人群 研究对象 ; I，Intervention干预措施，可以是治疗、护理或其他干预; C ，Comparator 对照，可以是标准治疗或安慰剂等对比条件；O，Outcome 结局指标，可以是研究目标或评估结果；S，Study design 研究设计，可以是RCT、队列研究、病例对照等。最后，输出排列组合建议：根据 PICOS 的不同组合，生成多个具有可操作性和创新性的选题建议，帮助用户选择研究方向。回答应简洁，不要复述文献原文。"
+                # 先检索相关文献，作为上下文注入，并从对话预算中扣除其 token；文献最多占对话预算的一半
+                evidence, hits = evidence_message(user_input, token_budget=min(GROUNDING_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGET // 2))
+                budget = max(CONTEXT_TOKEN_BUDGET - count_message_tokens([evidence]), 0) if evidence else None
+                context = build_context(session, thread.id if thread else None, system_prompt, st.session_state.conversation_history, user_input,
+                                        budget=budget, before_seq=asked_seq)
+                if evidence:
+                    context.insert(1, evidence)
+                    with st.expander(f"参考文献（{len(hits)} 篇）"):
+                        for i, (_, _, metadata) in enumerate(hits, start=1):
+                            st.markdown(f"[{i}] {metadata.get('title')}（PMID {metadata.get('source_id')}）")
+                answer = call_llm(user_input, context, use_cache=True)
                 st.session_state.conversation_history.append({"role": "user", "content": user_input})
                 st.session_state.conversation_history.append({"role": "assistant", "content": answer})
                 st.session_state.last_question = user_input
                 st.session_state.last_answer = answer
 
-                updated_history = [
-                    {"role": "user", "content": user_input},
-                    {"role": "assistant", "content": answer}
-                ]
-                new_nursing_topic.conversation_history = json.dumps(updated_history, ensure_ascii=False)
                 try:
+                    if thread:
+                        cited = [metadata.get('source_id') for _, _, metadata in hits] if evidence else []
+                        append_messages(session, thread.id, [{"role": "assistant", "content": answer,
+                                                              "metadata": {"cited_pmids": cited} if cited else None}],
+                                        nursing_topic_id=new_nursing_topic.id)
                     session.commit()
                 except Exception as e:
                     session.rollback()
                     st.error(f"更新对话历史到数据库时出错: {e}")
                     return
+                save_to_vector_db(new_nursing_topic.id)  # 后台写入向量库，供后续检索
                 st.session_state.has_ai_answer = True
 
         # 显示对话历史
@@ -168,38 +168,45 @@ def main():
             new_question = st.text_input("继续提问", "")
             if st.button("提交新问题"):
                 new_system_role = "You are an expert in providing in - depth analysis based on previous conversations."
-                new_conversation_history = [{"role": "system", "content": new_system_role}] + st.session_state.conversation_history
                 if st.session_state.last_question != new_question:
+                    # 获取当前的 topic 和 content
+                    current_topic = st.session_state.new_nursing_topic
+                    if current_topic:
+                        # 使用 session.merge() 重新绑定对象到会话
+                        current_topic = session.merge(current_topic)
+                        thread = find_thread(session, current_topic.user_id, current_topic.content)
+                        new_conversation_history = build_context(session, thread.id if thread else None, new_system_role, st.session_state.conversation_history, new_question)
+                    else:
+                        new_conversation_history = [{"role": "system", "content": new_system_role}] + st.session_state.conversation_history
                     new_answer = call_llm(new_question, new_conversation_history)
                     st.session_state.conversation_history.append({"role": "user", "content": new_question})
                     st.session_state.conversation_history.append({"role": "assistant", "content": new_answer})
                     st.session_state.last_question = new_question
                     st.session_state.last_answer = new_answer
 
-                    # 获取当前的 topic 和 content
-                    current_topic = st.session_state.new_nursing_topic
                     if current_topic:
-                        # 使用 session.merge() 重新绑定对象到会话
-                        current_topic = session.merge(current_topic)
-
                         # 新开一行记录
                         new_nursing_topic = NursingTopic(
                             topic_type=current_topic.topic_type,
                             content=current_topic.content,
                             sub_content=new_question,
-                            user=current_topic.user,  # 现在可以安全访问 user
-                            conversation_history=json.dumps([
-                                {"role": "user", "content": new_question},
-                                {"role": "assistant", "content": new_answer}
-                            ], ensure_ascii=False)
+                            user=current_topic.user  # 现在可以安全访问 user
                         )
                         try:
                             session.add(new_nursing_topic)
+                            session.flush()  # 插入时由监听器建立或更新线程
+                            thread = thread or find_thread(session, current_topic.user_id, current_topic.content)
+                            if thread:
+                                append_messages(session, thread.id, [
+                                    {"role": "user", "content": new_question},
+                                    {"role": "assistant", "content": new_answer}
+                                ], nursing_topic_id=new_nursing_topic.id)
                             session.commit()
                         except Exception as e:
                             session.rollback()
                             st.error(f"保存新问题到数据库时出错: {e}")
                             return
+                        save_to_vector_db(new_nursing_topic.id)  # 后台写入向量库，供后续检索
 
                         # 更新 st.session_state.new_nursing_topic
                         st.session_state.new_nursing_topic = new_nursing_topic
@@ -210,8 +217,6 @@ def main():
 
     except Exception as e:
         st.error(f"发生错误: {e}")
-    finally:
-        session.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,37 +1,19 @@
 import streamlit as st
-import os
-import json
-from sqlalchemy.orm import sessionmaker, joinedload
-from models.database import engine, Base
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, NursingTopic
-from openai import OpenAI
+from utils.llm_gateway import stream_chat
+from utils.stream_renderer import render_stream
+from utils.context_manager import build_context
+from utils.conversation_store import HISTORY_MESSAGES_LIMIT, append_messages, find_thread, last_messages, to_chat
+from utils.vector_storage import save_to_vector_db
 
 # 创建数据库会话
-Session = sessionmaker(bind=engine)
-session = Session()
+session = ScopedSession  # 指向 main() 本次重跑所在工作单元的会话
 
 # 调用大模型
 def call_llm(user_input, messages):
-    client = OpenAI(
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-    )
     new_messages = messages + [{"role": "user", "content": user_input}]
-    completion = client.chat.completions.create(
-        model="qwen-plus",
-        messages=new_messages,
-        stream=True,
-        stream_options={"include_usage": True}
-    )
-    result = ""
-    placeholder = st.empty()
-    for chunk in completion:
-        try:
-            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
-                result += chunk.choices[0].delta.content
-                placeholder.write(result)
-        except IndexError as e:
-            st.error(f"发生索引错误: {e}")
+    result, _ = render_stream(stream_chat(new_messages, user=st.session_state.get('user')))
     return result
 
 # 显示对话历史
@@ -62,6 +44,7 @@ def display_conversation_history():
                         st.rerun()
 
 # 主函数
+@unit_of_work
 def main():
     st.title("历史记录助手")
     
@@ -91,18 +74,16 @@ def main():
     st.text_input("选题类型", value=selected_topic_type, disabled=True, key="topic_type_display")  # 锁定 topic_type
     st.text_input("选题内容", value=selected_content, disabled=True, key="content_display")  # 锁定 content
     
-    # 加载已存储的对话历史
-    connection = session
+    # 加载已存储的对话历史：只读取线程最近的消息
+    username = st.session_state.get('user')
+    user = session.query(User).filter(User.username == username).first()
+    thread = find_thread(session, user.id, selected_content) if user else None
     try:
-        results = connection.query(NursingTopic).filter_by(content=selected_content).order_by(NursingTopic.created_at).all()
+        rows = last_messages(session, thread.id, HISTORY_MESSAGES_LIMIT) if thread else []
         
-        # 如果有对话历史，则加载到会话状态
-        if results:
-            conversation_history = []
-            for row in results:
-                history = json.loads(row.conversation_history) if row.conversation_history else []
-                conversation_history.extend(history)
-            st.session_state.conversation_history = conversation_history
+        # 如果有对话历史，则加载到会话状态（仅用于显示，提问时的上下文由 build_context 从线程读取）
+        if rows:
+            st.session_state.conversation_history = to_chat(rows)
         
         # 显示对话历史
         if st.session_state.conversation_history:
@@ -113,14 +94,11 @@ def main():
     # 提交新问题
     new_question = st.text_input("继续提问", key="new_question_input")
     if st.button("提交新问题", key="submit_new_question_button"):
-        username = st.session_state.get('user')
-        user = session.query(User).filter(User.username == username).first()
-        
         # 构建用户输入
         if st.session_state.last_question != new_question:
             # 调用 LLM 并获取 AI 回答
             new_system_role = "You are an expert in providing in - depth analysis based on previous conversations."
-            new_conversation_history = [{"role": "system", "content": new_system_role}] + st.session_state.conversation_history
+            new_conversation_history = build_context(session, thread.id if thread else None, new_system_role, st.session_state.conversation_history, new_question)
             new_answer = call_llm(new_question, new_conversation_history)
             
             # 更新会话状态
@@ -141,14 +119,17 @@ def main():
                     topic_type=selected_topic_type,
                     content=selected_content,
                     sub_content=new_question,
-                    user=user,
-                    conversation_history=json.dumps([
-                        {"role": "user", "content": new_question},
-                        {"role": "assistant", "content": new_answer}
-                    ], ensure_ascii=False)
+                    user=user
                 )
                 session.add(new_nursing_topic)
+                session.flush()  # 插入时由监听器建立或更新线程
+                thread = thread or find_thread(session, user.id, selected_content)
+                append_messages(session, thread.id, [
+                    {"role": "user", "content": new_question},
+                    {"role": "assistant", "content": new_answer}
+                ], nursing_topic_id=new_nursing_topic.id)
                 session.commit()
+                save_to_vector_db(new_nursing_topic.id)  # 后台写入向量库，供后续检索
                 
                 st.success("新问题已成功存储到数据库！")
                 
@@ -159,5 +140,3 @@ def main():
                 st.error(f"存储到数据库失败: {e}")
             
             st.rerun()
-    
-    session.close()
\ No newline at end of file
@@ -1,8 +1,7 @@
-from openai import OpenAI
+from utils.llm_gateway import stream_chat
+from utils.stream_renderer import render_stream
 import streamlit as st
-import os
-from sqlalchemy.orm import sessionmaker
-from models.database import engine, Base
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, Writing
 from datetime import datetime
 from dotenv import load_dotenv
@@ -11,17 +10,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Create database session
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# Initialize Aliyun BaiLian API client
-try:
-    client = OpenAI(
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-except Exception as e:
-    raise Exception(f"初始化阿里云百炼 API 客户端失败，请检查配置。错误信息: {e}")
+session = ScopedSession  # 指向 main() 本次重跑所在工作单元的会话
 
 # Define system role
 system_role = """
@@ -37,6 +26,7 @@ if "writing_prompts" not in st.session_state:
     st.session_state.writing_prompts = []
 
 
+@unit_of_work
 def main():
     st.title("撰写助手")
 
@@ -73,22 +63,10 @@ def main():
                 st.markdown(prompt)
 
             with st.chat_message("assistant"):
-                response = client.chat.completions.create(
-                    model="qwen-plus",
-                    messages=[
-                        {"role": "system", "content": system_role},
-                        *st.session_state.messages
-                    ],
-                    stream=True,
-                )
-                full_response = ""
-                response_container = st.empty()  # Create an empty container to update
-                for chunk in response:
-                    if hasattr(chunk, "choices") and len(chunk.choices) > 0:
-                        delta = chunk.choices[0].delta
-                        if hasattr(delta, "content") and delta.content:
-                            full_response += delta.content
-                            response_container.markdown(full_response)  # Update the container
+                full_response, _ = render_stream(stream_chat([
+                    {"role": "system", "content": system_role},
+                    *st.session_state.messages
+                ], user=st.session_state.get('user')), method="markdown")
                 st.session_state.messages.append({"role": "assistant", "content": full_response})
 
     # Writing prompt generation
@@ -105,23 +83,11 @@ def main():
     if st.button("生成写作提示", key="generate_prompts_button"):
         input_text = f"基于撰写类型：{writing_type}，用户输入的内容：{user_input}，以及对话历史，生成写作提示。"
         try:
-            response = client.chat.completions.create(
-                model="qwen-plus",
-                messages=[
-                    {"role": "system", "content": system_role},
-                    *st.session_state.messages,
-                    {"role": "user", "content": input_text}
-                ],
-                stream=True,
-            )
-            prompts_text = ""
-            response_container = st.empty()  # Create an empty container to update
-            for chunk in response:
-                if hasattr(chunk, "choices") and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if hasattr(delta, "content") and delta.content:
-                        prompts_text += delta.content
-                        response_container.markdown(prompts_text)  # Update the container
+            prompts_text, _ = render_stream(stream_chat([
+                {"role": "system", "content": system_role},
+                *st.session_state.messages,
+                {"role": "user", "content": input_text}
+            ], user=st.session_state.get('user')), method="markdown")
             st.session_state.writing_prompts = prompts_text.split("\n")
             st.success("写作提示生成完成！")
         except Exception as e:
@@ -1,34 +1,21 @@
-from openai import OpenAI
+from utils.llm_gateway import stream_chat
+from utils.stream_renderer import render_stream
 import streamlit as st
-import os
-import json
-from sqlalchemy.orm import sessionmaker
-from models.database import engine, Base
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, MyGoals
-from datetime import datetime
 from dotenv import load_dotenv
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
 # 创建数据库会话
-Session = sessionmaker(bind=engine)
-session = Session()
+session = ScopedSession  # 指向 main() 本次重跑所在工作单元的会话
 
 # 定义系统角色
 system_role = """
 你是一名医学研究领域的专家，擅长科研方案设计与开题报告撰写。
 """
 
-# 初始化阿里云百炼 API 客户端
-try:
-    client = OpenAI(
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-except Exception as e:
-    raise Exception(f"初始化阿里云百炼 API 客户端失败，请检查配置。错误信息: {e}")
-
 def generate_plan_with_ai(my_topic: str):
     """使用 AI 大模型生成方案"""
     prompt = f"""
@@ -48,21 +35,12 @@ def generate_plan_with_ai(my_topic: str):
     5.预期成果
     """
     try:
-        completion = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
-                {"role": "system", "content": system_role},
-                {"role": "user", "content": prompt}
-            ],
-            stream=True,
-            stream_options={"include_usage": True}
-        )
-        for chunk in completion:
-            if hasattr(chunk, "choices") and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta
-                if hasattr(delta, "content") and delta.content:
-                    content = delta.content
-                    yield content  # 逐步返回内容
+        stream = stream_chat([
+            {"role": "system", "content": system_role},
+            {"role": "user", "content": prompt}
+        ], cache=True, user=st.session_state.get('user'))
+        yield from stream  # 逐步返回内容
+        return stream.usage
     except Exception as e:
         raise Exception(f"调用阿里云百炼 API 失败，请检查配置。错误信息: {e}")
 
@@ -94,6 +72,7 @@ def display_my_plans(db, user_id: int):
             with st.expander(goal.my_topics[:30] + "...", expanded=False):
                 st.write(goal.my_plans)
 
+@unit_of_work
 def main():
     st.title("我的方案")
     
@@ -120,14 +99,8 @@ def main():
     if st.button("生成我的方案", key="generate_plan_button"):
         # 调用 AI 生成方案
         try:
-            # 创建一个占位符用于逐步更新显示内容
-            placeholder = st.empty()
-            
             # 调用 AI 生成方案，并逐步显示
-            plan = ""
-            for chunk in generate_plan_with_ai(selected_goal.my_topics):
-                plan += chunk
-                placeholder.write(plan)  # 逐步更新显示内容
+            plan, _ = render_stream(generate_plan_with_ai(selected_goal.my_topics))
             st.success("方案生成完成！")
             
             # 更新 my_goals 表中的 my_plans 字段
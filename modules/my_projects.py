@@ -4,8 +4,7 @@ import numpy as np
 import os
 import json
 from dotenv import load_dotenv
-from sqlalchemy.orm import sessionmaker
-from models.database import engine, Base
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, Project, DataFile, CleaningReport
 from datetime import datetime
 from sklearn.impute import SimpleImputer
@@ -15,8 +14,7 @@ import plotly.express as px
 load_dotenv()
 
 # 数据库会话管理
-Session = sessionmaker(bind=engine)
-session = Session()
+session = ScopedSession  # 指向 main() 本次重跑所在工作单元的会话
 
 def create_project(session, user_id, project_name):
     new_project = Project(user_id=user_id, project_name=project_name, created_at=datetime.now())
@@ -180,6 +178,7 @@ def display_analysis_results(data):
     else:
         st.info("数据中没有数值列，无法进行相关性分析。")
 
+@unit_of_work
 def main():
     st.title("我的项目")
     
@@ -340,9 +339,6 @@ def main():
             st.info("请先上传数据文件并完成清洗，然后点击“展示分析结果”以继续。")
     except Exception as e:
         st.error(f"发生未知错误: {e}")
-    finally:
-        # 延迟关闭会话，确保不会中断用户操作
-        pass  # 移除 session.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
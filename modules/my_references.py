@@ -1,10 +1,13 @@
 import streamlit as st
-from openai import OpenAI
+from utils.llm_gateway import chat
+from utils.mesh_index import get_mesh_index
+from utils.pubmed_client import PUBMED_MAX_RESULTS
+from utils.literature_store import search_articles
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
-import xml.etree.ElementTree as ET
-from sqlalchemy.orm import sessionmaker
-from models.database import engine
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, MyGoals
 from dotenv import load_dotenv
 import os
@@ -13,20 +16,29 @@ import os
 load_dotenv()
 
 # 创建数据库会话
-Session = sessionmaker(bind=engine)
-session = Session()
+session = ScopedSession  # 指向 main() 本次重跑所在工作单元的会话
 
-# 初始化 OpenAI 客户端
-try:
-    client = OpenAI(
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-except Exception as e:
-    st.error(f"初始化 OpenAI 客户端失败，请检查配置。错误信息: {e}")
+# 检索阶段的并发与超时配置
+TERM_EXPANSION_WORKERS = int(os.getenv("TERM_EXPANSION_WORKERS", "8"))
+HTTP_TIMEOUT = float(os.getenv("LITERATURE_HTTP_TIMEOUT", "10"))
+MIN_MESH_TERMS = 5  # 假设少于 5 个结果时需要补充
+
+# 线程共享的 HTTP 连接池
+http = requests.Session()
+http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=TERM_EXPANSION_WORKERS))
+
+# MeSH 描述词查询（不调用 Streamlit，可在工作线程中运行）
+def lookup_mesh_descriptors(keywords, match="exact", year="current", limit=10):
+    # 优先查询本地 MeSH 索引，未命中时才请求 NLM 接口
+    mesh_index = get_mesh_index()
+    if mesh_index is not None:
+        descriptors = []
+        for keyword in keywords:
+            descriptors.extend(mesh_index.lookup(keyword, match=match, limit=limit))
+        descriptors = list(dict.fromkeys(descriptors))[:limit]
+        if descriptors:
+            return descriptors
 
-# MeSH 的 API 调用
-def get_mesh_terms(keywords, match="exact", year="current", limit=10):
     lookup_descriptor_url = "https://id.nlm.nih.gov/mesh/lookup/descriptor"
     params = {
         "label": " OR ".join(keywords),
@@ -34,26 +46,12 @@ def get_mesh_terms(keywords, match="exact", year="current", limit=10):
         "year": year,
         "limit": limit
     }
-    try:
-        response = requests.get(lookup_descriptor_url, params=params)
-        response.raise_for_status()
-        results = response.json()
-        if results:
-            descriptors = [result["label"] for result in results]
-            st.write(f"在 MeSH 中找到相关描述词: {descriptors}")
-            return descriptors
-        else:
-            st.write(f"在 MeSH 中未找到相关描述词，将尝试使用 AI 生成同义词")
-            return []
-    except requests.RequestException as e:
-        st.error(f"MeSH API 请求失败: {e}")
-        return []
-    except (KeyError, ValueError, IndexError) as e:
-        st.error(f"解析 MeSH API 响应失败: {e}")
-        return []
+    response = http.get(lookup_descriptor_url, params=params, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return [result["label"] for result in response.json() or []]
 
-# 使用大模型生成同义词
-def generate_synonyms_with_ai(keyword):
+# 请求大模型生成同义词（不调用 Streamlit，可在工作线程中运行）
+def request_synonyms(keyword, user=None):
     prompt = f"""
     你是一名医学领域的专家，请为以下关键词生成多个相关的同义词或近义词：
     关键词：{keyword}
@@ -62,47 +60,68 @@ def generate_synonyms_with_ai(keyword):
         "synonyms": ["同义词1", "同义词2", "同义词3"]
     }}
     """
+    response = chat(
+        [
+            {"role": "system", "content": "你是一名医学领域的专家。"},
+            {"role": "user", "content": prompt}
+        ],
+        cache=True,
+        user=user,
+        response_format={"type": "json_object"}  # 强制返回 JSON 格式
+    )
+    if not response:
+        raise Exception("AI 没有返回任何内容，请检查输入或 API 配置。")
+    return response, json.loads(response).get("synonyms", [])
+
+# 扩展单个关键词：先查 MeSH，结果不足时再调用 AI；返回词表和待显示的消息
+def expand_term(value):
+    messages = []
     try:
-        completion = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
-                {"role": "system", "content": "你是一名医学领域的专家。"},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},  # 强制返回 JSON 格式
-            stream=False
-        )
-        response = completion.choices[0].message.content
-        
-        # 打印 AI 原始响应，用于调试
-        st.write(f"AI 原始响应: {response}")
-        
-        if not response:
-            raise Exception("AI 没有返回任何内容，请检查输入或 API 配置。")
-        
-        # 解析 JSON 响应
-        synonyms = json.loads(response).get("synonyms", [])
-        st.write(f"AI 生成的同义词: {synonyms}")
-        return synonyms
+        mesh_terms = lookup_mesh_descriptors([value], match="contains", year="current", limit=10)
+        if mesh_terms:
+            messages.append(("write", f"在 MeSH 中找到相关描述词: {mesh_terms}"))
+        else:
+            messages.append(("write", f"在 MeSH 中未找到相关描述词，将尝试使用 AI 生成同义词"))
+    except requests.RequestException as e:
+        mesh_terms = []
+        messages.append(("error", f"MeSH API 请求失败: {e}"))
+    except (KeyError, ValueError, IndexError, TypeError) as e:
+        mesh_terms = []
+        messages.append(("error", f"解析 MeSH API 响应失败: {e}"))
+
+    if len(mesh_terms) >= MIN_MESH_TERMS:
+        return mesh_terms, messages
+    try:
+        # 同义词扩展由同一用户一次性并发发起，不占用单用户并发名额，仍受全局并发限制
+        _, ai_terms = request_synonyms(value)
+        messages.append(("write", f"AI 生成的同义词: {ai_terms}"))
     except Exception as e:
-        st.error(f"调用 AI 生成同义词失败，请检查配置。错误信息: {e}")
-        return []
+        ai_terms = []
+        messages.append(("error", f"调用 AI 生成同义词失败，请检查配置。错误信息: {e}"))
+    return list(dict.fromkeys(mesh_terms + ai_terms)), messages  # 合并并去重，保持顺序
 
 # 合并 MeSH 和 AI 生成的同义词
 def get_combined_terms(keywords):
+    # 按 PICOS 顺序展开所有关键词（去重）
+    values = list(dict.fromkeys(value for values in keywords.values() for value in values))
+    results = [None] * len(values)
+
+    if values:
+        progress = st.progress(0.0, text="正在获取同义词...")
+        with ThreadPoolExecutor(max_workers=min(TERM_EXPANSION_WORKERS, len(values))) as pool:
+            futures = {pool.submit(expand_term, value): i for i, value in enumerate(values)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                results[i] = future.result()
+                progress.progress(done / len(values), text=f"已完成 {done}/{len(values)}：{values[i]}")
+        progress.empty()
+
+    # 按原始顺序显示每个关键词的结果
     combined_terms = {}
-    for key, values in keywords.items():
-        # 对每个 PICOS 项逐一处理
-        for value in values:
-            # 先尝试从 MeSH 获取同义词
-            mesh_terms = get_mesh_terms([value], match="contains", year="current", limit=10)
-            
-            # 如果 MeSH 结果不足，调用 AI 生成同义词
-            if len(mesh_terms) < 5:  # 假设少于 5 个结果时需要补充
-                ai_terms = generate_synonyms_with_ai(value)
-                combined_terms[value] = list(set(mesh_terms + ai_terms))  # 合并并去重
-            else:
-                combined_terms[value] = mesh_terms
+    for value, (terms, messages) in zip(values, results):
+        for level, message in messages:
+            getattr(st, level)(f"{value}：{message}")
+        combined_terms[value] = terms
     
     # 显示 JSON 格式的同义词
     st.write(f"获取的 MeSH 主题词和同义词（JSON 格式）：")
@@ -125,16 +144,15 @@ def extract_keywords_with_ai(topic):
     用户输入：{topic}
     """
     try:
-        completion = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
+        response = chat(
+            [
                 {"role": "system", "content": "你是一名医学信息检索领域的专家。"},
                 {"role": "user", "content": prompt}
             ],
-            response_format={"type": "json_object"},  # 强制返回 JSON 格式
-            stream=False
+            cache=True,
+            user=st.session_state.get('user'),
+            response_format={"type": "json_object"}  # 强制返回 JSON 格式
         )
-        response = completion.choices[0].message.content
         
         # 打印 AI 原始响应，用于调试
         st.write(f"AI 原始响应: {response}")
@@ -181,57 +199,23 @@ def generate_query(picos, terms):
     
     return " AND ".join(query)
 
-# PubMed检索
-def pubmed_search(query):
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-    params = {
-        "db": "pubmed",
-        "term": query,
-        "retmax": 10  # 最多返回10条结果，可根据需要调整
-    }
-    response = requests.get(base_url, params=params)
-    root = ET.fromstring(response.content)
-    id_list = root.find("IdList")
-    pubmed_ids = [id.text for id in id_list.findall("Id")]
-    # 获取文献详细信息
-    base_fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-    fetch_params = {
-        "db": "pubmed",
-        "id": ",".join(pubmed_ids),
-        "retmode": "xml"
-    }
-    fetch_response = requests.get(base_fetch_url, fetch_params)
-    fetch_root = ET.fromstring(fetch_response.content)
-    articles = []
-    for article in fetch_root.findall('.//PubmedArticle'):
-        title = article.find('.//ArticleTitle').text
-        authors = []
-        for author in article.findall('.//Author'):
-            last_name_elem = author.find('LastName')
-            first_name_elem = author.find('ForeName')
-            if last_name_elem is not None and first_name_elem is not None:
-                last_name = last_name_elem.text
-                first_name = first_name_elem.text
-                authors.append(f"{first_name} {last_name}")
-            else:
-                # 如果没有分开的姓和名，尝试获取全名
-                collective_name_elem = author.find('CollectiveName')
-                if collective_name_elem is not None:
-                    authors.append(collective_name_elem.text)
-                else:
-                    continue
-        pub_date = article.find('.//PubMedPubDate')
-        year = pub_date.find('Year').text if pub_date is not None and pub_date.find('Year') is not None else 'N/A'
-        journal = article.find('.//Title').text
-        articles.append({
-            "title": title,
-            "authors": authors,
-            "year": year,
-            "journal": journal
-        })
-    return articles
+# PubMed检索：返回命中总数和逐篇解析的文献生成器（优先使用本地文献库）
+def pubmed_search(query, max_results=PUBMED_MAX_RESULTS):
+    return search_articles(query, max_results)
+
+# 显示单篇文献
+def render_article(container, result):
+    with container:
+        st.markdown(f"**{result['title']}**")
+        st.write("作者:", ", ".join(result["authors"]))
+        st.write("发表年份:", result["year"], " 期刊:", result["journal"], " PMID:", result["pmid"])
+        if result["abstract"]:
+            with st.expander("摘要"):
+                st.write(result["abstract"])
+        st.write("-" * 50)
 
 # 主函数
+@unit_of_work
 def main():
     st.title("医学文献检索与管理")
     
@@ -301,24 +285,27 @@ def main():
     
     # 步骤 4：PubMed 检索
     if hasattr(st.session_state, 'query') and st.session_state.step >= 3:
+        max_results = st.number_input("最多获取文献数", min_value=10, max_value=10000, value=PUBMED_MAX_RESULTS, step=50)
         if st.button("在 PubMed 中检索") and st.session_state.step == 3:
             try:
                 query = st.session_state.query
                 st.write(f"正在使用以下布尔逻辑检索式查询 PubMed 数据库：{query}")
                 
-                # 显示加载动画
                 with st.spinner("正在查询 PubMed 数据库，请稍候..."):
-                    pubmed_results = pubmed_search(query)
+                    total, pubmed_results = pubmed_search(query, int(max_results))
                 
-                if not pubmed_results:
+                if not total:
                     st.warning("未找到相关文献，请尝试调整布尔逻辑检索式。")
                 else:
-                    for result in pubmed_results:
-                        st.write("标题:", result["title"])
-                        st.write("作者:", ", ".join(result["authors"]))
-                        st.write("发表年份:", result["year"])
-                        st.write("期刊:", result["journal"])
-                        st.write("-" * 50)
+                    expected = min(total, int(max_results))
+                    st.write(f"PubMed 共命中 {total} 篇文献，正在获取前 {expected} 篇。")
+                    progress = st.progress(0.0)
+                    container = st.container()
+                    # 文献按批次流式获取，每解析一篇就显示一篇
+                    for done, result in enumerate(pubmed_results, start=1):
+                        render_article(container, result)
+                        progress.progress(min(done / expected, 1.0), text=f"已获取 {done}/{expected}")
+                    progress.empty()
             except Exception as e:
                 st.error(f"PubMed 检索失败: {e}")
 
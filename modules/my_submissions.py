@@ -1,29 +1,17 @@
 import streamlit as st
-from sqlalchemy.orm import sessionmaker
-from models.database import engine, Base
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, Manuscript, ReferencePaper, ReviewerComment
 from dotenv import load_dotenv
-import os
 import pdfplumber
-from openai import OpenAI
+from utils.llm_gateway import stream_chat
+from utils.stream_renderer import render_stream
 from datetime import datetime
 
 # Load environment variables
 load_dotenv()
 
 # Create database session
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# Initialize OpenAI client
-try:
-    client = OpenAI(
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-except Exception as e:
-    st.error(f"初始化 OpenAI 客户端失败，请检查配置。错误信息: {e}")
-    raise
+session = ScopedSession  # 指向 main() 本次重跑所在工作单元的会话
 
 # Define system role
 system_role = """
@@ -53,30 +41,27 @@ def extract_text_from_pdf(file):
 # Helper function: Call OpenAI model for style analysis or text generation
 def call_language_model(prompt, max_tokens=500, temperature=0.7):
     try:
-        response = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
+        parts = []
+        stream = stream_chat(
+            [
                 {"role": "system", "content": system_role},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=max_tokens,
             temperature=temperature,
-            stream=True,
+            user=st.session_state.get('user'),
         )
-        full_response = ""
-        for chunk in response:
-            if hasattr(chunk, "choices") and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta
-                if hasattr(delta, "content") and delta.content:
-                    content = delta.content
-                    full_response += content
-                    yield content  # Stream content
-        st.session_state.full_response = full_response  # Store complete response
+        for content in stream:
+            parts.append(content)
+            yield content  # Stream content
+        st.session_state.full_response = "".join(parts)  # Store complete response
+        return stream.usage
     except Exception as e:
         st.error(f"调用 OpenAI 模型失败：{e}")
         raise
 
 # Main program
+@unit_of_work
 def main():
     st.title("我的投稿助手")
 
@@ -127,11 +112,7 @@ def analyze_reference_paper(user):
         # 开始分析按钮
         if st.button("开始分析", key="analyze_button"):
             prompt = f"请分析以下参考文稿的{analysis_type}：\n{content}"
-            placeholder = st.empty()  # 创建一个占位符
-            analysis_result = ""
-            for chunk in call_language_model(prompt):
-                analysis_result += chunk
-                placeholder.write(analysis_result)  # 流式输出内容
+            analysis_result, _ = render_stream(call_language_model(prompt))  # 流式输出内容
             st.success("风格分析完成！")
 
             # 将生成的结果存储到 session_state
@@ -189,11 +170,7 @@ def generate_manuscript(user):
             return
 
         prompt = f"根据以下参考文稿的风格和创作规范生成文稿：\n\n参考文稿风格：{reference.style}\n\n创作规范：{guidelines}"
-        placeholder = st.empty()  # Create a placeholder
-        generated_content = ""
-        for chunk in call_language_model(prompt):
-            generated_content += chunk
-            placeholder.write(generated_content)  # Stream content
+        generated_content, _ = render_stream(call_language_model(prompt))  # Stream content
         st.success("文稿生成完成！")
 
         # Save generated manuscript to database
@@ -243,11 +220,7 @@ def handle_reviewer_feedback(user):
 
         if action == "修改原文":
             prompt = f"根据以下审稿意见修改原文：\n\n原文：{manuscript.content}\n\n审稿意见：{reviewer_comment}"
-            placeholder = st.empty()  # Create a placeholder
-            revised_content = ""
-            for chunk in call_language_model(prompt):
-                revised_content += chunk
-                placeholder.write(revised_content)  # Stream content
+            revised_content, _ = render_stream(call_language_model(prompt))  # Stream content
             st.success("原文修改完成！")
 
             # Save revised content to database
@@ -268,11 +241,7 @@ def handle_reviewer_feedback(user):
 
         elif action == "撰写回复信":
             prompt = f"根据以下审稿意见撰写回复信：\n\n审稿意见：{reviewer_comment}"
-            placeholder = st.empty()  # Create a placeholder
-            reply_letter = ""
-            for chunk in call_language_model(prompt):
-                reply_letter += chunk
-                placeholder.write(reply_letter)  # Stream content
+            reply_letter, _ = render_stream(call_language_model(prompt))  # Stream content
             st.success("回复信生成完成！")
 
             # Save reply letter to database
@@ -1,10 +1,9 @@
-from openai import OpenAI
+from utils.llm_gateway import stream_chat
+from utils.stream_renderer import render_stream
 import streamlit as st
-import os
-import json
-from sqlalchemy.orm import sessionmaker
-from models.database import engine, Base
+from models.database import ScopedSession, unit_of_work
 from models.project_models import User, NursingTopic, MyGoals
+from utils.conversation_store import to_chat, topic_messages
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -16,15 +15,6 @@ system_role = """
 你是医学研究领域的专家，特别擅长护理方面的科研选题。
 """
 
-# 初始化阿里云百炼 API 客户端
-try:
-    client = OpenAI(
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-except Exception as e:
-    raise Exception(f"初始化阿里云百炼 API 客户端失败，请检查配置。错误信息: {e}")
-
 
 def generate_plan_with_ai(conversation_history: str, user_input: str):
     """使用 AI 大模型生成方案"""
@@ -32,21 +22,12 @@ def generate_plan_with_ai(conversation_history: str, user_input: str):
     {conversation_history}\n{user_input}
     """
     try:
-        completion = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
-                {"role": "system", "content": system_role},
-                {"role": "user", "content": prompt}
-            ],
-            stream=True,
-            stream_options={"include_usage": True}
-        )
-        for chunk in completion:
-            if hasattr(chunk, "choices") and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta
-                if hasattr(delta, "content") and delta.content:
-                    content = delta.content
-                    yield content  # 逐步返回内容
+        stream = stream_chat([
+            {"role": "system", "content": system_role},
+            {"role": "user", "content": prompt}
+        ], user=st.session_state.get('user'))
+        yield from stream  # 逐步返回内容
+        return stream.usage
     except Exception as e:
         raise Exception(f"调用阿里云百炼 API 失败，请检查配置。错误信息: {e}")
 
@@ -84,11 +65,11 @@ def display_my_topics(db, user_id: int):
                 st.write(goal.my_topics)
 
 
+@unit_of_work
 def main():
     st.title("我的选题")
-    # 创建数据库会话
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    # 本次重跑的数据库会话，由 @unit_of_work 提交并关闭
+    session = ScopedSession()
     try:
         # 获取当前用户
         username = st.session_state.get('user')
@@ -116,7 +97,7 @@ def main():
 
         # 显示 conversation_history
         st.write("### 对话历史")
-        conversation_history = json.loads(selected_topic.conversation_history)
+        conversation_history = to_chat(topic_messages(session, selected_topic.id))
         for message in conversation_history:
             if message["role"] == "assistant":
                 st.markdown(message["content"])
@@ -134,14 +115,8 @@ def main():
 
             # 调用OpenAI模型生成回答
             try:
-                # 创建一个占位符用于逐步更新显示内容
-                placeholder = st.empty()
-
                 # 调用 AI 生成方案，并逐步显示
-                plan = ""
-                for chunk in generate_plan_with_ai(ai_input, user_input):
-                    plan += chunk
-                    placeholder.write(plan)  # 逐步更新显示内容
+                plan, _ = render_stream(generate_plan_with_ai(ai_input, user_input))
                 st.success("方案生成完成！")
 
                 # 设置保存按钮状态
@@ -161,8 +136,6 @@ def main():
     except Exception as e:
         session.rollback()
         st.error(f"数据库操作发生错误: {e}")
-    finally:
-        session.close()
 
 
 if __name__ == "__main__":
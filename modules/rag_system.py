@@ -0,0 +1,902 @@
+import heapq
+import json
+import logging
+import math
+import os
+import pickle
+import random
+import threading
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from models.database import SessionLocal
+from models.project_models import Article, ConversationMessage, Manuscript, MyGoals, NursingTopic, Writing
+from utils.chunking import chunk_chat, chunk_text
+from utils.conversation_store import to_chat, topic_messages
+from utils.embedding_cache import cached_encode
+from utils.embeddings import EMBEDDING_DEVICE
+from utils.lexical_index import BM25Index, reciprocal_rank_fusion
+from utils.quantization import QuantizedIndex
+from utils.segment_store import SegmentStore
+
+try:
+    import hnswlib
+except ImportError:  # 未安装 hnswlib 时使用纯 NumPy 实现的 HNSW 图
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+# 加载环境变量
+load_dotenv()
+
+# 检索引擎配置
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join("data", "rag"))
+RAG_HNSW_THRESHOLD = int(os.getenv("RAG_HNSW_THRESHOLD", "50000"))  # 超过该向量数时由暴力检索切换到 HNSW
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "16"))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+RAG_HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+RAG_EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "64"))
+RAG_FILTER_OVERSAMPLE = 4  # 带过滤条件检索时多取的倍数
+RAG_REFRESH_INTERVAL = float(os.getenv("RAG_REFRESH_INTERVAL", "1"))  # 检查其他进程写入的最小间隔（秒）
+RAG_GRAPH_SAVE_ROWS = int(os.getenv("RAG_GRAPH_SAVE_ROWS", "10000"))  # 图索引新增多少行后重新落盘
+RAG_GRAPH_ADD_BLOCK = 65536  # 构建图或量化索引时每次读取的向量数
+RAG_QUANTIZATION = os.getenv("RAG_QUANTIZATION", "").lower()  # int8 / pq；留空则不量化，大语料使用 HNSW
+RAG_QUANT_MIN_ROWS = int(os.getenv("RAG_QUANT_MIN_ROWS", "10000"))  # 启用量化检索的最少向量数
+RAG_QUANT_RESCORE = os.getenv("RAG_QUANT_RESCORE", "1") == "1"  # 是否用全精度向量重新计算候选得分
+RAG_QUANT_RESCORE_FACTOR = int(os.getenv("RAG_QUANT_RESCORE_FACTOR", "4"))  # 重新打分的候选数为 k 的倍数
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "50"))  # 混合检索时每一路取的候选数
+RAG_LEXICAL_WEIGHT = float(os.getenv("RAG_LEXICAL_WEIGHT", "1.0"))  # 融合时 BM25 排名的权重
+RAG_RERANK_MODEL = os.getenv("RAG_RERANK_MODEL", "")  # 交叉编码器模型名，留空则不重排
+RAG_RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "20"))
+
+
+def normalize(vectors):
+    """
+    Return the vectors as a C-contiguous float32 matrix with unit-length rows.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms)
+
+
+class GraphIndex:
+    """
+    A small NumPy implementation of HNSW (Malkov & Yashunin), used when
+    hnswlib is not installed. Distances are inner products on unit vectors.
+    """
+
+    def __init__(self, dim, m=RAG_HNSW_M, ef_construction=RAG_HNSW_EF_CONSTRUCTION, ef_search=RAG_HNSW_EF_SEARCH):
+        self.dim = dim
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_mult = 1 / math.log(m)
+        self.vectors_ = np.zeros((1024, dim), dtype=np.float32)
+        self.levels = {}  # label -> 最高层
+        self.links = [{}]  # links[层][label] -> 邻居 label 列表
+        self.deleted = set()
+        self.entry = None
+        self.max_level = -1
+        self.rng = random.Random(0)
+
+    def __len__(self):
+        return len(self.levels) - len(self.deleted)
+
+    def _search_layer(self, query, entries, ef, level):
+        vectors = self.vectors_
+        visited = set(entries)
+        scores = (vectors[entries] @ query).tolist()
+        candidates = [(-s, e) for s, e in zip(scores, entries)]
+        results = [(s, e) for s, e in zip(scores, entries)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        links = self.links[level]
+        while candidates:
+            negative, node = heapq.heappop(candidates)
+            if -negative < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in links.get(node, ()) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for n, s in zip(neighbors, (vectors[neighbors] @ query).tolist()):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(results, (s, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return results
+
+    def _select(self, candidates, m):
+        # 启发式选边：只保留比已选邻居更靠近目标的候选，保持图的连通性
+        selected, pruned = [], []
+        for score, node in sorted(candidates, reverse=True):
+            if len(selected) >= m:
+                break
+            if selected and float((self.vectors_[selected] @ self.vectors_[node]).max()) > score:
+                pruned.append(node)
+            else:
+                selected.append(node)
+        return selected + pruned[:m - len(selected)]
+
+    def _insert(self, label, vector):
+        if label >= len(self.vectors_):
+            extra = max(label + 1, 2 * len(self.vectors_)) - len(self.vectors_)
+            self.vectors_ = np.vstack([self.vectors_, np.zeros((extra, self.dim), dtype=np.float32)])
+        self.vectors_[label] = vector
+        level = int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+        self.levels[label] = level
+        while len(self.links) <= level:
+            self.links.append({})
+        for l in range(level + 1):
+            self.links[l][label] = []
+        if self.entry is None:
+            self.entry, self.max_level = label, level
+            return
+
+        entries = [self.entry]
+        for l in range(self.max_level, level, -1):
+            entries = [max(self._search_layer(vector, entries, 1, l))[1]]
+        for l in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(vector, entries, self.ef_construction, l)
+            m_max = self.m0 if l == 0 else self.m
+            neighbors = self._select([f for f in found if f[1] != label], self.m)
+            self.links[l][label] = neighbors
+            for n in neighbors:
+                links = self.links[l][n]
+                links.append(label)
+                if len(links) > m_max:
+                    scores = (self.vectors_[links] @ self.vectors_[n]).tolist()
+                    self.links[l][n] = self._select(list(zip(scores, links)), m_max)
+            entries = [node for _, node in found]
+        if level > self.max_level:
+            self.entry, self.max_level = label, level
+
+    def add(self, labels, vectors):
+        for label, vector in zip(np.asarray(labels).tolist(), vectors):
+            # label 是分段存储中的行号，同一行不会写入两次
+            if label not in self.levels:
+                self._insert(label, vector)
+
+    def delete(self, labels):
+        self.deleted.update(np.asarray(labels).tolist())
+
+    def search(self, query, k, ef=None):
+        if self.entry is None or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        entries = [self.entry]
+        for l in range(self.max_level, 0, -1):
+            entries = [max(self._search_layer(query, entries, 1, l))[1]]
+        ef = max(ef or self.ef_search, k + min(len(self.deleted), k))
+        found = sorted(self._search_layer(query, entries, ef, 0), reverse=True)
+        found = [(s, n) for s, n in found if n not in self.deleted][:k]
+        return np.array([n for _, n in found], dtype=np.int64), np.array([s for s, _ in found], dtype=np.float32)
+
+    def save(self, path):
+        with open(path + ".graph", "wb") as f:
+            state = dict(self.__dict__, vectors_=self.vectors_[:max(self.levels, default=-1) + 1])
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return [".graph"]
+
+    @classmethod
+    def load(cls, path, dim):
+        index = cls(dim)
+        with open(path + ".graph", "rb") as f:
+            index.__dict__.update(pickle.load(f))
+        index.vectors_ = np.array(index.vectors_, dtype=np.float32).reshape(-1, dim)
+        return index
+
+
+class HnswlibIndex:
+    """
+    HNSW through hnswlib, used for large corpora when it is installed.
+    """
+
+    def __init__(self, dim, m=RAG_HNSW_M, ef_construction=RAG_HNSW_EF_CONSTRUCTION, ef_search=RAG_HNSW_EF_SEARCH,
+                 capacity=RAG_HNSW_THRESHOLD * 2):
+        self.dim = dim
+        self.index = hnswlib.Index(space="ip", dim=dim)
+        self.index.init_index(max_elements=capacity, M=m, ef_construction=ef_construction)
+        self.index.set_ef(ef_search)
+        self.ef_search = ef_search
+        self.deleted = set()
+
+    def __len__(self):
+        return self.index.element_count - len(self.deleted)
+
+    def add(self, labels, vectors):
+        needed = self.index.element_count + len(labels)
+        if needed > self.index.max_elements:
+            self.index.resize_index(max(needed, 2 * self.index.max_elements))
+        self.index.add_items(vectors, np.asarray(labels, dtype=np.int64))
+
+    def delete(self, labels):
+        for label in np.asarray(labels).tolist():
+            if label not in self.deleted:
+                try:
+                    self.index.mark_deleted(label)
+                except RuntimeError:  # 标签不在图中或已标记删除
+                    pass
+                self.deleted.add(label)
+
+    def search(self, query, k, ef=None):
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        self.index.set_ef(max(ef or self.ef_search, k))
+        labels, distances = self.index.knn_query(query, k=k)
+        return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+    def save(self, path):
+        self.index.save_index(path + ".hnsw")
+        return [".hnsw"]
+
+    @classmethod
+    def load(cls, path, dim):
+        index = cls.__new__(cls)
+        index.dim = dim
+        index.ef_search = RAG_HNSW_EF_SEARCH
+        index.index = hnswlib.Index(space="ip", dim=dim)
+        index.index.load_index(path + ".hnsw")
+        index.index.set_ef(RAG_HNSW_EF_SEARCH)
+        index.deleted = set()  # 由 RAGIndex 根据存储中的删除标记重新应用
+        return index
+
+
+def make_hnsw_index(dim):
+    return HnswlibIndex(dim) if hnswlib is not None else GraphIndex(dim)
+
+
+def make_search_index(dim):
+    """
+    Create the approximate index RAGIndex builds over large stores: quantized codes when RAG_QUANTIZATION is set, HNSW otherwise.
+    """
+    return QuantizedIndex(dim, RAG_QUANTIZATION) if RAG_QUANTIZATION else make_hnsw_index(dim)
+
+
+def search_index_threshold():
+    return RAG_QUANT_MIN_ROWS if RAG_QUANTIZATION else RAG_HNSW_THRESHOLD
+
+
+class RAGIndex:
+    """
+    A vector index with string ids and per-id metadata, stored in a
+    SegmentStore under ``directory``.
+
+    Small corpora are searched exactly over the memory-mapped float16
+    segments. Above RAG_HNSW_THRESHOLD live vectors an HNSW graph (hnswlib
+    when installed, GraphIndex otherwise) is built over the store and saved
+    next to it; with RAG_QUANTIZATION set, int8 or PQ codes are used instead
+    above RAG_QUANT_MIN_ROWS, with optional full-precision re-scoring.
+
+    Every process picks up rows and tombstones written by other processes
+    on its next refresh. Vectors are L2-normalised, so scores are cosine
+    similarities. A BM25 index over the same rows backs keyword and hybrid
+    search.
+    """
+
+    def __init__(self, directory=RAG_INDEX_DIR):
+        self.directory = directory
+        self.store = SegmentStore(directory)
+        self.graph = None
+        self.labels = {}  # 外部 id -> label
+        self.documents = {}  # 源文档 id -> 其分块的外部 id
+        self.lexical = None  # BM25 倒排索引，首次关键词检索时构建
+        self.lexical_sources = {}  # metadata 中的 source -> 其分块的 label，供过滤检索先圈定候选
+        self._generation = None
+        self._synced_rows = 0
+        self._synced_tombstones = 0
+        self._graph_rows = 0  # 图已覆盖的行数
+        self._graph_saved_rows = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.RLock()
+        self._sync()
+        self._load_graph()
+
+    @property
+    def dim(self):
+        return self.store.dim
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.labels
+
+    def _track(self, label):
+        doc_id = self.store.ids[label]
+        self.labels[doc_id] = label
+        source = self.store.doc_ids[label]
+        if source is not None:
+            self.documents.setdefault(source, set()).add(doc_id)
+
+    def _untrack(self, label):
+        doc_id = self.store.ids[label]
+        if self.labels.get(doc_id) != label:
+            return
+        del self.labels[doc_id]
+        source = self.store.doc_ids[label]
+        if source in self.documents:
+            self.documents[source].discard(doc_id)
+            if not self.documents[source]:
+                del self.documents[source]
+
+    def _sync(self):
+        # 将分段存储中新增的行和删除标记同步到 id 映射与图索引
+        store = self.store
+        if store.generation != self._generation:
+            self.labels, self.documents, self.lexical, self.lexical_sources = {}, {}, None, {}
+            self._synced_rows = self._synced_tombstones = 0
+            self.graph, self._graph_rows, self._graph_saved_rows = None, 0, 0
+            self._generation = store.generation
+        for label in range(self._synced_rows, store.rows):
+            if store.alive[label]:
+                self._track(label)
+                if self.lexical is not None:
+                    self._index_lexical(self.lexical, label)
+        self._synced_rows = store.rows
+        removed = store.tombstones[self._synced_tombstones:]
+        for label in removed:
+            self._untrack(label)
+            if self.lexical is not None and label in self.lexical:
+                self._unindex_lexical(label)
+        self._synced_tombstones = len(store.tombstones)
+        if self.graph is not None:
+            self._extend_graph(removed)
+
+    def _extend_graph(self, removed=()):
+        store = self.store
+        new = [label for label in range(self._graph_rows, store.rows) if store.alive[label]]
+        # 分块读取向量，避免一次性把整个存储转换为 float32
+        for start in range(0, len(new), RAG_GRAPH_ADD_BLOCK):
+            block = new[start:start + RAG_GRAPH_ADD_BLOCK]
+            self.graph.add(block, store.vectors(block))
+        self._graph_rows = store.rows
+        removed = [label for label in removed if label < self._graph_rows]
+        if removed:
+            self.graph.delete(removed)
+
+    @staticmethod
+    def _lexical_text(metadata):
+        return "\n".join(part for part in (metadata.get("title"), metadata.get("content")) if part)
+
+    def _index_lexical(self, lexical, label):
+        metadata = self.store.metadata(label)
+        lexical.add(label, self._lexical_text(metadata))
+        self.lexical_sources.setdefault(metadata.get("source"), set()).add(label)
+
+    def _unindex_lexical(self, label):
+        metadata = self.store.metadata(label)
+        self.lexical.remove(label, self._lexical_text(metadata))
+        labels = self.lexical_sources.get(metadata.get("source"))
+        if labels is not None:
+            labels.discard(label)
+            if not labels:
+                del self.lexical_sources[metadata.get("source")]
+
+    def _ensure_lexical(self):
+        # BM25 索引由存储中各分块的标题与正文重建，与向量共用 label，之后随 _sync 增量维护
+        if self.lexical is None:
+            with self._lock:
+                if self.lexical is None:
+                    lexical = BM25Index()
+                    self.lexical_sources = {}
+                    for label in sorted(self.labels.values()):
+                        self._index_lexical(lexical, label)
+                    self.lexical = lexical
+        return self.lexical
+
+    def _graph_path(self, suffix=""):
+        return os.path.join(self.directory, "graph" + suffix)
+
+    def _load_graph(self):
+        if len(self) <= search_index_threshold():
+            return
+        try:
+            with open(self._graph_path(".json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = None
+        backends = {"GraphIndex": GraphIndex, "HnswlibIndex": HnswlibIndex, "QuantizedIndex": QuantizedIndex}
+        # 量化方式与当前配置不一致时重新构建
+        if meta and meta.get("kind") != (RAG_QUANTIZATION or None):
+            meta = None
+        if meta and meta["generation"] == self.store.generation and (meta["backend"] != "HnswlibIndex" or hnswlib):
+            self.graph = backends[meta["backend"]].load(self._graph_path(), self.dim)
+            self._graph_rows = self._graph_saved_rows = meta["rows"]
+            self._extend_graph(self.store.tombstones)
+        else:
+            self._build_graph()
+
+    def _build_graph(self):
+        self.graph = make_search_index(self.dim)
+        self._graph_rows = 0
+        self._extend_graph()
+        self.save_graph()
+
+    def save_graph(self):
+        """
+        Write the HNSW graph next to the store so other processes can load it instead of rebuilding.
+        """
+        with self._lock:
+            if self.graph is None:
+                return
+            tmp = self._graph_path(f".{os.getpid()}.tmp")
+            suffixes = self.graph.save(tmp)
+            for suffix in suffixes:
+                os.replace(tmp + suffix, self._graph_path(suffix))
+            meta = {"generation": self.store.generation, "rows": self._graph_rows,
+                    "backend": type(self.graph).__name__, "kind": getattr(self.graph, "kind", None)}
+            with open(tmp + ".json", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp + ".json", self._graph_path(".json"))
+            self._graph_saved_rows = self._graph_rows
+
+    def refresh(self, force=False):
+        """
+        Pick up changes committed by other processes, at most every RAG_REFRESH_INTERVAL seconds.
+        """
+        now = time.monotonic()
+        if not force and now - self._refreshed_at < RAG_REFRESH_INTERVAL:
+            return
+        self._refreshed_at = now
+        with self._lock:
+            if self.store.reload():
+                self._sync()
+            if self.graph is None:
+                self._load_graph()
+
+    def add(self, ids, vectors, metadatas=None):
+        """
+        Add or replace vectors.
+
+        :param ids: External ids, e.g. "article:12345#0".
+        :param vectors: One embedding per id.
+        :param metadatas: Optional dicts stored alongside each vector.
+        """
+        vectors = normalize(vectors)
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            self.refresh(force=True)
+            self.delete([doc_id for doc_id in ids if doc_id in self.labels])
+            self.store.append(list(ids), vectors, list(metadatas))
+            self._sync()
+            if self.graph is None and len(self) > search_index_threshold():
+                self._build_graph()
+
+    def delete(self, ids):
+        """
+        Remove vectors by external id. Unknown ids are ignored.
+        """
+        with self._lock:
+            self.refresh(force=True)
+            labels = [self.labels[doc_id] for doc_id in ids if doc_id in self.labels]
+            if labels:
+                self.store.delete(labels)
+                self._sync()
+
+    def replace_document(self, doc_id, ids, vectors, metadatas):
+        """
+        Swap all chunks of a source document for new ones.
+
+        :param doc_id: The source document id, e.g. "manuscript:3".
+        :param ids: Chunk ids; each metadata dict gets ``doc_id`` set.
+        """
+        with self._lock:
+            self.refresh(force=True)
+            self.delete(list(self.documents.get(doc_id, ())))
+            if ids:
+                self.add(ids, vectors, [dict(metadata, doc_id=doc_id) for metadata in metadatas])
+
+    def delete_document(self, doc_id):
+        """
+        Remove every chunk of a source document.
+        """
+        self.replace_document(doc_id, [], None, [])
+
+    def search(self, vector, k=5, where=None):
+        """
+        Find the nearest stored vectors.
+
+        :param vector: The query embedding.
+        :param k: Number of results.
+        :param where: Optional dict; only results whose metadata matches every item are returned.
+        :return: A list of (id, score, metadata), best first.
+        """
+        self.refresh()
+        if not self.labels:
+            return []
+        query = normalize(vector)[0]
+        fetch = k * RAG_FILTER_OVERSAMPLE if where else k
+        while True:
+            fetch = min(fetch, len(self.labels))
+            if isinstance(self.graph, QuantizedIndex):
+                with self._lock:
+                    labels, scores = self.graph.search(query, fetch * RAG_QUANT_RESCORE_FACTOR if RAG_QUANT_RESCORE
+                                                       else fetch)
+                if RAG_QUANT_RESCORE:
+                    labels, scores = self._rescore(query, labels, fetch)
+            elif self.graph is not None:
+                with self._lock:
+                    labels, scores = self.graph.search(query, fetch)
+            else:
+                labels, scores = self.store.search(query, fetch)
+            store = self.store
+            hits = [(store.ids[label], float(score), store.metadata(label))
+                    for label, score in zip(labels.tolist(), scores.tolist()) if store.alive[label]]
+            if where:
+                hits = [hit for hit in hits if all(hit[2].get(key) == value for key, value in where.items())]
+            # 过滤后不足 k 条时扩大候选范围重试
+            if len(hits) >= k or fetch >= len(self.labels):
+                return hits[:k]
+            fetch *= RAG_FILTER_OVERSAMPLE
+
+    def _rescore(self, query, labels, k):
+        # 用存储中的全精度向量重新计算量化检索候选的得分
+        if not len(labels):
+            return labels, np.empty(0, dtype=np.float32)
+        scores = self.store.vectors(labels) @ query
+        order = np.argsort(-scores)[:k]
+        return labels[order], scores[order]
+
+    def search_text(self, text, k=5, where=None):
+        """
+        Embed the text and search for it.
+        """
+        return self.search(embed_texts([text])[0], k, where)
+
+    def lexical_search(self, text, k=5, where=None):
+        """
+        Rank chunks by BM25 over their title and content.
+
+        :return: A list of (id, score, metadata), best first.
+        """
+        self.refresh()
+        with self._lock:
+            lexical = self._ensure_lexical()
+            # 按 source 过滤时只对该来源的分块打分，其余条件在取回 metadata 后再判断
+            allowed = self.lexical_sources.get(where["source"], set()) if where and "source" in where else None
+            rest = {key: value for key, value in (where or {}).items() if key != "source"}
+            ranked = lexical.search(text, len(lexical) if rest else k, allowed)
+        store, hits = self.store, []
+        for label, score in ranked:
+            if not store.alive[label]:
+                continue
+            metadata = store.metadata(label)
+            if where and not all(metadata.get(key) == value for key, value in where.items()):
+                continue
+            hits.append((store.ids[label], score, metadata))
+            if len(hits) >= k:
+                break
+        return hits
+
+    def hybrid_search(self, text, k=5, where=None, candidates=RAG_HYBRID_CANDIDATES, prefilter=False, rerank=None):
+        """
+        Combine BM25 and vector search with reciprocal-rank fusion.
+
+        Exact terms such as drug names or scale abbreviations are matched by
+        BM25, paraphrases by the embeddings; chunks found by both rank highest.
+
+        :param candidates: How many hits to take from each ranking before fusing.
+        :param prefilter: Only score the vectors of the lexical candidates
+            instead of searching the whole vector index. Much cheaper on large
+            stores, at the cost of missing chunks that share no terms with the query.
+        :param rerank: Re-order the fused top RAG_RERANK_CANDIDATES with a
+            cross-encoder; defaults to on when RAG_RERANK_MODEL is set.
+        :return: A list of (id, score, metadata), best first; scores are fused
+            RRF scores, or cross-encoder scores after reranking.
+        """
+        rerank = bool(RAG_RERANK_MODEL) if rerank is None else rerank
+        candidates = max(candidates, k, RAG_RERANK_CANDIDATES if rerank else 0)
+        lexical_hits = self.lexical_search(text, candidates, where)
+        query = embed_texts([text])[0]
+        if prefilter:
+            vector_hits = self._score_hits(query, lexical_hits)
+        else:
+            vector_hits = self.search(query, candidates, where)
+        metadata = {doc_id: meta for doc_id, _, meta in lexical_hits + vector_hits}
+        fused = reciprocal_rank_fusion([[doc_id for doc_id, _, _ in lexical_hits],
+                                        [doc_id for doc_id, _, _ in vector_hits]],
+                                       weights=[RAG_LEXICAL_WEIGHT, 1.0])
+        hits = [(doc_id, score, metadata[doc_id]) for doc_id, score in fused]
+        if rerank and hits:
+            hits = rerank_hits(text, hits[:RAG_RERANK_CANDIDATES]) + hits[RAG_RERANK_CANDIDATES:]
+        return hits[:k]
+
+    def _score_hits(self, query, hits):
+        # 只对给定候选计算余弦相似度，按得分重新排序
+        with self._lock:
+            labels = [self.labels[doc_id] for doc_id, _, _ in hits if doc_id in self.labels]
+            if not labels:
+                return []
+            scores = self.store.vectors(labels) @ normalize(query)[0]
+        by_label = {self.labels.get(doc_id): (doc_id, metadata) for doc_id, _, metadata in hits}
+        order = np.argsort(-scores)
+        return [(by_label[labels[i]][0], float(scores[i]), by_label[labels[i]][1]) for i in order.tolist()]
+
+    def save(self, force=False):
+        """
+        Persist the graph if enough rows were added since it was last saved.
+
+        Vectors, ids and tombstones are durable as soon as they are written,
+        so this only matters for the HNSW graph; other processes replay any
+        rows the saved graph is missing from the store.
+        """
+        with self._lock:
+            if self.graph is not None and (force or self._graph_rows - self._graph_saved_rows >= RAG_GRAPH_SAVE_ROWS):
+                self.save_graph()
+
+    def compact(self):
+        """
+        Drop deleted rows from the store and rebuild the graph over the remaining ones.
+        """
+        with self._lock:
+            self.store.compact()
+            self._sync()
+            self._load_graph()
+
+    @classmethod
+    def load(cls, directory=RAG_INDEX_DIR):
+        """
+        Open the index stored in ``directory`` (an empty one if none exists yet).
+        """
+        return cls(directory)
+
+
+def embed_texts(texts):
+    """
+    Embed texts with the shared embedding service, reusing cached vectors for unchanged text.
+    """
+    return cached_encode(texts, dtype=np.float32)
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def rerank_hits(text, hits):
+    """
+    Re-order (id, score, metadata) hits by a cross-encoder's relevance score for the query.
+
+    The model named by RAG_RERANK_MODEL is loaded on first use; hits are
+    returned unchanged if it is not configured or cannot be loaded. A failed
+    load is remembered for the life of the process and not retried per query.
+    """
+    global _reranker
+    if not RAG_RERANK_MODEL or not hits:
+        return hits
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    _reranker = CrossEncoder(RAG_RERANK_MODEL, device=EMBEDDING_DEVICE)
+                except Exception as e:
+                    logger.warning(f"加载重排模型失败，本进程内不再重试，检索结果不重排: {e}")
+                    _reranker = False  # 记住失败，避免每次查询重新加载
+    if not _reranker:
+        return hits
+    scores = _reranker.predict([(text, metadata.get("content", "")) for _, _, metadata in hits])
+    order = np.argsort(-np.asarray(scores, dtype=np.float32))
+    return [(hits[i][0], float(scores[i]), hits[i][2]) for i in order.tolist()]
+
+
+# 将业务表记录转换为待索引的文档：(id, 文本, 元数据)
+def nursing_topic_document(topic):
+    text = "\n".join(part for part in (topic.content, topic.sub_content) if part)
+    return f"nursing_topic:{topic.id}", text, {"source": "nursing_topic", "source_id": topic.id,
+                                               "user_id": topic.user_id, "title": topic.content[:100]}
+
+
+def my_goals_document(goal):
+    text = "\n".join(part for part in (goal.my_topics, goal.my_plans) if part)
+    return f"my_goals:{goal.id}", text, {"source": "my_goals", "source_id": goal.id,
+                                         "user_id": goal.user_id, "title": (goal.my_topics or "")[:100]}
+
+
+def writing_document(writing):
+    text = "\n".join(part for part in (writing.user_input, writing.generated_content) if part)
+    return f"writing:{writing.id}", text, {"source": "writing", "source_id": writing.id,
+                                           "user_id": writing.user_id, "title": writing.type}
+
+
+def manuscript_document(manuscript):
+    text = "\n".join(part for part in (manuscript.title, manuscript.content) if part)
+    return f"manuscript:{manuscript.id}", text, {"source": "manuscript", "source_id": manuscript.id,
+                                                 "user_id": manuscript.user_id, "title": manuscript.title}
+
+
+def article_document(article):
+    text = "\n".join(part for part in (article.title, article.abstract) if part)
+    return f"article:{article.pmid}", text, {"source": "article", "source_id": article.pmid,
+                                             "title": article.title, "year": article.year}
+
+
+# 每类文档：(模型, 按 id 查询时使用的列, 转换函数)
+DOCUMENT_SOURCES = {
+    "nursing_topic": (NursingTopic, NursingTopic.id, nursing_topic_document),
+    "my_goals": (MyGoals, MyGoals.id, my_goals_document),
+    "writing": (Writing, Writing.id, writing_document),
+    "manuscript": (Manuscript, Manuscript.id, manuscript_document),
+    "article": (Article, Article.pmid, article_document),
+}
+
+
+# 增量索引时每类文档判断新增或修改所依据的时间戳列
+WATERMARK_COLUMNS = {
+    "nursing_topic": NursingTopic.created_at,
+    "my_goals": MyGoals.updated_at,
+    "writing": Writing.created_at,
+    "manuscript": Manuscript.updated_at,
+    "article": Article.fetched_at,
+}
+
+
+def iter_documents(db):
+    """
+    Yield every indexable document from the business tables.
+    """
+    for model, _, to_document in DOCUMENT_SOURCES.values():
+        for row in db.query(model).yield_per(500):
+            document = to_document(row)
+            if document[1]:
+                yield document
+
+
+def document_chunks(doc_id, text, metadata):
+    """
+    Chunk a document into (chunk id, text, metadata) triples carrying source offsets for citation.
+    """
+    for chunk in chunk_text(text):
+        yield f"{doc_id}#{chunk.index}", chunk.text, dict(metadata, start=chunk.start, end=chunk.end,
+                                                          content=chunk.text)
+
+
+def conversation_chunks(topic, history):
+    """
+    Chunk a NursingTopic's conversation messages at turn and sentence boundaries.
+
+    :param history: The row's {"role", "content"} messages, see utils.conversation_store.topic_messages.
+    """
+    doc_id = f"conversation:{topic.id}"
+    for chunk in chunk_chat(history):
+        yield f"{doc_id}#{chunk.index}", chunk.text, {
+            "source": "conversation",
+            "source_id": topic.id,
+            "user_id": topic.user_id,
+            "turns": [section["turn"] for section in chunk.metadata["sections"]],
+            "start": chunk.start,
+            "end": chunk.end,
+            "content": chunk.text,
+        }
+
+
+def load_document_chunks(db, doc_id):
+    """
+    Load and chunk one document by its id (e.g. "manuscript:3" or "conversation:12").
+
+    :return: A list of (chunk id, text, metadata), or None if the source row no longer exists.
+    """
+    source, _, source_id = doc_id.partition(":")
+    if source == "conversation":
+        topic = db.get(NursingTopic, int(source_id))
+        if topic is None:
+            return None
+        return list(conversation_chunks(topic, to_chat(topic_messages(db, topic.id))))
+    if source not in DOCUMENT_SOURCES:
+        raise ValueError(f"未知的文档类型: {doc_id}")
+    model, column, to_document = DOCUMENT_SOURCES[source]
+    key = source_id if column.type.python_type is str else int(source_id)
+    row = db.query(model).filter(column == key).first()
+    return None if row is None else list(document_chunks(*to_document(row)))
+
+
+def index_documents(index, documents, batch_size=RAG_EMBED_BATCH_SIZE):
+    """
+    Chunk (id, text, metadata) documents, embed the chunks in batches and
+    replace each document's previous chunks in the index.
+
+    :return: The number of documents indexed.
+    """
+    count = 0
+    batch, pending = [], 0
+    for doc_id, text, metadata in documents:
+        chunks = list(document_chunks(doc_id, text, metadata))
+        batch.append((doc_id, chunks))
+        pending += len(chunks)
+        if pending >= batch_size:
+            count += apply_chunks(index, batch)
+            batch, pending = [], 0
+    count += apply_chunks(index, batch)
+    return count
+
+
+def apply_chunks(index, batch):
+    """
+    Embed the chunks of several documents in one call and swap them into the index.
+
+    :param batch: A list of (doc_id, chunks), where chunks come from
+        :func:`load_document_chunks`; None removes the document.
+    :return: The number of documents applied.
+    """
+    texts = [text for _, chunks in batch for _, text, _ in chunks or ()]
+    vectors = embed_texts(texts) if texts else None
+    offset = 0
+    for doc_id, chunks in batch:
+        if chunks is None:
+            index.delete_document(doc_id)
+            continue
+        ids = [chunk_id for chunk_id, _, _ in chunks]
+        index.replace_document(doc_id, ids, vectors[offset:offset + len(chunks)] if chunks else None,
+                               [metadata for _, _, metadata in chunks])
+        offset += len(chunks)
+    return len(batch)
+
+
+def index_conversations(db, index, batch_size=RAG_EMBED_BATCH_SIZE):
+    """
+    Re-chunk and embed the conversation of every NursingTopic row that has messages.
+
+    :return: The set of conversation document ids indexed.
+    """
+    topic_ids = db.query(ConversationMessage.nursing_topic_id).filter(
+        ConversationMessage.nursing_topic_id.isnot(None)).distinct().order_by(ConversationMessage.nursing_topic_id)
+    seen, batch, pending = set(), [], 0
+    for topic_id, in topic_ids.all():
+        doc_id = f"conversation:{topic_id}"
+        chunks = load_document_chunks(db, doc_id)
+        seen.add(doc_id)
+        batch.append((doc_id, chunks))
+        pending += len(chunks or ())
+        if pending >= batch_size:
+            apply_chunks(index, batch)
+            batch, pending = [], 0
+    apply_chunks(index, batch)
+    return seen
+
+
+def rebuild_index(directory=RAG_INDEX_DIR):
+    """
+    Re-index every document source and every topic conversation, drop
+    documents whose rows are gone, and compact the store.
+    """
+    index = RAGIndex(directory)
+    db = SessionLocal()
+    try:
+        seen = set()
+        index_documents(index, (document for document in iter_documents(db) if not seen.add(document[0])))
+        seen |= index_conversations(db, index)
+    finally:
+        db.close()
+    sources = set(DOCUMENT_SOURCES) | {"conversation"}
+    for doc_id in list(index.documents):
+        if doc_id.partition(":")[0] in sources and doc_id not in seen:
+            index.delete_document(doc_id)
+    index.compact()
+    index.save(force=True)
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_rag_index():
+    """
+    Return the process-wide RAGIndex, loaded from RAG_INDEX_DIR on first use.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RAGIndex.load(RAG_INDEX_DIR)
+    return _index
+
+
+if __name__ == "__main__":
+    built = rebuild_index()
+    print(f"已索引 {len(built.documents)} 篇文档（{len(built)} 个分块）到 {RAG_INDEX_DIR}")
@@ -0,0 +1,232 @@
+import json
+import math
+import os
+import re
+from collections import deque
+from dataclasses import dataclass, field
+
+from utils.context_manager import count_tokens
+
+# 分块配置：paraphrase-MiniLM-L6-v2 最多读取 128 个 word piece
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "120"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "20"))
+SECTION_SEPARATOR = "\n\n"
+
+# 句末标点（中文句末标点直接断句，英文标点须后接空白，避免拆开 3.5、e.g. 之类）及空行
+SENTENCE_END = re.compile(r"[。！？；]+[”’」』）)]*|[.!?;]+[\"')\]]*(?=\s|$)|\n\s*\n")
+CLAUSE_END = re.compile(r"[，、：,:]+")
+ROLE_LABELS = {"user": "用户", "assistant": "助手", "system": "系统"}
+# PDF 中常见的章节标题
+PDF_HEADING = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*\s*[\.、]?\s*)?"
+    r"(摘要|关键词|引言|前言|背景|对象与方法|资料与方法|方法|结果|讨论|结论|参考文献|致谢|"
+    r"abstract|keywords|introduction|background|methods?|materials and methods|results|discussion|"
+    r"conclusions?|references|acknowledg(?:e)?ments)\s*[:：]?\s*$",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Chunk:
+    text: str
+    start: int  # 在源文本中的起始偏移（字符）
+    end: int  # 在源文本中的结束偏移（不含）
+    index: int  # 在源文本中的序号
+    tokens: int
+    metadata: dict = field(default_factory=dict)
+
+
+def sentence_spans(text, offset=0):
+    """
+    Yield (start, end) spans of the sentences in a text.
+
+    Splits after 。！？； and after . ! ? ; followed by whitespace, and at blank
+    lines. Spans keep their trailing punctuation.
+    """
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+        if text[start:end].strip():
+            yield offset + start, offset + end
+        start = end
+    if text[start:].strip():
+        yield offset + start, offset + len(text)
+
+
+def _bounded(text, spans, limit):
+    """
+    Split any span longer than ``limit`` tokens at clause punctuation, then by length.
+    """
+    for start, end in spans:
+        tokens = count_tokens(text[start:end])
+        if tokens <= limit:
+            yield start, end, tokens
+            continue
+        pieces, piece_start = [], start
+        for match in CLAUSE_END.finditer(text, start, end):
+            pieces.append((piece_start, match.end()))
+            piece_start = match.end()
+        pieces.append((piece_start, end))
+        for piece_start, piece_end in pieces:
+            piece_tokens = count_tokens(text[piece_start:piece_end])
+            if piece_tokens <= limit:
+                yield piece_start, piece_end, piece_tokens
+                continue
+            # 没有可用的标点时按长度硬切
+            width = max(1, math.floor((piece_end - piece_start) * limit / piece_tokens))
+            for i in range(piece_start, piece_end, width):
+                j = min(i + width, piece_end)
+                yield i, j, count_tokens(text[i:j])
+
+
+def _pack(text, spans, chunk_tokens, overlap_tokens):
+    """
+    Greedily pack sentence spans into windows, carrying up to
+    ``overlap_tokens`` of trailing sentences into the next window.
+    """
+    window, total = deque(), 0
+    for start, end, tokens in spans:
+        if window and total + tokens > chunk_tokens:
+            yield window[0][0], window[-1][1]
+            kept, kept_tokens = deque(), 0
+            while window and kept_tokens + window[-1][2] <= overlap_tokens:
+                span = window.pop()
+                kept.appendleft(span)
+                kept_tokens += span[2]
+            window, total = kept, kept_tokens
+            while window and total + tokens > chunk_tokens:
+                total -= window.popleft()[2]
+        window.append((start, end, tokens))
+        total += tokens
+    if window:
+        yield window[0][0], window[-1][1]
+
+
+def chunk_text(text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, metadata=None, start_index=0):
+    """
+    Split a text into sentence-aligned chunks of about ``chunk_tokens`` tokens.
+
+    This is a generator, so long documents are chunked lazily.
+
+    :param text: The source text.
+    :param chunk_tokens: Target maximum tokens per chunk (as estimated by count_tokens).
+    :param overlap_tokens: Tokens of trailing sentences repeated at the start of the next chunk.
+    :param metadata: A dict copied onto every chunk.
+    :return: A generator of Chunk, with offsets into ``text``.
+    """
+    spans = _bounded(text, sentence_spans(text), chunk_tokens)
+    index = start_index
+    for start, end in _pack(text, spans, chunk_tokens, overlap_tokens):
+        raw = text[start:end]
+        stripped = raw.strip()
+        start += len(raw) - len(raw.lstrip())
+        yield Chunk(stripped, start, start + len(stripped), index, count_tokens(stripped), dict(metadata or {}))
+        index += 1
+
+
+def join_sections(sections):
+    """
+    Render (text, metadata) sections into the single document that chunk offsets refer to.
+    """
+    return SECTION_SEPARATOR.join(text for text, _ in sections)
+
+
+def chunk_sections(sections, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, merge=True):
+    """
+    Chunk a sequence of (text, metadata) sections without splitting inside
+    section boundaries where it can be avoided.
+
+    With ``merge`` on, consecutive short sections are packed into one chunk
+    whose metadata lists every section it covers under ``"sections"``;
+    otherwise each section is chunked on its own. Offsets refer to
+    :func:`join_sections` of the same sections.
+
+    :return: A generator of Chunk.
+    """
+    offset, index = 0, 0
+    pending, pending_tokens = [], 0  # 等待合并的短小节：(起始偏移, 文本, 元数据)
+
+    def flush():
+        nonlocal index
+        if not pending:
+            return None
+        start = pending[0][0]
+        end = pending[-1][0] + len(pending[-1][1])
+        text = join_sections([(text, None) for _, text, _ in pending])
+        chunk = Chunk(text, start, end, index, count_tokens(text), {"sections": [m for _, _, m in pending]})
+        index += 1
+        pending.clear()
+        return chunk
+
+    for text, metadata in sections:
+        tokens = count_tokens(text) + 1
+        if merge and tokens <= chunk_tokens:
+            if pending and pending_tokens + tokens > chunk_tokens:
+                yield flush()
+                pending_tokens = 0
+            pending.append((offset, text, metadata))
+            pending_tokens += tokens
+        else:
+            chunk = flush()
+            pending_tokens = 0
+            if chunk is not None:
+                yield chunk
+            for chunk in chunk_text(text, chunk_tokens, overlap_tokens, {"sections": [metadata]}, index):
+                chunk.start += offset
+                chunk.end += offset
+                index = chunk.index + 1
+                yield chunk
+        offset += len(text) + len(SECTION_SEPARATOR)
+    chunk = flush()
+    if chunk is not None:
+        yield chunk
+
+
+def chat_sections(history):
+    """
+    Turn a chat history (a list of {"role", "content"} or its JSON string) into sections, one per turn.
+    """
+    if isinstance(history, str):
+        history = json.loads(history) if history.strip() else []
+    for turn, message in enumerate(history):
+        content = (message.get("content") or "").strip()
+        if content:
+            role = message.get("role", "")
+            yield f"{ROLE_LABELS.get(role, role)}：{content}", {"turn": turn, "role": role}
+
+
+def chunk_chat(history, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Chunk a chat history so short question/answer turns share a chunk and long turns split at sentences.
+    """
+    return chunk_sections(chat_sections(history), chunk_tokens, overlap_tokens, merge=True)
+
+
+def pdf_sections(pages):
+    """
+    Split extracted PDF page texts into sections at headings such as 摘要/方法/Results.
+
+    :param pages: An iterable of page texts, e.g. from pdfplumber ``page.extract_text()``.
+    :return: A generator of (text, {"section": heading, "page": first page number}).
+    """
+    heading, page_number, lines = None, 1, []
+    for number, page in enumerate(pages, start=1):
+        for line in (page or "").splitlines():
+            match = PDF_HEADING.match(line)
+            if match:
+                if any(l.strip() for l in lines):
+                    yield "\n".join(lines).strip(), {"section": heading, "page": page_number}
+                heading, page_number, lines = match.group(1), number, [line]
+            else:
+                if not lines:
+                    page_number = number
+                lines.append(line)
+    if any(l.strip() for l in lines):
+        yield "\n".join(lines).strip(), {"section": heading, "page": page_number}
+
+
+def chunk_pdf(pages, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Chunk a PDF so that no chunk crosses a section heading.
+    """
+    return chunk_sections(pdf_sections(pages), chunk_tokens, overlap_tokens, merge=False)
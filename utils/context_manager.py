@@ -0,0 +1,149 @@
+import logging
+import math
+import os
+import re
+from datetime import datetime
+
+from models.project_models import ConversationMessage, ConversationSummary
+from utils.llm_gateway import chat
+
+logger = logging.getLogger(__name__)
+
+# 上下文配置（环境变量）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "6000"))  # 发送给模型的历史上限
+CONTEXT_KEEP_TURNS = int(os.getenv("LLM_CONTEXT_KEEP_TURNS", "3"))  # 原文保留的最近轮数（一问一答为一轮）
+SUMMARY_TOKEN_LIMIT = int(os.getenv("LLM_SUMMARY_TOKEN_LIMIT", "800"))
+MESSAGE_OVERHEAD_TOKENS = 4  # 每条消息的角色与分隔符开销
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+SUMMARY_SYSTEM_PROMPT = "你是一名医学科研助理，负责压缩对话记录。"
+SUMMARY_INSTRUCTION = """
+请将以下“已有摘要”和“新增对话”合并为一份简洁的中文摘要，
+保留研究主题、PICOS 要素、用户的偏好与约束、已经给出的关键结论，省略寒暄和重复内容，
+不超过 {limit} 字。
+
+已有摘要：
+{summary}
+
+新增对话：
+{dialogue}
+"""
+
+
+def count_tokens(text):
+    """
+    Estimate the number of tokens in a text.
+
+    CJK characters are counted as one token each and other text as roughly one
+    token per four characters, which slightly overestimates qwen's tokenizer and
+    keeps budgets on the safe side without shipping a tokenizer.
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_message_tokens(messages):
+    """
+    Estimate the number of tokens a list of chat messages will use.
+    """
+    return sum(count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def load_summary(db, thread_id):
+    return db.query(ConversationSummary).filter(ConversationSummary.thread_id == thread_id).first()
+
+
+def _summarize(previous_summary, messages):
+    dialogue = "\n".join(
+        f"{'用户' if message['role'] == 'user' else 'AI'}: {message['content']}" for message in messages
+    )
+    prompt = SUMMARY_INSTRUCTION.format(limit=SUMMARY_TOKEN_LIMIT, summary=previous_summary or "（无）", dialogue=dialogue)
+    return chat([
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ])
+
+
+def _truncate(text, limit):
+    while text and count_tokens(text) > limit:
+        text = text[:int(len(text) * 0.9)]
+    return text
+
+
+def build_context(db, thread_id, system_prompt, history=(), new_question="", budget=None, keep_turns=None,
+                  before_seq=None):
+    """
+    Build the messages to send for a follow-up question within a token budget.
+
+    Turns older than the last ``keep_turns`` are folded into a rolling summary
+    stored in conversation_summaries, so each turn is summarized only once. The
+    result is the system prompt, the summary, and as many recent turns as fit.
+
+    For a saved thread the messages are read from conversation_messages,
+    starting after the last seq already folded into the summary, so the
+    summary and the verbatim turns always line up with the thread.
+
+    :param db: An open SQLAlchemy session.
+    :param thread_id: The TopicThread id; None (no saved thread) skips the summary.
+    :param system_prompt: The system prompt for this call.
+    :param history: The user/assistant messages of an unsaved conversation; only used when thread_id is None.
+    :param new_question: The question about to be asked, reserved in the budget.
+    :param budget: Maximum prompt tokens, defaults to LLM_CONTEXT_TOKEN_BUDGET.
+    :param keep_turns: Turns kept verbatim, defaults to LLM_CONTEXT_KEEP_TURNS.
+    :param before_seq: Ignore thread messages from this seq on, e.g. the question already saved for this call.
+    :return: A list of messages, not including new_question.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    keep_turns = CONTEXT_KEEP_TURNS if keep_turns is None else keep_turns
+
+    record = load_summary(db, thread_id) if thread_id is not None else None
+    summary = record.summary if record else ""
+    if thread_id is not None:
+        # 只读取尚未并入摘要的消息
+        query = db.query(ConversationMessage).filter(ConversationMessage.thread_id == thread_id,
+                                                     ConversationMessage.seq > (record.summarized_seq if record else 0))
+        if before_seq is not None:
+            query = query.filter(ConversationMessage.seq < before_seq)
+        rows = [row for row in query.order_by(ConversationMessage.seq) if row.content]
+        history = [{"role": row.role, "content": row.content} for row in rows]
+    else:
+        history = [message for message in history if message.get("content")]
+    summarized = 0
+
+    # 将超出保留轮数、尚未摘要的旧消息并入滚动摘要
+    fold_until = max(len(history) - keep_turns * 2, 0)
+    if thread_id is not None and fold_until > 0:
+        try:
+            folded = _truncate(_summarize(summary, history[:fold_until]), SUMMARY_TOKEN_LIMIT)
+            if record is None:
+                record = ConversationSummary(thread_id=thread_id)
+                db.add(record)
+            record.summary = folded
+            record.summarized_seq = rows[fold_until - 1].seq
+            record.updated_at = datetime.now()
+            db.commit()
+            summary, summarized = folded, fold_until
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"更新对话摘要失败，使用已有摘要: {e}")
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": f"以下是此前对话的摘要：\n{summary}"})
+
+    # 从最近的消息往前取，直到用完预算
+    remaining = budget - count_message_tokens(messages) - count_tokens(new_question) - MESSAGE_OVERHEAD_TOKENS
+    recent = []
+    for message in reversed(history[summarized:]):
+        cost = count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if cost > remaining:
+            break
+        recent.append(message)
+        remaining -= cost
+    # 不以孤立的 AI 回答开头
+    while recent and recent[-1]["role"] == "assistant":
+        recent.pop()
+    return messages + list(reversed(recent))
@@ -0,0 +1,72 @@
+import os
+
+from sqlalchemy import func
+
+from models.project_models import ConversationMessage, TopicThread, thread_key
+from utils.context_manager import count_tokens
+
+# 历史记录页一次载入显示的最近消息数
+HISTORY_MESSAGES_LIMIT = int(os.getenv("CONVERSATION_HISTORY_MESSAGES", "200"))
+
+
+def find_thread(db, user_id, content):
+    """
+    Return the TopicThread of a user's NursingTopic content, or None.
+    """
+    return db.query(TopicThread).filter(TopicThread.user_id == user_id,
+                                        TopicThread.thread_key == thread_key(content)).first()
+
+
+def append_messages(db, thread_id, messages, nursing_topic_id=None):
+    """
+    Append messages to the end of a thread.
+
+    Only the new rows are inserted; earlier messages are never rewritten. The
+    thread row is locked (SELECT ... FOR UPDATE on Postgres) while sequence
+    numbers are taken, so concurrent appends to one thread cannot collide.
+    The caller commits.
+
+    :param messages: {"role", "content"} dicts, optionally with "metadata"; empty contents are skipped.
+    :param nursing_topic_id: The NursingTopic row the messages belong to.
+    :return: The inserted ConversationMessage rows.
+    """
+    db.query(TopicThread.id).filter(TopicThread.id == thread_id).with_for_update().one()
+    last = db.query(func.max(ConversationMessage.seq)).filter(ConversationMessage.thread_id == thread_id).scalar()
+    rows = [
+        ConversationMessage(thread_id=thread_id, seq=(last or 0) + offset, role=message["role"],
+                            content=message["content"], token_count=count_tokens(message["content"]),
+                            nursing_topic_id=nursing_topic_id, meta=message.get("metadata"))
+        for offset, message in enumerate((m for m in messages if m.get("content")), start=1)
+    ]
+    db.add_all(rows)
+    db.flush()
+    return rows
+
+
+def last_messages(db, thread_id, n):
+    """
+    Read the last ``n`` messages of a thread, oldest first.
+    """
+    rows = (db.query(ConversationMessage)
+            .filter(ConversationMessage.thread_id == thread_id)
+            .order_by(ConversationMessage.seq.desc())
+            .limit(n)
+            .all())
+    return rows[::-1]
+
+
+def topic_messages(db, nursing_topic_id):
+    """
+    Read the messages of one NursingTopic row (one question and its answer), oldest first.
+    """
+    return (db.query(ConversationMessage)
+            .filter(ConversationMessage.nursing_topic_id == nursing_topic_id)
+            .order_by(ConversationMessage.thread_id, ConversationMessage.seq)
+            .all())
+
+
+def to_chat(rows):
+    """
+    Convert ConversationMessage rows into {"role", "content"} chat messages.
+    """
+    return [{"role": row.role, "content": row.content} for row in rows]
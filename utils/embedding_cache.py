@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.database import SessionLocal
+from models.project_models import EmbeddingCacheEntry
+from utils.embeddings import get_embedding_service
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))  # 内存 LRU 容量
+EMBEDDING_CACHE_LOOKUP_BATCH = 500  # 每条 IN 查询携带的哈希数
+
+
+def text_key(text):
+    """
+    Hash a chunk after collapsing whitespace, so re-flowed text hits the same entry.
+    """
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed float16 embeddings: an in-memory LRU in front of the
+    embedding_cache table, keyed by (model, SHA-256 of the normalised text).
+    """
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (model, text_hash) -> float16 向量
+        self._lock = threading.Lock()
+
+    def _remember(self, model, items):
+        with self._lock:
+            for key, vector in items.items():
+                self._entries[(model, key)] = vector
+                self._entries.move_to_end((model, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_many(self, model, keys):
+        """
+        Look up cached vectors.
+
+        :param model: The embedding model name.
+        :param keys: Text hashes from :func:`text_key`.
+        :return: A dict of text hash -> float16 vector for the hits.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get((model, key))
+                if vector is not None:
+                    self._entries.move_to_end((model, key))
+                    found[key] = vector
+        missing = [key for key in keys if key not in found]
+        if not missing:
+            return found
+        loaded = {}
+        db = SessionLocal()
+        try:
+            for i in range(0, len(missing), EMBEDDING_CACHE_LOOKUP_BATCH):
+                rows = db.query(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.vector).filter(
+                    EmbeddingCacheEntry.model == model,
+                    EmbeddingCacheEntry.text_hash.in_(missing[i:i + EMBEDDING_CACHE_LOOKUP_BATCH]),
+                )
+                for text_hash, vector in rows:
+                    loaded[text_hash] = np.frombuffer(vector, dtype=np.float16)
+        except Exception as e:
+            logger.warning(f"读取向量缓存失败: {e}")
+        finally:
+            db.close()
+        self._remember(model, loaded)
+        found.update(loaded)
+        return found
+
+    def put_many(self, model, items):
+        """
+        Store float16 vectors in memory and in the database, skipping existing rows.
+
+        :param items: A dict of text hash -> vector.
+        """
+        if not items:
+            return
+        items = {key: np.asarray(vector, dtype=np.float16) for key, vector in items.items()}
+        self._remember(model, items)
+        rows = [{"model": model, "text_hash": key, "dim": len(vector), "vector": vector.tobytes()}
+                for key, vector in items.items()]
+        db = SessionLocal()
+        try:
+            dialect = db.get_bind().dialect.name
+            if dialect in ("postgresql", "sqlite"):
+                insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+                db.execute(insert(EmbeddingCacheEntry).values(rows).on_conflict_do_nothing(
+                    index_elements=["model", "text_hash"]))
+            else:
+                existing = {text_hash for (text_hash,) in db.query(EmbeddingCacheEntry.text_hash).filter(
+                    EmbeddingCacheEntry.model == model, EmbeddingCacheEntry.text_hash.in_(list(items)))}
+                db.add_all(EmbeddingCacheEntry(**row) for row in rows if row["text_hash"] not in existing)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"写入向量缓存失败: {e}")
+        finally:
+            db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide EmbeddingCache.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
+
+
+def cached_encode(texts, service=None, dtype=np.float32):
+    """
+    Embed texts, encoding only those whose vectors are not cached yet.
+
+    Fresh vectors go through the same float16 round-trip as cached ones, so
+    a text always maps to the same vector whether or not it was a hit.
+
+    :param texts: A list of strings.
+    :param service: An EmbeddingService, defaults to the shared one.
+    :return: A (len(texts), dimension) array.
+    """
+    texts = list(texts)
+    service = service or get_embedding_service()
+    cache = get_embedding_cache()
+    keys = [text_key(text) for text in texts]
+    vectors = cache.get_many(service.model_name, list(dict.fromkeys(keys)))
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        encoded = service.encode(list(missing.values()), dtype=np.float16)
+        fresh = dict(zip(missing, encoded))
+        cache.put_many(service.model_name, fresh)
+        vectors.update(fresh)
+    if not texts:
+        return np.zeros((0, service.dimension), dtype=dtype)
+    return np.stack([vectors[key] for key in keys]).astype(dtype)
@@ -1,26 +1,155 @@
-from sentence_transformers import SentenceTransformer
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+# 向量模型配置（环境变量）
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE") or None  # 如 cpu / cuda，默认由 sentence-transformers 选择
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))  # 攒批最多等待的毫秒数
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "2"))  # 执行 encode 的线程数
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")  # float32 或 float16
+
+
+class EmbeddingService:
+    """
+    A process-wide embedding service with lazy model loading and micro-batching.
+
+    Concurrent :meth:`encode` calls are queued and merged into one
+    ``SentenceTransformer.encode`` batch (up to ``batch_size`` texts or
+    ``max_wait_ms`` of waiting), which runs on a small thread pool. Outputs
+    are L2-normalised.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE, max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+                 workers=EMBEDDING_WORKERS, dtype=EMBEDDING_DTYPE, device=EMBEDDING_DEVICE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.dtype = np.dtype(dtype)
+        self.device = device
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self._batcher = threading.Thread(target=self._collect, name="embedding-batcher", daemon=True)
+        self._batcher.start()
+
+    @property
+    def model(self):
+        """
+        The SentenceTransformer model, loaded on first use.
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, dtype=None):
+        """
+        Embed a list of texts, sharing a batch with any concurrent callers.
+
+        :param texts: A list of strings.
+        :param dtype: Output dtype, defaults to EMBEDDING_DTYPE.
+        :return: A (len(texts), dimension) array of unit-length rows.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=dtype or self.dtype)
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result().astype(dtype or self.dtype, copy=False)
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            # 在等待窗口内继续收集请求，直到凑满一个批次
+            while size < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            # 同一批次内的重复文本只计算一次
+            unique = list(dict.fromkeys(text for texts, _ in batch for text in texts))
+            vectors = np.asarray(
+                self.model.encode(unique, batch_size=self.batch_size, convert_to_numpy=True),
+                dtype=np.float32,
+            )
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors /= norms
+            rows = {text: i for i, text in enumerate(unique)}
+            for texts, future in batch:
+                future.set_result(vectors[[rows[text] for text in texts]])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name=EMBEDDING_MODEL):
+    """
+    Return the shared EmbeddingService for a model, creating it on first use.
+    """
+    service = _services.get(model_name)
+    if service is None:
+        with _services_lock:
+            service = _services.get(model_name)
+            if service is None:
+                service = _services[model_name] = EmbeddingService(model_name)
+    return service
+
 
 class EmbeddingGenerator:
     """
     A class used to generate embeddings for text data using Sentence Transformers.
+
+    Instances share the process-wide EmbeddingService, so creating one no
+    longer loads a separate copy of the model.
     """
 
-    def __init__(self, model_name='paraphrase-MiniLM-L6-v2'):
+    def __init__(self, model_name=EMBEDDING_MODEL):
         """
         Initialize the embedding generator with a specified Sentence Transformers model.
-        
+
         :param model_name: The name of the Sentence Transformers model to use.
         """
-        # Load the Sentence Transformers model
-        self.model = SentenceTransformer(model_name)
+        self.service = get_embedding_service(model_name)
+
+    @property
+    def model(self):
+        return self.service.model
 
     def generate_embeddings(self, texts):
         """
         Generate embeddings for a list of text strings.
-        
+
         :param texts: A list of text strings to generate embeddings for.
-        :return: A list of embeddings, where each embedding is a numpy array.
+        :return: A (len(texts), dimension) numpy array of normalized embeddings.
         """
-        # Generate embeddings using the Sentence Transformers model
-        embeddings = self.model.encode(texts)
-        return embeddings
\ No newline at end of file
+        return self.service.encode(texts)
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from modules.rag_system import get_rag_index
+from utils.context_manager import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# 检索增强配置（环境变量）
+GROUNDING_TOP_K = int(os.getenv("GROUNDING_TOP_K", "5"))  # 注入的文献篇数上限
+GROUNDING_TOKEN_BUDGET = int(os.getenv("GROUNDING_TOKEN_BUDGET", "900"))  # 注入文献的总 token 上限
+GROUNDING_SNIPPET_TOKENS = int(os.getenv("GROUNDING_SNIPPET_TOKENS", "200"))  # 每篇摘录的 token 上限
+GROUNDING_TIMEOUT_MS = float(os.getenv("GROUNDING_TIMEOUT_MS", "100"))  # 检索耗时上限，超时则不注入文献
+GROUNDING_WORKERS = int(os.getenv("GROUNDING_WORKERS", "2"))  # 检索线程数，同时也是进行中检索的上限
+GROUNDING_SOURCE = "article"  # 只从本地文献库（PubMed 摘要）中检索
+
+EVIDENCE_HEADER = "以下是从本地文献库检索到的相关文献摘录，回答时请按编号引用（如 [1]），不要编造未列出的文献："
+
+_executor = ThreadPoolExecutor(max_workers=GROUNDING_WORKERS, thread_name_prefix="grounding")
+# 进行中的检索不超过线程数，任务不会在执行器队列里堆积；已满时直接跳过本次检索
+_slots = threading.BoundedSemaphore(GROUNDING_WORKERS)
+_warmed = False
+
+
+def _submit(query, k):
+    # 没有空闲名额时返回 None，名额在任务结束（含被取消）时归还
+    if not _slots.acquire(blocking=False):
+        return None
+    try:
+        future = _executor.submit(_retrieve, query, k)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def _retrieve(query, k):
+    hits = get_rag_index().hybrid_search(query, k * 3, where={"source": GROUNDING_SOURCE})
+    # 同一篇文献的多个分块只保留得分最高的一个
+    best = {}
+    for chunk_id, score, metadata in hits:
+        best.setdefault(metadata.get("doc_id", chunk_id), (chunk_id, score, metadata))
+    return list(best.values())[:k]
+
+
+def warm_up():
+    """
+    Load the index, its BM25 postings and the embedding model in the background,
+    so the first grounded question does not spend its time budget on start-up.
+    Only the first call in a process does anything.
+    """
+    global _warmed
+    if not _warmed:
+        _warmed = True
+        _submit("warm up", 1)
+
+
+def retrieve_evidence(query, k=GROUNDING_TOP_K, timeout_ms=GROUNDING_TIMEOUT_MS):
+    """
+    Retrieve the most relevant literature chunks for a query within a time budget.
+
+    Retrieval runs on a worker thread; if it does not finish within
+    ``timeout_ms`` the caller gets no evidence instead of waiting, and a
+    retrieval already running completes in the background and warms the
+    caches. At most GROUNDING_WORKERS retrievals are in flight; when all are
+    busy the question is answered without evidence rather than queued.
+
+    :return: A list of (chunk id, score, metadata), one per article, best first.
+    """
+    future = _submit(query, k)
+    if future is None:
+        logger.info("文献检索线程均忙，本次不注入文献")
+        return []
+    try:
+        return future.result(timeout=timeout_ms / 1000)
+    except FutureTimeout:
+        future.cancel()
+        logger.info(f"文献检索超过 {timeout_ms:g} ms，本次不注入文献")
+    except Exception as e:
+        logger.warning(f"文献检索失败: {e}")
+    return []
+
+
+def _clip(text, limit):
+    if count_tokens(text) <= limit:
+        return text
+    # 二分查找不超过上限的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) + 1 <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…" if low else ""
+
+
+def format_evidence(hits, token_budget=GROUNDING_TOKEN_BUDGET, snippet_tokens=GROUNDING_SNIPPET_TOKENS):
+    """
+    Render hits as a numbered, compact evidence block that fits ``token_budget``.
+
+    Each entry is the title, year and PMID followed by the matching passage
+    clipped to ``snippet_tokens``; entries that no longer fit are dropped.
+
+    :return: (text, number of hits included); text is "" if nothing fits.
+    """
+    lines, remaining = [EVIDENCE_HEADER], token_budget - count_tokens(EVIDENCE_HEADER)
+    for _, _, metadata in hits:
+        title = metadata.get("title") or ""
+        head = f"[{len(lines)}] {title}（{metadata.get('year') or '年份不详'}，PMID {metadata.get('source_id')}）"
+        passage = (metadata.get("content") or "").strip()
+        if title and passage.startswith(title):
+            passage = passage[len(title):]
+        passage = " ".join(passage.split())
+        cost = count_tokens(head) + 1
+        if cost >= remaining:
+            break
+        passage = _clip(passage, min(snippet_tokens, remaining - cost))
+        entry = f"{head}：{passage}" if passage else head
+        lines.append(entry)
+        remaining -= count_tokens(entry) + 1
+    return ("\n".join(lines) if len(lines) > 1 else ""), len(lines) - 1
+
+
+def evidence_message(query, k=GROUNDING_TOP_K, token_budget=GROUNDING_TOKEN_BUDGET):
+    """
+    Retrieve evidence for a query and wrap it as a system message.
+
+    :return: (message, hits cited in it); message is None when nothing was retrieved in time.
+    """
+    hits = retrieve_evidence(query, k)
+    text, count = format_evidence(hits, token_budget)
+    return ({"role": "system", "content": text} if text else None), hits[:count]
@@ -0,0 +1,161 @@
+import argparse
+import logging
+import os
+import time
+from datetime import timedelta
+
+from models.database import SessionLocal
+from models.project_models import IndexTombstone, IndexWatermark
+from modules.rag_system import DOCUMENT_SOURCES, WATERMARK_COLUMNS, apply_chunks, document_chunks, get_rag_index
+
+logger = logging.getLogger(__name__)
+
+# 增量索引配置（环境变量）
+INDEXER_BATCH_SIZE = int(os.getenv("INDEXER_BATCH_SIZE", "200"))  # 每批入库并推进水位的记录数
+INDEXER_OVERLAP_SECONDS = float(os.getenv("INDEXER_OVERLAP_SECONDS", "300"))  # 回看水位之前的时间窗口，补上晚提交的记录
+INDEXER_INTERVAL = float(os.getenv("INDEXER_INTERVAL", "60"))  # --loop 模式下两轮之间的秒数
+
+
+def _watermark(db, source):
+    mark = db.query(IndexWatermark).filter(IndexWatermark.source == source).first()
+    if mark is None:
+        mark = IndexWatermark(source=source, watermark=None, last_id=0)
+        db.add(mark)
+    return mark
+
+
+def _after(mark, timestamp, row_id):
+    """
+    Whether (timestamp, row_id) is past the stored (watermark, last_id) position.
+    """
+    if mark.watermark is None:
+        return True
+    if timestamp is None:
+        return False
+    return (timestamp, row_id) > (mark.watermark, mark.last_id)
+
+
+def apply_tombstones(index, batch_size=INDEXER_BATCH_SIZE):
+    """
+    Remove the documents of deleted rows from the index and drop their tombstones.
+
+    Every remaining tombstone is processed on each run rather than only
+    those past a watermark, so one committed late by a slow transaction is
+    never skipped.
+
+    :return: The number of tombstones applied.
+    """
+    count = 0
+    db = SessionLocal()
+    try:
+        while True:
+            tombstones = db.query(IndexTombstone.id, IndexTombstone.doc_id).order_by(IndexTombstone.id).limit(
+                batch_size).all()
+            if not tombstones:
+                return count
+            apply_chunks(index, [(doc_id, None) for doc_id in dict.fromkeys(doc_id for _, doc_id in tombstones)])
+            index.save()
+            db.query(IndexTombstone).filter(IndexTombstone.id.in_([row_id for row_id, _ in tombstones])).delete(
+                synchronize_session=False)
+            db.commit()
+            count += len(tombstones)
+    finally:
+        db.close()
+
+
+def index_source(index, source, batch_size=INDEXER_BATCH_SIZE):
+    """
+    Index the rows of one document source created or changed since its watermark.
+
+    Rows are streamed in (timestamp, id) order through a server-side cursor
+    and applied in batches; the watermark is committed after each batch, so
+    an interrupted run resumes where it stopped. Rows inside the
+    INDEXER_OVERLAP_SECONDS window before the watermark are read again and
+    indexed if they are missing from the index, which catches rows whose
+    transaction committed after a later row was already indexed.
+
+    :param source: A key of DOCUMENT_SOURCES that has a watermark column.
+    :return: The number of documents indexed.
+    """
+    model, _, to_document = DOCUMENT_SOURCES[source]
+    column = WATERMARK_COLUMNS[source]
+    # 读取用独立会话：提交水位会结束事务，不能与服务端游标共用同一连接
+    reader, writer = SessionLocal(), SessionLocal()
+    count = 0
+    try:
+        mark = _watermark(writer, source)
+        query = reader.query(model, column).order_by(column, model.id)
+        if mark.watermark is not None:
+            query = query.filter(column > mark.watermark - timedelta(seconds=INDEXER_OVERLAP_SECONDS))
+        batch, position = [], None
+        for row, timestamp in query.execution_options(stream_results=True).yield_per(batch_size):
+            doc_id, text, metadata = to_document(row)
+            if _after(mark, timestamp, row.id):
+                if timestamp is not None:
+                    position = (timestamp, row.id)
+            elif doc_id in index.documents or not text:
+                continue
+            batch.append((doc_id, list(document_chunks(doc_id, text, metadata)) if text else []))
+            if len(batch) >= batch_size:
+                count += _commit_batch(index, writer, mark, batch, position)
+                batch = []
+        count += _commit_batch(index, writer, mark, batch, position)
+        return count
+    except Exception:
+        writer.rollback()
+        raise
+    finally:
+        reader.close()
+        writer.close()
+
+
+def _commit_batch(index, db, mark, batch, position):
+    if batch:
+        apply_chunks(index, batch)
+        index.save()
+    if position is not None and _after(mark, *position):
+        mark.watermark, mark.last_id = position
+    db.commit()
+    return len(batch)
+
+
+def run_incremental_index(index=None, sources=None, batch_size=INDEXER_BATCH_SIZE):
+    """
+    Apply pending deletions, then index new and changed rows of every source.
+
+    :param index: A RAGIndex, defaults to the shared one.
+    :param sources: Source names to index, defaults to all with a watermark column.
+    :return: A dict of source -> documents indexed, plus "deleted" -> tombstones applied.
+    """
+    index = index or get_rag_index()
+    stats = {"deleted": apply_tombstones(index, batch_size)}
+    for source in sources or WATERMARK_COLUMNS:
+        stats[source] = index_source(index, source, batch_size)
+    index.save(force=True)
+    return stats
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="按水位增量更新向量索引")
+    parser.add_argument("--source", action="append", choices=sorted(WATERMARK_COLUMNS),
+                        help="只索引指定的文档类型，可重复")
+    parser.add_argument("--batch-size", type=int, default=INDEXER_BATCH_SIZE)
+    parser.add_argument("--loop", action="store_true", help=f"持续运行，每 {INDEXER_INTERVAL:g} 秒一轮")
+    args = parser.parse_args()
+
+    while True:
+        try:
+            stats = run_incremental_index(sources=args.source, batch_size=args.batch_size)
+            logger.info(f"增量索引完成: {stats}")
+        except Exception as e:
+            if not args.loop:
+                raise
+            logger.error(f"增量索引失败: {e}")
+        if not args.loop:
+            break
+        time.sleep(INDEXER_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
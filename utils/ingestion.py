@@ -0,0 +1,237 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+from models.database import SessionLocal
+from models.project_models import IngestionDeadLetter
+
+logger = logging.getLogger(__name__)
+
+# 向量入库队列配置（环境变量）
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))  # 每批最多处理的文档数
+INGEST_BATCH_WAIT = float(os.getenv("INGEST_BATCH_WAIT", "0.5"))  # 攒批最多等待的秒数
+INGEST_ENQUEUE_TIMEOUT = float(os.getenv("INGEST_ENQUEUE_TIMEOUT", "2"))  # 队列满时入队最多阻塞的秒数
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "3"))
+INGEST_RETRY_BASE_DELAY = float(os.getenv("INGEST_RETRY_BASE_DELAY", "2"))
+
+
+class IngestionQueueFull(Exception):
+    """
+    Raised when a document cannot be enqueued because the queue stayed full.
+    """
+
+
+class IngestionQueue:
+    """
+    A bounded queue of document ids with a fixed pool of indexing workers.
+
+    Documents are identified by ids such as "conversation:12", so enqueuing
+    a document that is already queued is a no-op, one that is being indexed
+    is indexed again afterwards, and re-indexing simply replaces its chunks. Workers drain up to INGEST_BATCH_SIZE ids,
+    embed all of their chunks in one call, and save the index once per
+    batch. Failed documents are retried with backoff and moved to the
+    ingestion_dead_letters table after INGEST_MAX_RETRIES attempts.
+    """
+
+    def __init__(self, maxsize=INGEST_QUEUE_SIZE, workers=INGEST_WORKERS, batch_size=INGEST_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._pending = {}  # doc_id -> 已失败次数；排队、处理中或等待重试的文档
+        self._queued = set()  # 已在队列中尚未取出的文档
+        self._dirty = set()  # 处理期间再次入队、完成后需重新处理的文档
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"ingestion-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def enqueue(self, doc_id, timeout=INGEST_ENQUEUE_TIMEOUT):
+        """
+        Schedule a document for (re-)indexing.
+
+        Blocks for up to ``timeout`` seconds while the queue is full.
+
+        :return: False if the document was already queued, True otherwise.
+        :raises IngestionQueueFull: If the queue stayed full.
+        """
+        with self._lock:
+            if doc_id in self._queued:
+                return False
+            if doc_id in self._pending:
+                # 正在处理的文档在本轮完成后重新入库，保证读到最新内容
+                self._dirty.add(doc_id)
+                return True
+            self._pending[doc_id] = 0
+            self._queued.add(doc_id)
+        try:
+            self._queue.put(doc_id, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(doc_id, None)
+                self._queued.discard(doc_id)
+            raise IngestionQueueFull(f"向量入库队列已满，{doc_id} 未能入队")
+        return True
+
+    def pending(self):
+        """
+        Return the number of documents queued or waiting for a retry.
+        """
+        return len(self._pending)
+
+    def join(self, timeout=None):
+        """
+        Wait until no documents are pending, or the timeout expires.
+
+        :return: True if the queue drained.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + INGEST_BATCH_WAIT
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        with self._lock:
+            self._queued.difference_update(batch)
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                failures = self._process(batch)
+            except Exception as e:
+                logger.warning(f"向量入库批次失败: {e}")
+                failures = {doc_id: e for doc_id in batch}
+            for doc_id in batch:
+                if doc_id in failures:
+                    self._retry(doc_id, failures[doc_id])
+                    continue
+                with self._lock:
+                    dirty = doc_id in self._dirty
+                    self._dirty.discard(doc_id)
+                    if dirty:
+                        self._pending[doc_id] = 0
+                    else:
+                        self._pending.pop(doc_id, None)
+                if dirty:
+                    self._requeue(doc_id, None)
+
+    def _process(self, batch):
+        from modules.rag_system import apply_chunks, get_rag_index, load_document_chunks
+
+        loaded, failures = [], {}
+        db = SessionLocal()
+        try:
+            for doc_id in batch:
+                try:
+                    loaded.append((doc_id, load_document_chunks(db, doc_id)))
+                except Exception as e:
+                    failures[doc_id] = e
+        finally:
+            db.close()
+        if loaded:
+            index = get_rag_index()
+            apply_chunks(index, loaded)
+            index.save()
+        return failures
+
+    def _retry(self, doc_id, error):
+        with self._lock:
+            attempts = self._pending.get(doc_id, 0) + 1
+            self._pending[doc_id] = attempts
+            self._dirty.discard(doc_id)
+        if attempts > INGEST_MAX_RETRIES:
+            self._dead_letter(doc_id, error, attempts)
+            with self._lock:
+                self._pending.pop(doc_id, None)
+            return
+        delay = INGEST_RETRY_BASE_DELAY * 2 ** (attempts - 1) * (0.5 + random.random())
+        # 重试在定时器线程中重新入队，不占用工作线程
+        timer = threading.Timer(delay, self._requeue, args=(doc_id, error))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, doc_id, error):
+        with self._lock:
+            self._queued.add(doc_id)
+        try:
+            self._queue.put(doc_id, timeout=INGEST_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            with self._lock:
+                self._queued.discard(doc_id)
+            self._retry(doc_id, error or IngestionQueueFull(f"{doc_id} 重新入队失败"))
+
+    def _dead_letter(self, doc_id, error, attempts):
+        logger.error(f"文档 {doc_id} 入库失败 {attempts} 次，已转入死信表: {error}")
+        db = SessionLocal()
+        try:
+            row = db.query(IngestionDeadLetter).filter(IngestionDeadLetter.doc_id == doc_id).first()
+            if row is None:
+                row = IngestionDeadLetter(doc_id=doc_id, attempts=0)
+                db.add(row)
+            row.error = f"{type(error).__name__}: {error}"
+            row.attempts = (row.attempts or 0) + attempts
+            row.updated_at = datetime.now()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"写入死信表失败: {e}")
+        finally:
+            db.close()
+
+    def retry_dead_letters(self, limit=100):
+        """
+        Move up to ``limit`` dead-lettered documents back onto the queue.
+
+        :return: The number of documents re-enqueued.
+        """
+        db = SessionLocal()
+        try:
+            rows = db.query(IngestionDeadLetter).order_by(IngestionDeadLetter.updated_at).limit(limit).all()
+            count = 0
+            for row in rows:
+                try:
+                    self.enqueue(row.doc_id)
+                except IngestionQueueFull:
+                    break
+                db.delete(row)
+                count += 1
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+
+_queue_instance = None
+_queue_lock = threading.Lock()
+
+
+def get_ingestion_queue():
+    """
+    Return the process-wide IngestionQueue, starting its workers on first use.
+    """
+    global _queue_instance
+    if _queue_instance is None:
+        with _queue_lock:
+            if _queue_instance is None:
+                _queue_instance = IngestionQueue()
+    return _queue_instance
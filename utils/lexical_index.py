@@ -0,0 +1,158 @@
+import heapq
+import math
+import os
+import re
+from collections import Counter
+
+# BM25 参数（环境变量）
+BM25_K1 = float(os.getenv("RAG_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("RAG_BM25_B", "0.75"))
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))  # 倒数排名融合的平滑常数
+
+# 连续的中日韩字符，或由字母数字组成的词（保留 IL-6、3.5、β-blocker 之类的内部连接符）
+TOKEN_PATTERN = re.compile(
+    r"[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]+"
+    r"|[0-9a-zα-ω]+(?:[-.][0-9a-zα-ω]+)*"
+)
+CJK_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or that the this to was were with".split()
+)
+
+
+def tokenize(text):
+    """
+    Split text into index terms.
+
+    CJK runs become overlapping character bigrams (a single character stays
+    a unigram), so no Chinese word segmenter is needed. Latin text is
+    lower-cased and split into words; hyphenated or dotted words such as
+    "il-6" are kept whole and also emitted part by part.
+
+    :return: A list of terms, in order, with repeats.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer((text or "").lower()):
+        token = match.group()
+        if CJK_PATTERN.match(token):
+            if len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        elif token not in STOPWORDS:
+            terms.append(token)
+            parts = re.split(r"[-.]", token)
+            if len(parts) > 1:
+                terms.extend(part for part in parts if part and part not in STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """
+    An in-memory BM25 inverted index over integer labels.
+
+    Labels are the row labels of the vector store, so lexical and vector
+    hits refer to the same chunks.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # 词 -> {label: 词频}
+        self.lengths = {}  # label -> 词数
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __contains__(self, label):
+        return label in self.lengths
+
+    def add(self, label, text):
+        """
+        Index one text under ``label``, replacing whatever was indexed under it.
+        """
+        if label in self.lengths:
+            self.remove(label)
+        terms = tokenize(text)
+        self.lengths[label] = len(terms)
+        self.total_length += len(terms)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[label] = tf
+
+    def remove(self, label, text=None):
+        """
+        Remove a label. Pass the indexed ``text`` to avoid scanning every posting list.
+        """
+        length = self.lengths.pop(label, None)
+        if length is None:
+            return
+        self.total_length -= length
+        terms = set(tokenize(text)) if text is not None else list(self.postings)
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None and postings.pop(label, None) is not None and not postings:
+                del self.postings[term]
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.lengths) - df + 0.5) / (df + 0.5))
+
+    def scores(self, query, labels=None):
+        """
+        Score every label that shares at least one term with the query.
+
+        :param labels: Optional set of labels; only these are scored, so a
+            filtered search does not walk every posting list in full.
+        :return: A dict of label -> BM25 score.
+        """
+        if not self.lengths:
+            return {}
+        k1, b = self.k1, self.b
+        average = self.total_length / len(self.lengths) or 1.0
+        lengths = self.lengths
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            if labels is not None:
+                # 候选集较小时按候选查词频，否则遍历倒排表并跳过候选以外的 label
+                if len(labels) < len(postings):
+                    postings = {label: postings[label] for label in labels if label in postings}
+                else:
+                    postings = {label: tf for label, tf in postings.items() if label in labels}
+            for label, tf in postings.items():
+                norm = k1 * (1 - b + b * lengths[label] / average)
+                scores[label] = scores.get(label, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k, labels=None):
+        """
+        Return the ``k`` best labels for a query.
+
+        :param labels: Optional set of labels to restrict the search to.
+        :return: A list of (label, score), best first.
+        """
+        return heapq.nlargest(k, self.scores(query, labels).items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, weights=None):
+    """
+    Fuse several rankings with reciprocal-rank fusion (Cormack et al., 2009).
+
+    Each item scores sum(weight / (k + rank)) over the rankings it appears
+    in, so items ranked well by both lexical and vector search rise to the
+    top without having to calibrate their raw scores against each other.
+
+    :param rankings: Lists of keys, best first.
+    :param k: The smoothing constant; larger values flatten the rank curve.
+    :param weights: Optional weight per ranking, defaults to 1.
+    :return: A list of (key, fused score), best first.
+    """
+    fused = {}
+    for ranking, weight in zip(rankings, weights or [1.0] * len(rankings)):
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.database import SessionLocal
+from models.project_models import Article, PubMedQueryCache
+from utils.pubmed_client import PUBMED_BATCH_SIZE, PUBMED_MAX_RESULTS, get_pubmed_client
+
+logger = logging.getLogger(__name__)
+
+# 检索式 -> PMID 列表缓存的有效期，文献本身长期保存
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("PUBMED_QUERY_CACHE_TTL_SECONDS", str(24 * 3600)))
+ARTICLE_FIELDS = ("title", "authors", "journal", "year", "abstract", "mesh_terms")
+
+
+def query_hash(query):
+    """
+    Hash a query after normalising whitespace and case.
+    """
+    normalized = " ".join(query.split()).lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _row(article, fetched_at):
+    return {
+        "pmid": article["pmid"],
+        "title": article.get("title") or "",
+        "authors": json.dumps(article.get("authors") or [], ensure_ascii=False),
+        "journal": article.get("journal"),
+        "year": article.get("year"),
+        "abstract": article.get("abstract"),
+        "mesh_terms": json.dumps(article.get("mesh_terms") or [], ensure_ascii=False),
+        "fetched_at": fetched_at,
+    }
+
+
+def to_dict(article):
+    """
+    Convert an Article row into the dict shape produced by utils.pubmed_client.parse_article.
+    """
+    return {
+        "pmid": article.pmid,
+        "title": article.title,
+        "authors": json.loads(article.authors or "[]"),
+        "journal": article.journal,
+        "year": article.year,
+        "abstract": article.abstract or "",
+        "mesh_terms": json.loads(article.mesh_terms or "[]"),
+    }
+
+
+def upsert_articles(db, articles):
+    """
+    Insert or update articles by PMID in a single statement.
+
+    Uses ON CONFLICT on PostgreSQL and SQLite; other databases fall back to
+    a per-row merge. The caller commits.
+
+    :param db: An open session.
+    :param articles: Article dicts from utils.pubmed_client.
+    """
+    now = datetime.now()
+    rows = list({article["pmid"]: _row(article, now) for article in articles if article.get("pmid")}.values())
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert(Article).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Article.pmid],
+            set_={field: statement.excluded[field] for field in ARTICLE_FIELDS + ("fetched_at",)},
+        )
+        db.execute(statement)
+        return
+    existing = {row.pmid: row for row in db.query(Article).filter(Article.pmid.in_([r["pmid"] for r in rows]))}
+    for row in rows:
+        article = existing.get(row["pmid"])
+        if article is None:
+            db.add(Article(**row))
+        else:
+            for field, value in row.items():
+                setattr(article, field, value)
+
+
+def get_articles(db, pmids):
+    """
+    Load stored articles for the given PMIDs.
+
+    :return: A dict of pmid -> article dict, containing only the PMIDs that are stored.
+    """
+    found = {}
+    pmids = list(pmids)
+    for i in range(0, len(pmids), PUBMED_BATCH_SIZE):
+        for article in db.query(Article).filter(Article.pmid.in_(pmids[i:i + PUBMED_BATCH_SIZE])):
+            found[article.pmid] = to_dict(article)
+    return found
+
+
+def get_cached_query(db, query, max_results):
+    """
+    Return (total_count, pmids) for a fresh cached query covering max_results, or None.
+    """
+    row = db.query(PubMedQueryCache).filter(PubMedQueryCache.query_hash == query_hash(query)).first()
+    if row is None or row.fetched_at is None:
+        return None
+    if row.fetched_at < datetime.now() - timedelta(seconds=QUERY_CACHE_TTL_SECONDS):
+        return None
+    pmids = row.pmids.split(",") if row.pmids else []
+    # 缓存的 PMID 数不足本次所需时视为未命中
+    if len(pmids) < min(max_results, row.total_count):
+        return None
+    return row.total_count, pmids[:max_results]
+
+
+def save_query(db, query, total_count, pmids):
+    """
+    Store (or refresh) the PMID list for a query. The caller commits.
+    """
+    key = query_hash(query)
+    row = db.query(PubMedQueryCache).filter(PubMedQueryCache.query_hash == key).first()
+    if row is None:
+        row = PubMedQueryCache(query_hash=key, query=query)
+        db.add(row)
+    row.total_count = total_count
+    row.pmids = ",".join(pmids)
+    row.fetched_at = datetime.now()
+
+
+def _in_order(pmids, stored, fetched):
+    """
+    Yield articles in PMID order, taking stored ones from the database and
+    pulling the rest from the ``fetched`` stream as it arrives.
+    """
+    pending = {}
+    for pmid in pmids:
+        if pmid in stored:
+            yield stored[pmid]
+            continue
+        while pmid not in pending:
+            article = next(fetched, None)
+            if article is None:
+                break
+            pending[article["pmid"]] = article
+        if pmid in pending:
+            yield pending.pop(pmid)
+
+
+def search_articles(query, max_results=PUBMED_MAX_RESULTS, client=None):
+    """
+    Search PubMed through the local store.
+
+    The query's PMID list is served from pubmed_query_cache while fresh, and
+    only the articles missing from the articles table are fetched from NCBI.
+    Fetched articles are upserted in batches as they stream in.
+
+    :param query: The PubMed query string.
+    :param max_results: How many articles to return.
+    :param client: A PubMedClient, defaults to the shared one.
+    :return: (total_count, generator of article dicts in relevance order).
+    """
+    client = client or get_pubmed_client()
+    db = SessionLocal()
+    search = None
+    try:
+        cached = get_cached_query(db, query, max_results)
+        if cached is not None:
+            total, pmids = cached
+        else:
+            search = client.search(query, max_results)
+            total, pmids = search.count, search.pmids[:max_results]
+            save_query(db, query, search.count, search.pmids)
+            db.commit()
+        stored = get_articles(db, pmids)
+    except Exception:
+        db.close()
+        raise
+
+    missing = [pmid for pmid in pmids if pmid not in stored]
+    if not missing:
+        fetched = iter(())
+    elif search is not None and len(missing) == len(pmids):
+        # 全部未入库时直接从 history server 分批获取
+        fetched = client.fetch(search, len(pmids))
+    else:
+        fetched = client.fetch_pmids(missing)
+
+    def stream():
+        batch = []
+        try:
+            yield from _in_order(pmids, stored, _saving(db, fetched, batch))
+        finally:
+            try:
+                _flush(db, batch)
+            finally:
+                db.close()
+
+    return total, stream()
+
+
+def _saving(db, articles, batch):
+    for article in articles:
+        batch.append(article)
+        if len(batch) >= PUBMED_BATCH_SIZE:
+            _flush(db, batch)
+        yield article
+
+
+def _flush(db, batch):
+    if not batch:
+        return
+    try:
+        upsert_articles(db, batch)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"保存文献失败: {e}")
+    batch.clear()
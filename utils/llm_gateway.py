@@ -0,0 +1,432 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+
+# 加载 .env 环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "qwen-plus")
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+REPLAY_CHUNK_CHARS = 16  # 缓存命中时按此长度分段回放，复用流式渲染路径
+
+# 并发与重试配置（环境变量）
+MAX_CONCURRENCY = _env_int("LLM_MAX_CONCURRENCY", 8)  # 整个进程同时发往上游的请求数
+MAX_CONCURRENCY_PER_USER = _env_int("LLM_MAX_CONCURRENCY_PER_USER", 2)  # 单个用户同时进行的请求数
+MAX_RETRIES = _env_int("LLM_MAX_RETRIES", 4)
+RETRY_BASE_DELAY = _env_float("LLM_RETRY_BASE_DELAY", 0.5)
+RETRY_MAX_DELAY = _env_float("LLM_RETRY_MAX_DELAY", 8.0)
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def _build_http_client():
+    """
+    Build the keep-alive httpx connection pool shared by every LLM call in the process.
+
+    Timeouts and pool sizes are read from the environment:
+    LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_WRITE_TIMEOUT, LLM_POOL_TIMEOUT,
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY.
+    """
+    timeout = httpx.Timeout(
+        connect=_env_float("LLM_CONNECT_TIMEOUT", 10.0),
+        read=_env_float("LLM_READ_TIMEOUT", 120.0),
+        write=_env_float("LLM_WRITE_TIMEOUT", 30.0),
+        pool=_env_float("LLM_POOL_TIMEOUT", 30.0),
+    )
+    limits = httpx.Limits(
+        max_connections=_env_int("LLM_MAX_CONNECTIONS", 50),
+        max_keepalive_connections=_env_int("LLM_MAX_KEEPALIVE_CONNECTIONS", 20),
+        keepalive_expiry=_env_float("LLM_KEEPALIVE_EXPIRY", 60.0),
+    )
+    return httpx.AsyncClient(timeout=timeout, limits=limits)
+
+
+def _request_key(model, messages, kwargs):
+    data = json.dumps([model, messages, kwargs], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _is_retryable(error):
+    if isinstance(error, APIConnectionError):  # 包括超时
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _backoff_delay(attempt, error):
+    """
+    Exponential backoff with full jitter, never shorter than a Retry-After header.
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass
+    return delay
+
+
+def _get_cache():
+    from utils.response_cache import get_response_cache
+    return get_response_cache()
+
+
+class _End:
+    """Queue marker for the end of a stream bridged to a synchronous caller."""
+
+    def __init__(self, usage=None, error=None):
+        self.usage = usage
+        self.error = error
+
+
+class _Broadcast:
+    """
+    One upstream streaming call whose chunks are shared by every subscriber.
+
+    Subscribers that join late first receive the chunks already produced, so
+    identical requests from different sessions all see the complete answer.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.usage = None
+        self.error = None
+        self.done = False
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, chunk):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, error=None):
+        async with self._changed:
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.chunks) > position or self.done)
+                new_chunks = self.chunks[position:]
+                done = self.done
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+            if done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class _Gateway:
+    """
+    The asyncio side of the gateway.
+
+    An event loop runs on a daemon thread and owns the AsyncOpenAI client, the
+    global and per-user concurrency semaphores, and the table of in-flight
+    requests used to coalesce identical calls.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-gateway", daemon=True)
+        self.thread.start()
+        self.client = None
+        self.global_limit = None
+        self.user_limits = {}  # user -> [Semaphore, 使用者数]
+        self.streams = {}  # request key -> _Broadcast
+        self.calls = {}  # request key -> Task
+        self.submit(self._setup()).result()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _setup(self):
+        try:
+            self.client = AsyncOpenAI(
+                api_key=os.getenv("DASHSCOPE_API_KEY"),
+                base_url=os.getenv("DASHSCOPE_BASE_URL", DEFAULT_BASE_URL),
+                http_client=_build_http_client(),
+                max_retries=0,  # 重试由网关统一处理
+            )
+        except Exception as e:
+            raise Exception(f"初始化阿里云百炼 API 客户端失败，请检查配置。错误信息: {e}")
+        self.global_limit = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    def close(self):
+        self.submit(self.client.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    @contextlib.asynccontextmanager
+    async def limits(self, user):
+        """
+        Hold a per-user slot, then a global slot, for the duration of one upstream call.
+        """
+        entry = None
+        if user:
+            entry = self.user_limits.setdefault(user, [asyncio.Semaphore(MAX_CONCURRENCY_PER_USER), 0])
+            entry[1] += 1
+        try:
+            async with entry[0] if entry else contextlib.nullcontext():
+                async with self.global_limit:
+                    yield
+        finally:
+            if entry:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.user_limits[user]
+
+    async def _store(self, cache, model, messages, kwargs, text):
+        if cache and text:
+            await self.loop.run_in_executor(None, _get_cache().put, model, messages, text, kwargs)
+
+    async def _produce_stream(self, broadcast, model, messages, kwargs, user, cache):
+        try:
+            async with self.limits(user):
+                for attempt in range(MAX_RETRIES + 1):
+                    try:
+                        stream = await self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            stream=True,
+                            stream_options={"include_usage": True},
+                            **kwargs
+                        )
+                        async for chunk in stream:
+                            if chunk.usage:
+                                broadcast.usage = chunk.usage.model_dump()
+                            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                                await broadcast.publish(chunk.choices[0].delta.content)
+                        break
+                    except Exception as e:
+                        # 已经推送过内容的流不能重放，只在首个分块之前重试
+                        if broadcast.chunks or attempt >= MAX_RETRIES or not _is_retryable(e):
+                            raise
+                        delay = _backoff_delay(attempt, e)
+                        logger.warning(f"LLM 请求失败（第 {attempt + 1} 次），{delay:.2f}s 后重试: {e}")
+                        await asyncio.sleep(delay)
+            await broadcast.finish()
+            await self._store(cache, model, messages, kwargs, "".join(broadcast.chunks))
+        except Exception as e:
+            await broadcast.finish(e)
+        finally:
+            if self.streams.get(broadcast.key) is broadcast:
+                del self.streams[broadcast.key]
+
+    def join_stream(self, model, messages, kwargs, user, cache):
+        """
+        Return the broadcast for this request, starting an upstream call only if none is in flight.
+        """
+        key = _request_key(model, messages, kwargs)
+        broadcast = self.streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast(key)
+            self.streams[key] = broadcast
+            broadcast.task = self.loop.create_task(
+                self._produce_stream(broadcast, model, messages, kwargs, user, cache)
+            )
+        return broadcast
+
+    async def _produce_call(self, key, model, messages, kwargs, user, cache):
+        try:
+            async with self.limits(user):
+                for attempt in range(MAX_RETRIES + 1):
+                    try:
+                        completion = await self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            stream=False,
+                            **kwargs
+                        )
+                        break
+                    except Exception as e:
+                        if attempt >= MAX_RETRIES or not _is_retryable(e):
+                            raise
+                        delay = _backoff_delay(attempt, e)
+                        logger.warning(f"LLM 请求失败（第 {attempt + 1} 次），{delay:.2f}s 后重试: {e}")
+                        await asyncio.sleep(delay)
+            content = completion.choices[0].message.content
+            await self._store(cache, model, messages, kwargs, content)
+            return content
+        finally:
+            self.calls.pop(key, None)
+
+    async def call(self, model, messages, kwargs, user, cache):
+        """
+        Run a non-streaming call, sharing the result with identical in-flight calls.
+        """
+        key = _request_key(model, messages, kwargs)
+        task = self.calls.get(key)
+        if task is None:
+            task = self.loop.create_task(self._produce_call(key, model, messages, kwargs, user, cache))
+            self.calls[key] = task
+        # shield：某个调用方取消不会中断其他共享该请求的会话
+        return await asyncio.shield(task)
+
+
+def get_gateway():
+    """
+    Return the process-wide gateway, starting its event loop thread on first use.
+    """
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = _Gateway()
+    return _gateway
+
+
+def reset_gateway():
+    """
+    Shut the gateway down so the next call rebuilds it from the current environment.
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is not None:
+            _gateway.close()
+            _gateway = None
+
+
+async def _chat(messages, model, cache, user, kwargs):
+    if cache:
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, _get_cache().get, model, messages, kwargs)
+        if cached is not None:
+            return cached
+    return await get_gateway().call(model, messages, kwargs, user, cache)
+
+
+async def achat(messages, model=None, cache=False, user=None, **kwargs):
+    """
+    Awaitable variant of chat(), usable from any event loop.
+    """
+    return await asyncio.wrap_future(
+        get_gateway().submit(_chat(messages, model or DEFAULT_MODEL, cache, user, kwargs))
+    )
+
+
+def chat(messages, model=None, cache=False, user=None, **kwargs):
+    """
+    Send a non-streaming chat completion and return the reply text.
+
+    :param messages: A list of {"role": ..., "content": ...} messages.
+    :param model: The model name, defaults to LLM_MODEL / qwen-plus.
+    :param cache: Serve repeated requests from the response cache.
+    :param user: The requesting user, used for the per-user concurrency limit.
+    :param kwargs: Extra arguments for chat.completions.create (e.g. response_format, temperature).
+    :return: The content of the first choice.
+    """
+    model = model or DEFAULT_MODEL
+    if cache:
+        cached = _get_cache().get(model, messages, kwargs)
+        if cached is not None:
+            return cached
+    gateway = get_gateway()
+    return gateway.submit(gateway.call(model, messages, kwargs, user, cache)).result()
+
+
+class ChatStream:
+    """
+    An iterable over the content deltas of a streamed chat completion.
+
+    Iterating performs the request (or replays a cache hit); once exhausted,
+    ``usage`` holds the token usage reported by the API and ``cached`` tells
+    whether the text came from the response cache.
+    """
+
+    def __init__(self, messages, model, cache, user, kwargs):
+        self.messages = messages
+        self.model = model
+        self.cache = cache
+        self.user = user
+        self.kwargs = kwargs
+        self.usage = None
+        self.cached = False
+
+    def __iter__(self):
+        if self.cache:
+            cached = _get_cache().get(self.model, self.messages, self.kwargs)
+            if cached is not None:
+                self.cached = True
+                self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                for i in range(0, len(cached), REPLAY_CHUNK_CHARS):
+                    yield cached[i:i + REPLAY_CHUNK_CHARS]
+                return
+
+        gateway = get_gateway()
+        chunks = queue.Queue()
+
+        async def pump():
+            try:
+                broadcast = gateway.join_stream(self.model, self.messages, self.kwargs, self.user, self.cache)
+                async for chunk in broadcast.subscribe():
+                    chunks.put(chunk)
+                chunks.put(_End(usage=broadcast.usage))
+            except Exception as e:
+                chunks.put(_End(error=e))
+
+        future = gateway.submit(pump())
+        try:
+            while True:
+                item = chunks.get()
+                if isinstance(item, _End):
+                    if item.error is not None:
+                        raise item.error
+                    self.usage = item.usage
+                    return
+                yield item
+        finally:
+            # 调用方提前停止迭代时只取消本订阅，上游请求继续服务其他会话
+            future.cancel()
+
+
+def stream_chat(messages, model=None, cache=False, user=None, **kwargs):
+    """
+    Stream a chat completion, yielding content deltas as they arrive.
+
+    Requests run on the gateway's event loop under the global and per-user
+    concurrency limits, are retried with backoff on 429/5xx before the first
+    chunk, and identical in-flight requests share one upstream call. A cache
+    hit is replayed in small chunks so callers render it exactly like a live
+    stream; a miss is stored once the stream has completed.
+
+    :param messages: A list of {"role": ..., "content": ...} messages.
+    :param model: The model name, defaults to LLM_MODEL / qwen-plus.
+    :param cache: Serve repeated requests from the response cache.
+    :param user: The requesting user, used for the per-user concurrency limit.
+    :param kwargs: Extra arguments for chat.completions.create (e.g. max_tokens, temperature).
+    :return: A ChatStream of text chunks.
+    """
+    return ChatStream(messages, model or DEFAULT_MODEL, cache, user, kwargs)
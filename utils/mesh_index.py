@@ -0,0 +1,205 @@
+import argparse
+import gzip
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+MESH_INDEX_PATH = os.getenv("MESH_INDEX_PATH", os.path.join("data", "mesh", "mesh_index.sqlite"))
+IMPORT_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    ui TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS terms (
+    term_lower TEXT NOT NULL,
+    term TEXT NOT NULL,
+    ui TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_terms_term_lower ON terms (term_lower);
+CREATE VIRTUAL TABLE IF NOT EXISTS terms_fts USING fts5(term_lower, ui UNINDEXED, tokenize='trigram');
+"""
+
+# 记录类型：主题词（描述词）与补充概念
+RECORD_TAGS = {
+    "DescriptorRecord": ("descriptor", "DescriptorUI", "DescriptorName/String"),
+    "SupplementalRecord": ("supplementary", "SupplementalRecordUI", "SupplementalRecordName/String"),
+}
+
+
+def _open(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def iter_mesh_records(path):
+    """
+    Stream (ui, label, kind, entry_terms) tuples from a MeSH desc/supp XML dump.
+
+    Uses iterparse and clears each record after reading it, so memory stays
+    flat even for the full descriptor file.
+    """
+    with _open(path) as f:
+        for _, element in ET.iterparse(f, events=("end",)):
+            spec = RECORD_TAGS.get(element.tag)
+            if spec is None:
+                continue
+            kind, ui_path, label_path = spec
+            ui = element.findtext(ui_path)
+            label = element.findtext(label_path)
+            if ui and label:
+                terms = [term.text for term in element.iterfind("ConceptList/Concept/TermList/Term/String") if term.text]
+                yield ui, label, kind, list(dict.fromkeys([label] + terms))
+            element.clear()
+
+
+def import_mesh_xml(paths, index_path=MESH_INDEX_PATH):
+    """
+    Build (or rebuild) the local MeSH index from one or more XML dumps.
+
+    :param paths: desc20XX.xml / supp20XX.xml files, optionally gzipped.
+    :param index_path: The SQLite file to write.
+    :return: The number of records imported.
+    """
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    connection.executescript(SCHEMA)
+    count = 0
+    records, terms = [], []
+
+    def flush():
+        connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?)", records)
+        connection.executemany("INSERT INTO terms VALUES (?, ?, ?)", terms)
+        connection.executemany("INSERT INTO terms_fts VALUES (?, ?)", [(t[0], t[2]) for t in terms])
+        records.clear()
+        terms.clear()
+
+    for path in paths:
+        for ui, label, kind, entry_terms in iter_mesh_records(path):
+            records.append((ui, label, kind))
+            terms.extend((term.lower(), term, ui) for term in entry_terms)
+            count += 1
+            if len(records) >= IMPORT_BATCH_SIZE:
+                flush()
+    flush()
+    connection.commit()
+    connection.execute("INSERT INTO terms_fts(terms_fts) VALUES ('optimize')")
+    connection.commit()
+    connection.close()
+    # 构建完成后原子替换，正在运行的进程不会读到半成品
+    os.replace(tmp_path, index_path)
+    return count
+
+
+class MeshIndex:
+    """
+    Read-only lookups against the local MeSH index.
+
+    Each thread gets its own SQLite connection, so the index can be queried
+    from the worker threads of my_references.get_combined_terms.
+    """
+
+    def __init__(self, index_path=MESH_INDEX_PATH):
+        self.index_path = index_path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            uri = f"file:{os.path.abspath(self.index_path)}?mode=ro"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, keyword, match="exact", limit=10, include_supplementary=False):
+        """
+        Return descriptor labels whose name or entry terms match the keyword.
+
+        :param keyword: The term to look up (case-insensitive).
+        :param match: "exact", "startswith" or "contains", as in the NLM lookup API.
+        :param limit: Maximum number of labels.
+        :param include_supplementary: Also return supplementary concept records.
+        :return: A list of labels, best matches (exact, then prefix) first.
+        """
+        return list(self._lookup(keyword.strip().lower(), match, limit, include_supplementary))
+
+    @lru_cache(maxsize=4096)
+    def _lookup(self, keyword, match, limit, include_supplementary):
+        if not keyword:
+            return ()
+        kinds = ("descriptor", "supplementary") if include_supplementary else ("descriptor",)
+        placeholders = ",".join("?" * len(kinds))
+        connection = self._connection()
+        if match == "exact":
+            rows = connection.execute(
+                f"SELECT DISTINCT r.label FROM terms t JOIN records r ON r.ui = t.ui "
+                f"WHERE t.term_lower = ? AND r.kind IN ({placeholders}) LIMIT ?",
+                (keyword, *kinds, limit),
+            ).fetchall()
+            return tuple(row[0] for row in rows)
+
+        if match == "startswith":
+            condition, params = "t.term_lower >= ? AND t.term_lower < ?", (keyword, keyword + "\uffff")
+            source = "terms t"
+        elif len(keyword) >= 3:
+            # trigram 分词的 FTS5 支持任意子串匹配
+            condition, params = "t.term_lower MATCH ?", ('"' + keyword.replace('"', '""') + '"',)
+            source = "terms_fts t"
+        else:
+            condition, params = "t.term_lower LIKE ?", (f"%{keyword}%",)
+            source = "terms t"
+        rows = connection.execute(
+            f"SELECT r.label, MIN(CASE WHEN t.term_lower = ? THEN 0 "
+            f"WHEN substr(t.term_lower, 1, ?) = ? THEN 1 ELSE 2 END) AS rank, MIN(length(t.term_lower)) AS size "
+            f"FROM {source} JOIN records r ON r.ui = t.ui "
+            f"WHERE {condition} AND r.kind IN ({placeholders}) "
+            f"GROUP BY r.label ORDER BY rank, size LIMIT ?",
+            (keyword, len(keyword), keyword, *params, *kinds, limit),
+        ).fetchall()
+        return tuple(row[0] for row in rows)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_mesh_index():
+    """
+    Return the shared MeshIndex, or None if no index has been imported yet.
+    """
+    global _index
+    if _index is None and os.path.exists(MESH_INDEX_PATH):
+        with _index_lock:
+            if _index is None:
+                _index = MeshIndex(MESH_INDEX_PATH)
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 MeSH 主题词索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="从 MeSH XML 导入（desc20XX.xml / supp20XX.xml，可为 .gz）")
+    import_parser.add_argument("paths", nargs="+")
+    import_parser.add_argument("--index", default=MESH_INDEX_PATH)
+    query_parser = subparsers.add_parser("query", help="查询本地索引")
+    query_parser.add_argument("keyword")
+    query_parser.add_argument("--match", default="contains", choices=["exact", "startswith", "contains"])
+    query_parser.add_argument("--limit", type=int, default=10)
+    query_parser.add_argument("--index", default=MESH_INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        count = import_mesh_xml(args.paths, args.index)
+        print(f"已导入 {count} 条 MeSH 记录到 {args.index}")
+    else:
+        print(MeshIndex(args.index).lookup(args.keyword, match=args.match, limit=args.limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EUTILS_BASE_URL = os.getenv("NCBI_EUTILS_BASE_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+NCBI_TOOL = os.getenv("NCBI_TOOL", "nursing-research-assistant")
+NCBI_EMAIL = os.getenv("NCBI_EMAIL")
+# NCBI 限制：无 API Key 每秒 3 次请求，有 API Key 每秒 10 次
+NCBI_REQUESTS_PER_SECOND = float(os.getenv("NCBI_REQUESTS_PER_SECOND", "10" if NCBI_API_KEY else "3"))
+PUBMED_BATCH_SIZE = int(os.getenv("PUBMED_BATCH_SIZE", "200"))
+PUBMED_MAX_RESULTS = int(os.getenv("PUBMED_MAX_RESULTS", "200"))
+PUBMED_HTTP_TIMEOUT = float(os.getenv("PUBMED_HTTP_TIMEOUT", "30"))
+PUBMED_MAX_RETRIES = int(os.getenv("PUBMED_MAX_RETRIES", "3"))
+ESEARCH_MAX_RETMAX = 10000  # esearch 单次最多返回的 PMID 数
+
+
+@dataclass
+class SearchResult:
+    count: int  # PubMed 中命中的总数
+    webenv: str
+    query_key: str
+    pmids: list  # 按相关性排序的前 max_results 个 PMID
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most ``rate`` start per second, across threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _text(element, path):
+    node = element.find(path)
+    return "".join(node.itertext()).strip() if node is not None else None
+
+
+def _publication_year(article):
+    issue_date = article.find("MedlineCitation/Article/Journal/JournalIssue/PubDate")
+    if issue_date is not None:
+        year = issue_date.findtext("Year") or (issue_date.findtext("MedlineDate") or "")[:4]
+        if year:
+            return year
+    for pub_date in article.iterfind("PubmedData/History/PubMedPubDate"):
+        if pub_date.get("PubStatus") == "pubmed" and pub_date.findtext("Year"):
+            return pub_date.findtext("Year")
+    return "N/A"
+
+
+def parse_article(article):
+    """
+    Convert a ``PubmedArticle`` element into a plain dict.
+
+    :param article: The parsed ``PubmedArticle`` element.
+    :return: A dict with pmid, title, authors, journal, year, abstract and mesh_terms.
+    """
+    authors = []
+    for author in article.iterfind("MedlineCitation/Article/AuthorList/Author"):
+        last_name = author.findtext("LastName")
+        fore_name = author.findtext("ForeName")
+        if last_name and fore_name:
+            authors.append(f"{fore_name} {last_name}")
+        elif last_name:
+            authors.append(last_name)
+        elif author.findtext("CollectiveName"):
+            authors.append(author.findtext("CollectiveName"))
+
+    sections = []
+    for part in article.iterfind("MedlineCitation/Article/Abstract/AbstractText"):
+        text = "".join(part.itertext()).strip()
+        label = part.get("Label")
+        if text:
+            sections.append(f"{label}: {text}" if label else text)
+
+    mesh_terms = [
+        heading.findtext("DescriptorName")
+        for heading in article.iterfind("MedlineCitation/MeshHeadingList/MeshHeading")
+        if heading.findtext("DescriptorName")
+    ]
+    return {
+        "pmid": article.findtext("MedlineCitation/PMID"),
+        "title": _text(article, "MedlineCitation/Article/ArticleTitle") or "",
+        "authors": authors,
+        "journal": _text(article, "MedlineCitation/Article/Journal/Title") or "",
+        "year": _publication_year(article),
+        "abstract": "\n".join(sections),
+        "mesh_terms": mesh_terms,
+    }
+
+
+def iter_pubmed_articles(stream):
+    """
+    Stream parsed articles out of an efetch XML response.
+
+    Each ``PubmedArticle`` is dropped from the tree once parsed, so memory
+    stays bounded by a single article rather than the whole batch.
+
+    :param stream: A file-like object with the efetch XML.
+    """
+    root = None
+    for event, element in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+        if element.tag == "PubmedArticle":
+            yield parse_article(element)
+            root.clear()
+
+
+class PubMedClient:
+    """
+    E-utilities client that searches with the history server and fetches in batches.
+    """
+
+    def __init__(self, api_key=NCBI_API_KEY, batch_size=PUBMED_BATCH_SIZE, rate=NCBI_REQUESTS_PER_SECOND):
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate)
+        self.http = requests.Session()
+
+    def _params(self, **params):
+        params["db"] = "pubmed"
+        params["tool"] = NCBI_TOOL
+        if NCBI_EMAIL:
+            params["email"] = NCBI_EMAIL
+        if self.api_key:
+            params["api_key"] = self.api_key
+        return params
+
+    def _request(self, endpoint, params, stream=False):
+        url = f"{EUTILS_BASE_URL}/{endpoint}"
+        for attempt in range(PUBMED_MAX_RETRIES + 1):
+            self.limiter.wait()
+            try:
+                # 使用 POST 避免检索式过长时超出 URL 长度限制
+                response = self.http.post(url, data=params, stream=stream, timeout=PUBMED_HTTP_TIMEOUT)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response
+                response.close()
+                error = requests.HTTPError(f"{response.status_code} from {endpoint}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt == PUBMED_MAX_RETRIES:
+                raise error
+            time.sleep(min(8.0, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+
+    def search(self, query, max_results=PUBMED_MAX_RESULTS):
+        """
+        Run esearch with ``usehistory=y``.
+
+        :param query: The PubMed query string.
+        :param max_results: How many PMIDs to return (the full result set stays on the history server).
+        :return: A SearchResult.
+        """
+        params = self._params(term=query, usehistory="y", retmax=min(max_results, ESEARCH_MAX_RETMAX))
+        with self._request("esearch.fcgi", params) as response:
+            root = ET.fromstring(response.content)
+        error = root.findtext("ERROR")
+        if error:
+            raise ValueError(f"PubMed 检索式错误: {error}")
+        return SearchResult(
+            count=int(root.findtext("Count") or 0),
+            webenv=root.findtext("WebEnv"),
+            query_key=root.findtext("QueryKey"),
+            pmids=[id.text for id in root.iterfind("IdList/Id")],
+        )
+
+    def fetch(self, search, max_results=PUBMED_MAX_RESULTS, start=0):
+        """
+        Fetch articles for a search from the history server, one batch per request.
+
+        :param search: The SearchResult returned by :meth:`search`.
+        :param max_results: Stop after this many articles.
+        :param start: Offset into the result set.
+        :return: A generator of article dicts, yielded as each one is parsed.
+        """
+        end = min(search.count, start + max_results)
+        for retstart in range(start, end, self.batch_size):
+            params = self._params(
+                query_key=search.query_key,
+                WebEnv=search.webenv,
+                retstart=retstart,
+                retmax=min(self.batch_size, end - retstart),
+                retmode="xml",
+            )
+            with self._request("efetch.fcgi", params, stream=True) as response:
+                response.raw.decode_content = True
+                yield from iter_pubmed_articles(response.raw)
+
+    def fetch_pmids(self, pmids):
+        """
+        Fetch articles by PMID, in batches.
+
+        :param pmids: The PMIDs to fetch.
+        :return: A generator of article dicts.
+        """
+        pmids = list(pmids)
+        for i in range(0, len(pmids), self.batch_size):
+            params = self._params(id=",".join(pmids[i:i + self.batch_size]), retmode="xml")
+            with self._request("efetch.fcgi", params, stream=True) as response:
+                response.raw.decode_content = True
+                yield from iter_pubmed_articles(response.raw)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_pubmed_client():
+    """
+    Return the process-wide PubMedClient, so all users share one NCBI rate limit.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PubMedClient()
+    return _client
@@ -0,0 +1,282 @@
+import os
+
+import numpy as np
+
+# 量化配置（环境变量）
+PQ_SUBSPACES = int(os.getenv("VECTOR_PQ_SUBSPACES", "0"))  # 子空间数，0 表示 dim // 4（每个子向量 4 维，对 float32 压缩 16 倍）
+PQ_BITS = 8  # 每个子空间 256 个聚类中心，编码为 uint8
+QUANT_TRAIN_SAMPLE = int(os.getenv("VECTOR_QUANT_TRAIN_SAMPLE", "10000"))  # 训练码本使用的最大样本数
+QUANT_SEARCH_BLOCK_ROWS = 65536  # 扫描编码时每块的行数
+SCORE_CHUNK_ROWS = 4096  # 计算得分时的分片行数，使分片留在 CPU 缓存中
+
+
+class ScalarQuantizer:
+    """
+    Per-dimension symmetric int8 quantization: one byte per dimension.
+
+    Each dimension is scaled so that its 99.9th percentile magnitude maps to
+    127, which keeps a few outliers from wasting the range.
+    """
+
+    kind = "int8"
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.scale = None
+
+    @property
+    def code_size(self):
+        return self.dim
+
+    @property
+    def code_dtype(self):
+        return np.int8
+
+    def train(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.scale = np.maximum(np.percentile(np.abs(vectors), 99.9, axis=0), 1e-6).astype(np.float32) / 127
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale
+
+    def lookup(self, query):
+        """
+        Fold the scales into the query, so a score is one int8 x float32 dot product per row.
+        """
+        return np.asarray(query, dtype=np.float32) * self.scale
+
+    def scores(self, codes, table):
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+            chunk = codes[start:start + SCORE_CHUNK_ROWS]
+            out[start:start + len(chunk)] = chunk.astype(np.float32) @ table
+        return out
+
+    def state(self):
+        return {"scale": self.scale}
+
+    def load_state(self, state):
+        self.scale = np.asarray(state["scale"], dtype=np.float32)
+
+
+def _kmeans(vectors, clusters, iterations, rng):
+    # Lloyd 迭代；空簇用随机样本重新初始化
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=len(vectors) < clusters)].copy()
+    norms = (vectors ** 2).sum(axis=1)
+    for _ in range(iterations):
+        distances = norms[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=clusters)
+        sums = np.stack([np.bincount(assignment, weights=vectors[:, d], minlength=clusters)
+                         for d in range(vectors.shape[1])], axis=1).astype(np.float32)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+
+class ProductQuantizer:
+    """
+    Product quantization (Jégou et al., 2011) with asymmetric distance computation.
+
+    A vector is split into ``m`` sub-vectors, each replaced by the index of
+    its nearest of 256 centroids learned by k-means, so it takes ``m`` bytes.
+    At query time the inner products between the query's sub-vectors and
+    every centroid are computed once into an (m, 256) table, and a row's
+    score is the sum of its ``m`` table entries; the query itself is never
+    quantized.
+    """
+
+    kind = "pq"
+
+    def __init__(self, dim, m=PQ_SUBSPACES, iterations=10, seed=0):
+        m = m or max(1, dim // 4)
+        # 子空间数须整除维度，否则取不超过 m 的最大约数
+        while dim % m:
+            m -= 1
+        self.dim = dim
+        self.m = m
+        self.sub_dim = dim // m
+        self.clusters = 2 ** PQ_BITS
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None  # (m, 256, sub_dim)
+
+    @property
+    def code_size(self):
+        return self.m
+
+    @property
+    def code_dtype(self):
+        return np.uint8
+
+    def _split(self, vectors):
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.m, self.sub_dim)
+
+    def train(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        parts = self._split(vectors)
+        self.centroids = np.stack([_kmeans(np.ascontiguousarray(parts[:, j]), self.clusters, self.iterations, rng)
+                                   for j in range(self.m)]).astype(np.float32)
+
+    def encode(self, vectors):
+        parts = self._split(vectors)
+        codes = np.empty((len(parts), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            centroids = self.centroids[j]
+            distances = -2 * parts[:, j] @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+            codes[:, j] = distances.argmin(axis=1)
+        return codes
+
+    def decode(self, codes):
+        return self.centroids[np.arange(self.m), codes].reshape(len(codes), self.dim)
+
+    def lookup(self, query):
+        """
+        Build the (m, 256) table of inner products between query sub-vectors and centroids.
+        """
+        return np.einsum("jcd,jd->jc", self.centroids, np.asarray(query, dtype=np.float32).reshape(self.m, -1))
+
+    def scores(self, codes, table):
+        # 逐子空间查表累加；分片后按列读取的编码仍在缓存中
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+            chunk = codes[start:start + SCORE_CHUNK_ROWS]
+            total = np.zeros(len(chunk), dtype=np.float32)
+            for j in range(self.m):
+                total += table[j].take(chunk[:, j])
+            out[start:start + len(chunk)] = total
+        return out
+
+    def state(self):
+        return {"centroids": self.centroids}
+
+    def load_state(self, state):
+        self.centroids = np.asarray(state["centroids"], dtype=np.float32)
+
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+
+
+def make_quantizer(kind, dim, **options):
+    if kind not in QUANTIZERS:
+        raise ValueError(f"未知的量化方式: {kind}，可选 {', '.join(QUANTIZERS)}")
+    return QUANTIZERS[kind](dim, **options)
+
+
+class QuantizedIndex:
+    """
+    A flat index over quantized codes, scanned with asymmetric distance computation.
+
+    Rows are addressed by SegmentStore label like the HNSW backends, so
+    RAGIndex can use it in their place. The codebook is trained on the
+    first vectors added. Saved codes are opened with ``mmap_mode="r"`` and
+    shared between processes; rows added afterwards are kept in memory.
+    """
+
+    def __init__(self, dim, kind="int8", **options):
+        self.dim = dim
+        self.quantizer = make_quantizer(kind, dim, **options)
+        self.base = np.zeros((0, self.quantizer.code_size), dtype=self.quantizer.code_dtype)
+        self.tail = np.zeros((0, self.quantizer.code_size), dtype=self.quantizer.code_dtype)
+        self.tail_rows = 0
+        self.filled = np.zeros(0, dtype=bool)  # 按 label 标记已写入编码且未删除的行
+        self.trained = False
+
+    @property
+    def kind(self):
+        return self.quantizer.kind
+
+    @property
+    def rows(self):
+        return len(self.base) + self.tail_rows
+
+    def __len__(self):
+        return int(self.filled.sum())
+
+    def bytes_per_vector(self):
+        return self.quantizer.code_size * np.dtype(self.quantizer.code_dtype).itemsize
+
+    def add(self, labels, vectors):
+        labels = np.asarray(labels, dtype=np.int64)
+        if not len(labels):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not self.trained:
+            sample = vectors
+            if len(sample) > QUANT_TRAIN_SAMPLE:
+                sample = sample[np.random.default_rng(0).choice(len(sample), QUANT_TRAIN_SAMPLE, replace=False)]
+            self.quantizer.train(sample)
+            self.trained = True
+        rows = int(labels.max()) + 1
+        if rows > self.rows:
+            needed = rows - len(self.base)
+            if needed > len(self.tail):
+                grown = np.zeros((max(needed, 2 * len(self.tail)), self.quantizer.code_size),
+                                 dtype=self.quantizer.code_dtype)
+                grown[:self.tail_rows] = self.tail[:self.tail_rows]
+                self.tail = grown
+            self.tail_rows = needed
+            self.filled = np.concatenate([self.filled, np.zeros(rows - len(self.filled), dtype=bool)])
+        if (labels < len(self.base)).any():
+            raise ValueError("不能覆盖已落盘的编码")
+        self.tail[labels - len(self.base)] = self.quantizer.encode(vectors)
+        self.filled[labels] = True
+
+    def delete(self, labels):
+        labels = np.asarray(labels, dtype=np.int64)
+        self.filled[labels[labels < len(self.filled)]] = False
+
+    def _blocks(self):
+        for start in range(0, len(self.base), QUANT_SEARCH_BLOCK_ROWS):
+            yield start, self.base[start:start + QUANT_SEARCH_BLOCK_ROWS]
+        for start in range(0, self.tail_rows, QUANT_SEARCH_BLOCK_ROWS):
+            yield len(self.base) + start, self.tail[start:min(start + QUANT_SEARCH_BLOCK_ROWS, self.tail_rows)]
+
+    def search(self, query, k, ef=None):
+        """
+        Return the ``k`` rows with the highest approximate inner product.
+
+        :return: (labels, approximate scores), best first.
+        """
+        if not self.trained or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        table = self.quantizer.lookup(query)
+        best_labels, best_scores = [], []
+        for start, block in self._blocks():
+            scores = self.quantizer.scores(block, table).astype(np.float32)
+            scores[~self.filled[start:start + len(block)]] = -np.inf
+            take = min(k, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_labels.append(top + start)
+            best_scores.append(scores[top])
+        if not best_labels:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        labels, scores = np.concatenate(best_labels), np.concatenate(best_scores)
+        keep = np.isfinite(scores)
+        labels, scores = labels[keep], scores[keep]
+        order = np.argsort(-scores)[:k]
+        return labels[order].astype(np.int64), scores[order]
+
+    def save(self, path):
+        np.save(path + ".codes.npy", np.concatenate([self.base, self.tail[:self.tail_rows]]))
+        np.savez(path + ".quant.npz", kind=self.kind, filled=self.filled, **self.quantizer.state())
+        return [".codes.npy", ".quant.npz"]
+
+    @classmethod
+    def load(cls, path, dim):
+        with np.load(path + ".quant.npz") as data:
+            index = cls(dim, str(data["kind"]))
+            index.quantizer.load_state(data)
+            index.filled = data["filled"].copy()
+        try:
+            index.base = np.load(path + ".codes.npy", mmap_mode="r")
+        except ValueError:  # 空文件无法映射
+            index.base = np.load(path + ".codes.npy")
+        index.trained = True
+        return index
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models.database import SessionLocal
+from models.project_models import LLMResponseCache
+
+logger = logging.getLogger(__name__)
+
+# 缓存配置（环境变量）
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))  # 内存 LRU 容量
+CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "20000"))  # 数据库中保留的最大条数
+CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SEMANTIC_ENABLED = os.getenv("LLM_CACHE_SEMANTIC", "0") == "1"
+SEMANTIC_THRESHOLD = float(os.getenv("LLM_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+SEMANTIC_CANDIDATES = int(os.getenv("LLM_CACHE_SEMANTIC_CANDIDATES", "200"))
+PRUNE_EVERY = 100  # 每写入多少条检查一次数据库容量
+
+
+def _digest(payload):
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def make_keys(model, messages, params=None):
+    """
+    Compute the exact cache key and the context key for a request.
+
+    The exact key hashes (model, messages, params). The context key hashes the
+    same request without its last user message, so near-duplicate lookups only
+    ever match prompts asked in an identical conversation context.
+
+    :return: (cache_key, context_key, prompt) where prompt is the last user message.
+    """
+    params = params or {}
+    prompt = ""
+    context = list(messages)
+    if context and context[-1].get("role") == "user":
+        prompt = context.pop()["content"]
+    cache_key = _digest([model, messages, params])
+    context_key = _digest([model, context, params])
+    return cache_key, context_key, prompt
+
+
+class ResponseCache:
+    """
+    A two-level cache of LLM completions: an in-memory LRU with TTL in front of
+    the llm_response_cache table, plus an optional near-duplicate lookup that
+    compares prompt embeddings from the shared utils.embeddings service.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS,
+                 semantic=SEMANTIC_ENABLED, threshold=SEMANTIC_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.threshold = threshold
+        self._entries = OrderedDict()  # cache_key -> (response, stored_at)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _expired(self, stored_at):
+        return time.time() - stored_at > self.ttl_seconds
+
+    def _remember(self, cache_key, response, stored_at=None):
+        with self._lock:
+            self._entries[cache_key] = (response, stored_at or time.time())
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _embed(self, text):
+        import numpy as np
+        from utils.embeddings import get_embedding_service
+        return get_embedding_service().encode([text], dtype=np.float32)[0]
+
+    def get(self, model, messages, params=None):
+        """
+        Look up a cached completion.
+
+        :return: The cached response text, or None on a miss.
+        """
+        cache_key, context_key, prompt = make_keys(model, messages, params)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if not self._expired(entry[1]):
+                    self._entries.move_to_end(cache_key)
+                    return entry[0]
+                del self._entries[cache_key]
+        try:
+            loaded = self._load(cache_key, context_key, model, prompt)
+        except Exception as e:
+            logger.warning(f"读取 LLM 缓存失败: {e}")
+            return None
+        if loaded is None:
+            return None
+        # 按数据库行的写入时间计算 TTL，内存中的副本不会比数据库行活得更久
+        response, created_at = loaded
+        self._remember(cache_key, response, stored_at=created_at.timestamp() if created_at else None)
+        return response
+
+    def _load(self, cache_key, context_key, model, prompt):
+        # 返回 (回答, 写入时间)；近似命中时为匹配到的那一行的写入时间
+        db = SessionLocal()
+        try:
+            cutoff = datetime.now() - timedelta(seconds=self.ttl_seconds)
+            row = db.query(LLMResponseCache).filter(LLMResponseCache.cache_key == cache_key).first()
+            if row is not None and row.created_at is not None and row.created_at < cutoff:
+                db.delete(row)
+                db.commit()
+                row = None
+            if row is None and self.semantic and prompt:
+                row = self._nearest(db, context_key, model, prompt, cutoff)
+            if row is None:
+                return None
+            response, created_at = row.response, row.created_at
+            row.hit_count = (row.hit_count or 0) + 1
+            row.last_hit_at = datetime.now()
+            db.commit()
+            return response, created_at
+        finally:
+            db.close()
+
+    def _nearest(self, db, context_key, model, prompt, cutoff):
+        import numpy as np
+        candidates = (
+            db.query(LLMResponseCache)
+            .filter(
+                LLMResponseCache.context_key == context_key,
+                LLMResponseCache.model == model,
+                LLMResponseCache.embedding.isnot(None),
+                LLMResponseCache.created_at >= cutoff,
+            )
+            .order_by(LLMResponseCache.last_hit_at.desc())
+            .limit(SEMANTIC_CANDIDATES)
+            .all()
+        )
+        if not candidates:
+            return None
+        query = self._embed(prompt)
+        matrix = np.stack([np.frombuffer(row.embedding, dtype=np.float32) for row in candidates])
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return candidates[best]
+        return None
+
+    def put(self, model, messages, response, params=None):
+        """
+        Store a completed response in memory and in the database.
+        """
+        if not response:
+            return
+        cache_key, context_key, prompt = make_keys(model, messages, params)
+        self._remember(cache_key, response)
+        db = SessionLocal()
+        try:
+            embedding = self._embed(prompt).tobytes() if self.semantic and prompt else None
+            row = db.query(LLMResponseCache).filter(LLMResponseCache.cache_key == cache_key).first()
+            now = datetime.now()
+            if row is None:
+                row = LLMResponseCache(cache_key=cache_key, context_key=context_key, model=model,
+                                       prompt=prompt, hit_count=0)
+                db.add(row)
+            row.response = response
+            row.embedding = embedding
+            row.created_at = now
+            row.last_hit_at = now
+            db.commit()
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self.prune(db)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"写入 LLM 缓存失败: {e}")
+        finally:
+            db.close()
+
+    def prune(self, db=None):
+        """
+        Delete expired rows, then the least recently hit rows above LLM_CACHE_MAX_ROWS.
+        """
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            cutoff = datetime.now() - timedelta(seconds=self.ttl_seconds)
+            db.query(LLMResponseCache).filter(LLMResponseCache.created_at < cutoff).delete(synchronize_session=False)
+            overflow = db.query(LLMResponseCache.id).order_by(LLMResponseCache.last_hit_at.desc()).offset(CACHE_MAX_ROWS)
+            db.query(LLMResponseCache).filter(
+                LLMResponseCache.id.in_(select(overflow.subquery().c.id))
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"清理 LLM 缓存失败: {e}")
+        finally:
+            if own_session:
+                db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide ResponseCache.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
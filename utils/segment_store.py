@@ -0,0 +1,412 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 分段存储配置（环境变量）
+SEGMENT_ROWS = int(os.getenv("VECTOR_SEGMENT_ROWS", "65536"))  # 单个分段的最大行数
+SEARCH_BLOCK_ROWS = 65536  # 暴力检索时每次转换为 float32 的行数
+VECTOR_DTYPE = np.float16
+MANIFEST = "manifest.json"
+TOMBSTONES = "tombstones.log"  # 早期 manifest 未记录删除日志文件名时使用的默认名
+
+
+def tombstone_log(generation):
+    # 删除日志按 generation 区分，压缩后的新 manifest 与旧日志不会被混用
+    return f"tombstones.{generation}.log"
+
+
+class _FileLock:
+    """
+    An exclusive inter-process lock on a file, held by writers while they append or swap the manifest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            self._file = open(self.path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+class SegmentStore:
+    """
+    An append-only on-disk vector store shared by several processes.
+
+    Vectors live in raw float16 segment files (``seg-NNNNNN.f16``) opened
+    with ``np.memmap``, so worker processes share pages through the OS
+    cache instead of each holding a copy. Each segment has an id sidecar
+    (``.ids.jsonl``: id, doc_id and the offset of its metadata) and a
+    metadata sidecar (``.meta.jsonl``) read on demand. Deletes append
+    ``segment row`` lines to the generation's tombstone log
+    (``tombstones.<generation>.log``); :meth:`compact` rewrites the live
+    rows into fresh segments.
+
+    ``manifest.json`` records how many rows and bytes of each file are
+    committed and is replaced atomically, so readers never see a partial
+    append. Labels are global row numbers and stay stable until the next
+    compaction, which bumps ``generation``.
+    """
+
+    def __init__(self, directory, dim=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.dim = dim
+        self._write_lock = _FileLock(os.path.join(directory, ".lock"))
+        self._lock = threading.RLock()
+        self._meta_files = {}
+        self._maps = {}  # 分段名 -> (行数, memmap)
+        self._reset()
+        self.reload()
+
+    def _reset(self):
+        self.generation = 0
+        self.version = -1
+        self.segments = []  # [{"name", "rows", "ids_bytes", "meta_bytes"}]
+        self.next_segment = 1
+        self.tombstone_file = TOMBSTONES
+        self.tombstone_bytes = 0
+        self.ids = []  # label -> 外部 id
+        self.doc_ids = []  # label -> 源文档 id
+        self.meta_refs = []  # label -> (分段名, 偏移, 长度)
+        self.alive = np.zeros(0, dtype=bool)
+        self.tombstones = []  # 按写入顺序排列的已删除 label
+        self._loaded = {}  # 分段名 -> 已读取的 (行数, ids 字节数)
+        for handle in self._meta_files.values():
+            handle.close()
+        self._meta_files = {}
+        self._maps = {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    @property
+    def rows(self):
+        return len(self.ids)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self):
+        self.version += 1
+        manifest = {"dim": self.dim, "dtype": "float16", "generation": self.generation, "version": self.version,
+                    "next_segment": self.next_segment, "segments": self.segments,
+                    "tombstone_file": self.tombstone_file, "tombstone_bytes": self.tombstone_bytes}
+        tmp_path = self._path(MANIFEST + f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(MANIFEST))
+
+    def reload(self):
+        """
+        Pick up rows and tombstones committed by other processes since the last call.
+
+        Only the new tail of each sidecar is read; a new generation (after a
+        compaction elsewhere) triggers a full reload.
+
+        :return: True if anything changed.
+        """
+        with self._lock:
+            manifest = self._read_manifest()
+            if manifest is None or manifest["version"] == self.version and manifest["generation"] == self.generation:
+                return False
+            if manifest["generation"] != self.generation:
+                self._reset()
+            self.dim = manifest["dim"]
+            self.generation = manifest["generation"]
+            self.version = manifest["version"]
+            self.next_segment = manifest["next_segment"]
+            self.segments = manifest["segments"]
+            self.tombstone_file = manifest.get("tombstone_file", TOMBSTONES)
+            for segment in self.segments:
+                self._load_ids(segment)
+            self._load_tombstones(manifest["tombstone_bytes"])
+            return True
+
+    def _load_ids(self, segment):
+        name = segment["name"]
+        rows_loaded, bytes_loaded = self._loaded.get(name, (0, 0))
+        if rows_loaded >= segment["rows"]:
+            return
+        with open(self._path(name + ".ids.jsonl"), "rb") as f:
+            f.seek(bytes_loaded)
+            data = f.read(segment["ids_bytes"] - bytes_loaded)
+        for line in data.splitlines():
+            doc_id, source, offset, length = json.loads(line)
+            self.ids.append(doc_id)
+            self.doc_ids.append(source)
+            self.meta_refs.append((name, offset, length))
+        added = segment["rows"] - rows_loaded
+        self.alive = np.concatenate([self.alive, np.ones(added, dtype=bool)])
+        self._loaded[name] = (segment["rows"], segment["ids_bytes"])
+
+    def _segment_base(self):
+        bases, base = {}, 0
+        for segment in self.segments:
+            bases[segment["name"]] = base
+            base += segment["rows"]
+        return bases
+
+    def _load_tombstones(self, tombstone_bytes):
+        if tombstone_bytes <= self.tombstone_bytes:
+            return
+        with open(self._path(self.tombstone_file), "rb") as f:
+            f.seek(self.tombstone_bytes)
+            data = f.read(tombstone_bytes - self.tombstone_bytes)
+        bases = self._segment_base()
+        for line in data.decode("utf-8").splitlines():
+            name, row = line.split()
+            if name in bases:
+                label = bases[name] + int(row)
+                if self.alive[label]:
+                    self.alive[label] = False
+                    self.tombstones.append(label)
+        self.tombstone_bytes = tombstone_bytes
+
+    def _open_segment(self, segment):
+        # 追加写入时截掉未提交的尾部，避免上次中断留下的残缺数据
+        name = segment["name"]
+        files = {}
+        for suffix, size in ((".f16", segment["rows"] * self.dim * 2), (".ids.jsonl", segment["ids_bytes"]),
+                             (".meta.jsonl", segment["meta_bytes"])):
+            handle = open(self._path(name + suffix), "ab")
+            handle.truncate(size)
+            files[suffix] = handle
+        return files
+
+    def append(self, ids, vectors, metadatas):
+        """
+        Append vectors with their ids and metadata, starting new segments as needed.
+
+        :param ids: External ids.
+        :param vectors: A (n, dim) array; stored as float16.
+        :param metadatas: One dict per row; ``doc_id`` is also kept in memory for document lookups.
+        :return: The labels assigned to the rows.
+        """
+        vectors = np.asarray(vectors, dtype=VECTOR_DTYPE)
+        with self._write_lock, self._lock:
+            self.reload()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            start = self.rows
+            written = 0
+            while written < len(ids):
+                if not self.segments or self.segments[-1]["rows"] >= SEGMENT_ROWS:
+                    self.segments.append({"name": f"seg-{self.next_segment:06d}", "rows": 0,
+                                          "ids_bytes": 0, "meta_bytes": 0})
+                    self.next_segment += 1
+                segment = self.segments[-1]
+                count = min(len(ids) - written, SEGMENT_ROWS - segment["rows"])
+                self._append_to(segment, ids[written:written + count], vectors[written:written + count],
+                                metadatas[written:written + count])
+                written += count
+            self._write_manifest()
+            return list(range(start, self.rows))
+
+    def _append_to(self, segment, ids, vectors, metadatas):
+        files = self._open_segment(segment)
+        try:
+            files[".f16"].write(np.ascontiguousarray(vectors).tobytes())
+            id_lines = []
+            offset = segment["meta_bytes"]
+            for doc_id, metadata in zip(ids, metadatas):
+                line = (json.dumps(metadata, ensure_ascii=False) + "\n").encode("utf-8")
+                files[".meta.jsonl"].write(line)
+                id_lines.append((json.dumps([doc_id, metadata.get("doc_id"), offset, len(line)],
+                                            ensure_ascii=False) + "\n").encode("utf-8"))
+                self.ids.append(doc_id)
+                self.doc_ids.append(metadata.get("doc_id"))
+                self.meta_refs.append((segment["name"], offset, len(line)))
+                offset += len(line)
+            files[".ids.jsonl"].write(b"".join(id_lines))
+            for handle in files.values():
+                handle.flush()
+                os.fsync(handle.fileno())
+        finally:
+            for handle in files.values():
+                handle.close()
+        segment["rows"] += len(ids)
+        segment["meta_bytes"] = offset
+        segment["ids_bytes"] += sum(len(line) for line in id_lines)
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        self._loaded[segment["name"]] = (segment["rows"], segment["ids_bytes"])
+
+    def delete(self, labels):
+        """
+        Tombstone rows by label.
+        """
+        with self._write_lock, self._lock:
+            generation = self.generation
+            self.reload()
+            if self.generation != generation:
+                raise RuntimeError("向量存储已被其他进程压缩，请重新加载后再删除")
+            labels = [label for label in labels if self.alive[label]]
+            if not labels:
+                return
+            segments = [(segment["name"], segment["rows"]) for segment in self.segments]
+            lines = []
+            for label in labels:
+                base = 0
+                for name, rows in segments:
+                    if label < base + rows:
+                        lines.append(f"{name} {label - base}\n")
+                        break
+                    base += rows
+                self.alive[label] = False
+                self.tombstones.append(label)
+            with open(self._path(self.tombstone_file), "ab") as f:
+                f.truncate(self.tombstone_bytes)
+                data = "".join(lines).encode("utf-8")
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.tombstone_bytes += len(data)
+            self._write_manifest()
+
+    def _segment_map(self, segment):
+        name, rows = segment["name"], segment["rows"]
+        cached = self._maps.get(name)
+        if cached is None or cached[0] != rows:
+            matrix = np.memmap(self._path(name + ".f16"), dtype=VECTOR_DTYPE, mode="r", shape=(rows, self.dim))
+            cached = self._maps[name] = (rows, matrix)
+        return cached[1]
+
+    def iter_blocks(self, block_rows=SEARCH_BLOCK_ROWS):
+        """
+        Yield (first label, float16 memmap view) blocks covering every committed row.
+        """
+        base = 0
+        for segment in list(self.segments):
+            if segment["rows"]:
+                matrix = self._segment_map(segment)
+                for start in range(0, segment["rows"], block_rows):
+                    yield base + start, matrix[start:start + block_rows]
+            base += segment["rows"]
+
+    def vectors(self, labels):
+        """
+        Return float32 vectors for the given labels.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        out = np.empty((len(labels), self.dim), dtype=np.float32)
+        base = 0
+        for segment in list(self.segments):
+            mask = (labels >= base) & (labels < base + segment["rows"])
+            if mask.any():
+                out[mask] = self._segment_map(segment)[labels[mask] - base]
+            base += segment["rows"]
+        return out
+
+    def search(self, query, k):
+        """
+        Exact inner-product search over the live rows, block by block.
+
+        :return: (labels, scores), best first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        best_labels, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        alive = self.alive
+        for start, block in self.iter_blocks():
+            scores = block.astype(np.float32) @ query
+            scores[~alive[start:start + len(block)]] = -np.inf
+            take = min(k, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_labels = np.concatenate([best_labels, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+        keep = np.isfinite(best_scores)
+        best_labels, best_scores = best_labels[keep], best_scores[keep]
+        order = np.argsort(-best_scores)[:k]
+        return best_labels[order], best_scores[order]
+
+    def metadata(self, label):
+        """
+        Read one row's metadata from its sidecar.
+        """
+        name, offset, length = self.meta_refs[label]
+        with self._lock:
+            handle = self._meta_files.get(name)
+            if handle is None:
+                handle = self._meta_files[name] = open(self._path(name + ".meta.jsonl"), "rb")
+            handle.seek(offset)
+            return json.loads(handle.read(length))
+
+    def compact(self):
+        """
+        Rewrite the live rows into new segments, drop tombstones and delete the old files.
+
+        Bumps ``generation``, so every label changes. The new segments are
+        written and the manifest swapped before anything old is removed, so a
+        crash midway leaves the previous generation, tombstones included, intact.
+        """
+        with self._write_lock, self._lock:
+            self.reload()
+            live = np.flatnonzero(self.alive)
+            ids = [self.ids[label] for label in live]
+            metadatas = [self.metadata(label) for label in live]
+            vectors = self.vectors(live) if len(live) else np.zeros((0, self.dim or 0), dtype=np.float32)
+            dim, next_segment, version = self.dim, self.next_segment, self.version
+            generation, previous_log = self.generation + 1, self.tombstone_file
+            self._reset()
+            self.dim, self.next_segment, self.version, self.generation = dim, next_segment, version, generation
+            self.tombstone_file = tombstone_log(generation)
+            # 新一代的删除日志从空文件开始；旧日志仍属于旧 manifest，换完 manifest 前不动它
+            with open(self._path(self.tombstone_file), "wb"):
+                pass
+            for start in range(0, len(ids), SEGMENT_ROWS):
+                segment = {"name": f"seg-{self.next_segment:06d}", "rows": 0, "ids_bytes": 0, "meta_bytes": 0}
+                self.next_segment += 1
+                self.segments.append(segment)
+                end = start + SEGMENT_ROWS
+                self._append_to(segment, ids[start:end], np.asarray(vectors[start:end], dtype=VECTOR_DTYPE),
+                                metadatas[start:end])
+            self._write_manifest()
+            current = {segment["name"] for segment in self.segments}
+            # 上一代的删除日志保留到下次压缩，仍停留在旧 manifest 上的读者还能读到它
+            logs = {self.tombstone_file, previous_log}
+            for filename in os.listdir(self.directory):
+                # 删除旧分段与更早的删除日志；Windows 下仍被映射的文件无法删除，留待下次压缩
+                if (filename.startswith("seg-") and filename.split(".")[0] not in current
+                        or filename.startswith("tombstones.") and filename.endswith(".log") and filename not in logs):
+                    try:
+                        os.remove(self._path(filename))
+                    except OSError:
+                        pass
@@ -0,0 +1,58 @@
+import os
+import time
+
+import streamlit as st
+
+# 刷新阈值（环境变量）：距上次刷新超过该秒数，或累计新增字符数达到阈值时才推送到页面
+FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.1"))
+FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "200"))
+
+
+def render_stream(stream, placeholder=None, method="write", flush_interval=None, flush_chars=None):
+    """
+    Render a stream of text chunks into a Streamlit placeholder, coalescing updates.
+
+    Chunks are buffered in a list and the placeholder is only re-rendered when
+    ``flush_interval`` seconds have passed or ``flush_chars`` new characters
+    have arrived, plus once at the end, instead of once per token.
+
+    :param stream: A ChatStream, or any iterable of text chunks. A generator may
+        return the usage dict as its return value.
+    :param placeholder: The element to render into, defaults to a new st.empty().
+    :param method: The placeholder method used to render, "write" or "markdown".
+    :param flush_interval: Seconds between UI updates, defaults to STREAM_FLUSH_INTERVAL.
+    :param flush_chars: New characters that force an update, defaults to STREAM_FLUSH_CHARS.
+    :return: (text, usage) where usage is the token usage dict or None.
+    """
+    flush_interval = FLUSH_INTERVAL if flush_interval is None else flush_interval
+    flush_chars = FLUSH_CHARS if flush_chars is None else flush_chars
+    if placeholder is None:
+        placeholder = st.empty()
+    render = getattr(placeholder, method)
+
+    parts = []
+    pending = 0
+    last_flush = time.monotonic()
+    usage = None
+    iterator = iter(stream)
+    while True:
+        try:
+            piece = next(iterator)
+        except StopIteration as stop:
+            usage = stop.value
+            break
+        parts.append(piece)
+        pending += len(piece)
+        now = time.monotonic()
+        if pending >= flush_chars or now - last_flush >= flush_interval:
+            parts = ["".join(parts)]
+            render(parts[0])
+            pending = 0
+            last_flush = now
+
+    text = "".join(parts)
+    if pending or not text:
+        render(text)
+    if usage is None:
+        usage = getattr(stream, "usage", None)
+    return text, usage
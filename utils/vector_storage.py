@@ -1,50 +1,42 @@
-import pinecone
-from models.database import Session
-from models.project_models import ConversationHistory
-from utils.embeddings import EmbeddingGenerator
-import threading
+import logging
 
-# Initialize Pinecone
-pinecone.init(api_key='YOUR_PINECONE_API_KEY', environment='YOUR_PINECONE_ENVIRONMENT')
+from models.database import SessionLocal
+from modules.rag_system import apply_chunks, get_rag_index, load_document_chunks
+from utils.ingestion import IngestionQueueFull, get_ingestion_queue
 
-# Connect to your Pinecone index
-index = pinecone.Index("YOUR_PINECONE_INDEX_NAME")
-
-# Initialize the EmbeddingGenerator
-embedding_generator = EmbeddingGenerator()
+logger = logging.getLogger(__name__)
 
 def chunk_and_embed_conversation(conversation_id):
     """
-    Chunk the conversation text, generate embeddings, and save them to Pinecone.
+    Chunk a topic's conversation history, generate embeddings, and save them to the local RAG index.
     """
-    session = Session()
-    conversation = session.query(ConversationHistory).get(conversation_id)
-    
-    # Chunk the conversation text if necessary
-    chunks = [conversation.content[i:i+100] for i in range(0, len(conversation.content), 100)]
-    
-    # Generate embeddings for each chunk
-    embeddings = embedding_generator.generate_embeddings(chunks)
-    
-    # Prepare the vectors to upsert into Pinecone
-    vectors = [
-        {
-            "id": f"{conversation_id}_{i}", 
-            "values": embeddings[i], 
-            "metadata": {"content": chunk}
-        }
-        for i, chunk in enumerate(chunks)
-    ]
-    
-    # Upsert the vectors into Pinecone
-    index.upsert(vectors=vectors, namespace="ns1")
-    
-    session.close()
+    doc_id = f"conversation:{conversation_id}"
+    session = SessionLocal()
+    try:
+        chunks = load_document_chunks(session, doc_id)
+    finally:
+        session.close()
+
+    # Replace the conversation's previous chunks in the index
+    index = get_rag_index()
+    apply_chunks(index, [(doc_id, chunks)])
+    index.save()
 
 def save_to_vector_db(conversation_id):
     """
     Save the conversation to the vector database asynchronously.
+
+    The conversation is handed to the shared ingestion queue, so bursts of
+    saves are batched by a fixed pool of workers instead of one thread each.
+    A full queue is logged rather than raised, so saving a conversation never
+    fails because indexing is behind.
+
+    :param conversation_id: The id of the NursingTopic row whose messages were saved.
+    :return: Whether the conversation was scheduled for indexing.
     """
-    # Run the chunk and embed process in a separate thread
-    thread = threading.Thread(target=chunk_and_embed_conversation, args=(conversation_id,))
-    thread.start()
\ No newline at end of file
+    try:
+        get_ingestion_queue().enqueue(f"conversation:{conversation_id}")
+        return True
+    except IngestionQueueFull as e:
+        logger.warning(f"{e}，本次对话暂不写入向量库")
+        return False